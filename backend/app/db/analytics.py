@@ -0,0 +1,301 @@
+"""
+Optional local analytics engine. When `ANALYTICS_URL` is set (e.g. `duckdb:///analytics`), every table loaded with
+`add_csv_to_database` or `cloud/set_default_table.py` is also written as a Parquet snapshot in that directory, and
+agent queries that only read snapshotted tables run on an embedded DuckDB instead of the main database. Analytical
+GROUP BYs then run on a local columnar engine, with no network round trip. Queries DuckDB cannot run (e.g. SQL
+functions specific to the main database) fall back to the main database.
+
+The DuckDB connection that runs agent queries cannot read any file outside the snapshot directory, and its
+configuration is locked. Snapshots are only refreshed when a table is loaded through this application (or
+`cloud/set_default_table.py --refresh-rollups` runs), so writes made to the main database by anything else are not
+seen by the analytics engine. Snapshots older than `ANALYTICS_SNAPSHOT_MAX_AGE_SECONDS` are therefore not used, and
+queries on them run on the main database until the snapshot is refreshed.
+
+DuckDB is an optional dependency (`pip install duckdb`). Without it, or without `ANALYTICS_URL`, this module does
+nothing.
+"""
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from typing import Dict, Iterable, List, Optional
+from dotenv import load_dotenv
+import logging
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler("logs/database_operations.log"),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+ANALYTICS_URL = os.getenv("ANALYTICS_URL")
+# 0 disables the age check
+ANALYTICS_SNAPSHOT_MAX_AGE_SECONDS = float(os.getenv("ANALYTICS_SNAPSHOT_MAX_AGE_SECONDS", "86400"))
+# Snapshots written by other processes (e.g. cloud/set_default_table.py) are picked up at this interval
+SNAPSHOT_RESCAN_SECONDS = 60
+
+TABLE_NAME_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+_connection = None
+_snapshots: Dict[str, float] = {}  # Table name -> time its snapshot was written
+_scanned_at = 0.0
+_lock = threading.Lock()
+
+
+def get_snapshot_dir() -> Optional[str]:
+    """Get the snapshot directory configured by ANALYTICS_URL, or None if the analytics engine is disabled"""
+    if not ANALYTICS_URL:
+        return None
+    if not ANALYTICS_URL.startswith("duckdb:///"):
+        logger.warning(f"Unsupported ANALYTICS_URL (expected duckdb:///<directory>): {ANALYTICS_URL}")
+        return None
+    if duckdb is None:
+        logger.warning("ANALYTICS_URL is set but duckdb is not installed, the analytics engine is disabled.")
+        return None
+    return ANALYTICS_URL[len("duckdb:///"):] or "."
+
+
+def is_enabled() -> bool:
+    return get_snapshot_dir() is not None
+
+
+def _snapshot_path(table_name: str) -> Optional[str]:
+    # Table names come from uploads, only plain identifiers are used as directory names
+    if not TABLE_NAME_PATTERN.match(table_name):
+        return None
+    return os.path.join(get_snapshot_dir(), table_name.lower())
+
+
+def _quote(value: str, quote: str) -> str:
+    return quote + value.replace(quote, quote * 2) + quote
+
+
+def _get_connection():
+    """
+    Get the shared DuckDB connection, with one view per snapshot (must be called with the lock held). Agent queries
+    run on it, so it can only read the snapshot directory and its configuration cannot be changed.
+    """
+    global _connection
+    if _connection is None:
+        snapshot_dir = os.path.abspath(get_snapshot_dir())
+        os.makedirs(snapshot_dir, exist_ok=True)
+        connection = duckdb.connect()
+        connection.execute(f"SET allowed_directories = [{_quote(os.path.join(snapshot_dir, ''), chr(39))}]")
+        connection.execute("SET enable_external_access = false")
+        connection.execute("SET lock_configuration = true")
+        _connection = connection
+        _scan_snapshots()
+    return _connection
+
+
+def _scan_snapshots() -> None:
+    """Sync the views and the snapshot list with the snapshot directory (must be called with the lock held)"""
+    global _scanned_at
+    snapshot_dir = get_snapshot_dir()
+    found = {}
+    for name in os.listdir(snapshot_dir):
+        path = os.path.join(snapshot_dir, name)
+        if TABLE_NAME_PATTERN.match(name) and os.path.isdir(path):
+            found[name.lower()] = os.path.getmtime(path)
+    for name in set(_snapshots) - set(found):
+        _connection.execute(f"DROP VIEW IF EXISTS {_quote(name, chr(34))}")
+        del _snapshots[name]
+    for name, written_at in found.items():
+        if name not in _snapshots:
+            _create_view(_connection, name)
+        _snapshots[name] = written_at
+    _scanned_at = time.monotonic()
+
+
+def _create_view(connection, table_name: str) -> None:
+    files = os.path.join(os.path.abspath(_snapshot_path(table_name)), "*.parquet")
+    connection.execute(
+        f"CREATE OR REPLACE VIEW {_quote(table_name.lower(), chr(34))} AS "
+        f"SELECT * FROM read_parquet({_quote(files, chr(39))}, union_by_name = true)"
+    )
+    _snapshots[table_name.lower()] = time.time()
+
+
+def list_snapshots() -> List[str]:
+    """Get the names of the tables with a Parquet snapshot"""
+    if not is_enabled():
+        return []
+    with _lock:
+        _get_connection()
+        if time.monotonic() - _scanned_at > SNAPSHOT_RESCAN_SECONDS:
+            _scan_snapshots()
+        return sorted(_snapshots)
+
+
+def has_snapshots(table_names: Iterable[str]) -> bool:
+    """
+    Check if every table has a snapshot that is recent enough (see ANALYTICS_SNAPSHOT_MAX_AGE_SECONDS), so a query
+    reading them can run on the analytics engine. The snapshot list is cached, the snapshot directory is only read
+    again every SNAPSHOT_RESCAN_SECONDS.
+    """
+    table_names = set(table_names)
+    if not table_names or not table_names.issubset(list_snapshots()):
+        return False
+    if ANALYTICS_SNAPSHOT_MAX_AGE_SECONDS <= 0:
+        return True
+    oldest = min(_snapshots.get(name, 0.0) for name in table_names)
+    return time.time() - oldest < ANALYTICS_SNAPSHOT_MAX_AGE_SECONDS
+
+
+def remove_snapshot(table_name: str) -> None:
+    """Remove the snapshot of a table (e.g. when it could not be refreshed), so queries use the main database"""
+    path = _snapshot_path(table_name) if is_enabled() else None
+    if path is None:
+        return
+    with _lock:
+        _get_connection().execute(f"DROP VIEW IF EXISTS {_quote(table_name.lower(), chr(34))}")
+        _snapshots.pop(table_name.lower(), None)
+        shutil.rmtree(path, ignore_errors=True)
+
+
+class SnapshotWriter:
+    """
+    Writes the Parquet snapshot of a table chunk by chunk (one file per chunk, so memory use is bounded). The files
+    are written to a temporary directory that replaces the previous snapshot on `commit`.
+    """
+
+    def __init__(self, table_name: str):
+        self.table_name = table_name
+        self.path = _snapshot_path(table_name)
+        self.temp_path = f"{self.path}.tmp-{uuid.uuid4().hex}"
+        self.connection = duckdb.connect()
+        self.parts = 0
+        os.makedirs(self.temp_path)
+
+    def write(self, df) -> None:
+        """Write a chunk of the table (a pandas DataFrame)"""
+        part_path = os.path.join(self.temp_path, f"part-{self.parts:05d}.parquet")
+        self.connection.register("chunk", df)
+        try:
+            self.connection.execute(f"COPY chunk TO {_quote(part_path, chr(39))} (FORMAT PARQUET)")
+        finally:
+            self.connection.unregister("chunk")
+        self.parts += 1
+
+    def commit(self) -> None:
+        """Replace the previous snapshot of the table with the written chunks"""
+        self.connection.close()
+        old_path = f"{self.path}.old-{uuid.uuid4().hex}"
+        with _lock:
+            if os.path.exists(self.path):
+                os.rename(self.path, old_path)
+            os.rename(self.temp_path, self.path)
+            _create_view(_get_connection(), self.table_name)
+        shutil.rmtree(old_path, ignore_errors=True)
+        logger.info(f"Wrote Parquet snapshot of {self.table_name} ({self.parts} files)")
+
+    def abort(self) -> None:
+        """Discard the written chunks"""
+        self.connection.close()
+        shutil.rmtree(self.temp_path, ignore_errors=True)
+
+
+def create_snapshot_writer(table_name: str) -> Optional[SnapshotWriter]:
+    """Create a snapshot writer for a table, or None if the analytics engine is disabled or the name is not valid"""
+    if not is_enabled():
+        return None
+    if _snapshot_path(table_name) is None:
+        logger.warning(f"Table name {table_name!r} cannot be used for a snapshot, it will only be in the main database")
+        return None
+    return SnapshotWriter(table_name)
+
+
+def write_snapshot(table_name: str, frames: Iterable) -> None:
+    """Write the snapshot of a table from DataFrames. Errors are logged, and the stale snapshot is removed."""
+    writer = create_snapshot_writer(table_name)
+    if writer is None:
+        return
+    try:
+        for df in frames:
+            writer.write(df)
+        writer.commit()
+    except Exception as e:
+        writer.abort()
+        logger.error(f"Error writing the snapshot of {table_name}: {e}")
+        remove_snapshot(table_name)
+
+
+def _repair_views() -> None:
+    """
+    Recreate the missing views of the listed snapshots, and forget the snapshots whose files are gone (must be called
+    with the lock held). A view can go missing if something dropped it from the shared connection.
+    """
+    views = {row[0].lower() for row in _connection.execute(
+        "SELECT view_name FROM duckdb_views() WHERE NOT internal"
+    ).fetchall()}
+    for name in set(_snapshots) - views:
+        if os.path.isdir(_snapshot_path(name)):
+            written_at = _snapshots[name]
+            _create_view(_connection, name)
+            _snapshots[name] = written_at
+            logger.warning(f"Recreated the missing analytics view of {name}")
+        else:
+            del _snapshots[name]
+            logger.warning(f"Snapshot of {name} is gone, its queries will use the main database")
+
+
+def fetch(sql_query: str, max_rows: int, batch_size: int) -> Dict:
+    """
+    Run a single read statement on the analytics engine and fetch at most `max_rows` rows, in batches. Queries with
+    several statements, or a statement other than a SELECT, are refused with a ValueError. DuckDB errors are raised,
+    after the missing views are recreated if the query failed on one of them.
+
+    Returns:
+        A dictionary with the result "columns", the fetched "rows" (tuples), "total_rows" and "complete"
+    """
+    with _lock:
+        connection = _get_connection()
+        statements = connection.extract_statements(sql_query)
+        cursor = connection.cursor()
+    if len(statements) != 1 or statements[0].type != duckdb.StatementType.SELECT:
+        cursor.close()
+        raise ValueError("Only a single SELECT statement can run on the analytics engine.")
+    statement = statements[0]
+
+    try:
+        try:
+            cursor.execute(statement)
+        except duckdb.CatalogException:
+            with _lock:
+                _repair_views()
+            raise
+        columns = [column[0] for column in cursor.description]
+
+        rows = []
+        complete = True
+        while True:
+            batch = cursor.fetchmany(min(batch_size, max_rows + 1 - len(rows)))
+            if not batch:
+                break
+            rows.extend(batch)
+            if len(rows) > max_rows:
+                complete = False
+                rows = rows[:max_rows]
+                break
+
+        total_rows = len(rows)
+        if not complete:
+            # The new line ends a trailing "--" comment of the query
+            query = statement.query.rstrip().rstrip(";")
+            total_rows = cursor.execute(f"SELECT COUNT(*) FROM ({query}\n) AS query_rows").fetchone()[0]
+        return {"columns": columns, "rows": rows, "total_rows": total_rows, "complete": complete}
+    finally:
+        cursor.close()
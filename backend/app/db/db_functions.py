@@ -1,14 +1,24 @@
 """
 File for database operations. So far, it only contains a function to add a CSV file as a new table in the database.
 """
+import codecs
+import csv
+import io
+import time
 import pandas as pd
 import os
-from sqlalchemy import create_engine
-from sqlalchemy.exc import SQLAlchemyError
-from io import StringIO
+from sqlalchemy import inspect
+from sqlalchemy.exc import DataError, SQLAlchemyError
 from dotenv import load_dotenv
 import logging
 
+from backend.app.db.engine import get_engine
+from backend.app.db.table_versions import bump_table_version
+from backend.app.db import analytics
+from backend.app.db.schema_inference import (
+    SchemaMismatchError, infer_schema, create_table, coerce_chunk, describe_schema
+)
+
 
 logging.basicConfig(
     level=logging.INFO,
@@ -23,43 +33,213 @@ logger = logging.getLogger(__name__)
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///app.db")
 
-def add_csv_to_database(table_name, file_bytes):
+CSV_CHUNK_ROWS = int(os.getenv("CSV_CHUNK_ROWS", "50000"))  # Rows parsed and written at a time
+CSV_SAMPLE_BYTES = 64 * 1024  # Bytes read to detect the file encoding
+CSV_INFER_TYPES = os.getenv("CSV_INFER_TYPES", "true").lower() == "true"  # Narrow column types inferred from a sample
+
+def copy_insert(table, conn, keys, data_iter):
+    """
+    pandas `to_sql` insertion method for PostgreSQL. The rows are sent as CSV through `COPY ... FROM STDIN` on the raw
+    psycopg2 connection, which is much faster than INSERT statements for large tables.
     """
-    Add a CSV file as a new table in the database.
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(data_iter)
+    buffer.seek(0)
+
+    columns = ", ".join(_quote_identifier(key) for key in keys)
+    table_name = _quote_identifier(table.name)
+    if table.schema:
+        table_name = f"{_quote_identifier(table.schema)}.{table_name}"
+
+    with conn.connection.cursor() as cursor:
+        cursor.copy_expert(f"COPY {table_name} ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def _insert_method(conn):
+    """
+    The pandas `to_sql` insertion method for a connection: `copy_insert` with the psycopg2 driver, whose cursors have
+    `copy_expert`, and the default executemany with other drivers (psycopg 3, pg8000, SQLite...).
+    """
+    if conn.dialect.name == "postgresql" and conn.dialect.driver == "psycopg2":
+        return copy_insert
+    return None
+
+
+def _quote_identifier(name: str) -> str:
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def write_dataframe(df, table_name, conn, if_exists="append"):
+    """
+    Write a DataFrame to a table with the fastest method available for the database: COPY on PostgreSQL (with
+    psycopg2) and executemany otherwise. The throughput is logged in rows/s.
 
     Args:
-        table_name (str): Name of the table to create.
-        file_bytes (bytes): CSV file content.
+        df (pd.DataFrame): Rows to write.
+        table_name (str): Name of the table.
+        conn: SQLAlchemy connection (or engine) to write with.
+        if_exists (str): "replace" to recreate the table, "append" to add to it (as in `DataFrame.to_sql`).
     Returns:
-        dict: {"success": bool, "message": str}
+        int: Number of written rows.
+    """
+    method = _insert_method(conn)
+
+    started_at = time.perf_counter()
+    df.to_sql(
+        name=table_name,
+        con=conn,
+        if_exists=if_exists,
+        index=False,
+        method=method
+    )
+    elapsed = time.perf_counter() - started_at
+    logger.info(
+        f"Wrote {len(df)} rows into {table_name} in {elapsed:.2f}s "
+        f"({len(df) / max(elapsed, 1e-6):.0f} rows/s, {'COPY' if method else 'executemany'})"
+    )
+    return len(df)
+
+
+def detect_encoding(sample: bytes) -> str:
+    """
+    Detect the encoding of a CSV file from a sample of its first bytes. UTF-8 (with or without BOM) is used when the
+    sample decodes as UTF-8, latin1 (which accepts any byte) otherwise.
     """
+    if sample.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
     try:
-        engine = create_engine(DATABASE_URL)
-        
-        # Trying different encodings to read the CSV file
+        # Incremental decoding, so a multi-byte character cut at the end of the sample is not an error
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        return "latin1"
+
+
+def _load_csv_chunks(engine, table_name: str, file, encoding: str, infer_types: bool, progress_callback=None):
+    """
+    Parse a CSV file in chunks of CSV_CHUNK_ROWS rows and write each chunk as it is read, in a single transaction
+    (the table is only replaced if the whole file loads). With `infer_types`, the column types are inferred from the
+    first chunk and the table is created with them before loading. After each chunk, `progress_callback` (if any) is
+    called with the number of rows loaded and of bytes read so far. When the analytics engine is enabled, each chunk
+    is also written to the table's Parquet snapshot, which replaces the previous one once the transaction commits.
+
+    Returns:
+        Tuple of (number of loaded rows, inferred schema or None)
+    """
+    file.seek(0)
+    # The wrapper is detached afterwards so closing it does not close the underlying file
+    text_stream = io.TextIOWrapper(file, encoding=encoding, newline="")
+    rows = 0
+    schema = None
+    snapshot = analytics.create_snapshot_writer(table_name)
+    try:
+        with engine.begin() as conn:
+            for i, chunk in enumerate(pd.read_csv(text_stream, chunksize=CSV_CHUNK_ROWS)):
+                if i == 0 and infer_types:
+                    schema = infer_schema(chunk)
+                    create_table(conn, table_name, schema)
+                if schema:
+                    chunk = coerce_chunk(chunk, schema)
+
+                # Without an inferred schema, the first chunk replaces the table if it exists (with the pandas default
+                # types). The next chunks are appended to it.
+                if_exists = "append" if schema or i > 0 else "replace"
+                rows += write_dataframe(chunk, table_name, conn, if_exists=if_exists)
+                snapshot = _write_snapshot_chunk(snapshot, table_name, chunk)
+                logger.info(f"Loaded {rows} rows into {table_name}")
+                if progress_callback:
+                    progress_callback(rows, file.tell())
+    except BaseException:
+        if snapshot:
+            snapshot.abort()
+        raise
+    finally:
+        text_stream.detach()
+
+    if snapshot:
         try:
-            df = pd.read_csv(StringIO(file_bytes.decode("utf-8")))
-        except UnicodeDecodeError:
-            logger.warning("UTF-8 decoding failed, trying latin1 encoding.")
-            df = pd.read_csv(StringIO(file_bytes.decode("latin1")))
+            snapshot.commit()
         except Exception as e:
+            logger.error(f"Error saving the snapshot of {table_name}: {e}")
+            snapshot.abort()
+            analytics.remove_snapshot(table_name)
+    return rows, schema
+
+
+def _write_snapshot_chunk(snapshot, table_name: str, chunk: pd.DataFrame):
+    """
+    Write a chunk to the analytics snapshot of a table. A snapshot error does not stop the load: the snapshot is
+    dropped, so queries on the table use the main database. Returns the writer, or None once it was dropped.
+    """
+    if snapshot is None:
+        return None
+    try:
+        snapshot.write(chunk)
+        return snapshot
+    except Exception as e:
+        logger.error(f"Error writing the snapshot of {table_name}, it will only be queried in the database: {e}")
+        snapshot.abort()
+        analytics.remove_snapshot(table_name)
+        return None
+
+
+def add_csv_to_database(table_name, file, progress_callback=None):
+    """
+    Add a CSV file as a new table in the database. The file is streamed: it is decoded and parsed in chunks, and each
+    chunk is written as it is read, so memory use does not depend on the file size. The column types are inferred
+    from the first chunk (see `schema_inference`). If a later chunk does not fit them, the file is loaded again with
+    the pandas default types.
+
+    Args:
+        table_name (str): Name of the table to create.
+        file (bytes | BinaryIO): CSV file content, or a seekable binary file object with it (e.g. an upload).
+        progress_callback (callable, optional): Called after each chunk with (rows loaded, bytes read).
+    Returns:
+        dict: {"success": bool, "message": str} (and, on success, "rows", the number of loaded rows, and "schema",
+        the name, SQL type, nullability and categories of each column)
+    """
+    if isinstance(file, (bytes, bytearray)):
+        file = io.BytesIO(file)
+
+    try:
+        engine = get_engine(DATABASE_URL)
+        encoding = detect_encoding(file.read(CSV_SAMPLE_BYTES))
+        infer_types = CSV_INFER_TYPES
+
+        try:
+            # Each failed attempt is rolled back, so the file is loaded again from the start
+            while True:
+                try:
+                    rows, schema = _load_csv_chunks(engine, table_name, file, encoding, infer_types, progress_callback)
+                    break
+                except UnicodeDecodeError:
+                    if encoding == "latin1":
+                        raise
+                    # The sample decoded as UTF-8 but a later part of the file did not
+                    logger.warning("UTF-8 decoding failed, trying latin1 encoding.")
+                    encoding = "latin1"
+                except (SchemaMismatchError, DataError) as e:
+                    if not infer_types:
+                        raise
+                    logger.warning(f"Inferred column types do not fit the whole file, using default types: {e}")
+                    infer_types = False
+        except (pd.errors.ParserError, pd.errors.EmptyDataError) as e:
             logger.error(f"Error reading CSV file: {str(e)}")
             return {"success": False, "message": f"Error reading CSV file: {str(e)}"}
+        finally:
+            # Even a failed load may have dropped the old table, so cached query results are invalidated either way
+            bump_table_version(table_name)
+
+        if schema:
+            schema = describe_schema(schema, engine.dialect)
+        else:
+            schema = [
+                {"name": column["name"], "type": str(column["type"]), "nullable": column["nullable"], "categories": None}
+                for column in inspect(engine).get_columns(table_name)
+            ]
+        logger.info(f"Added {rows} records to {table_name} (encoding: {encoding}, schema: {schema})")
 
-        # Turning the Pandas DataFrame into a SQL table. 
-        # If a table with the same name exists, it will be replaced.
-        # Using small chunks to avoid memory issues with large files on AWS RDS free tier.
-        df.to_sql(
-            name=table_name,
-            con=engine,
-            if_exists="replace",
-            index=False,
-            method="multi",
-            chunksize=200
-        )
-        logger.info(f"Added {len(df)} records to {table_name}")
-
-        return {"success": True, "message": f"Table '{table_name}' created successfully."}
+        return {"success": True, "message": f"Table '{table_name}' created successfully.", "rows": rows, "schema": schema}
     
     except SQLAlchemyError as e:
         return {"success": False, "message": f"Database error: {str(e)}"}
@@ -0,0 +1,160 @@
+"""
+Process-wide SQLAlchemy engine registry. Creating an engine per call means a fresh connection handshake
+for every query (expensive against AWS RDS over TLS), so every module asks this registry for a shared,
+pooled engine instead. Pool settings are read from environment variables.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Any
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.url import make_url
+from dotenv import load_dotenv
+import logging
+
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler("logs/database_operations.log"),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///app.db")
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+# Longest time an agent query may run on the database (0 disables the limit)
+DB_STATEMENT_TIMEOUT_SECONDS = float(os.getenv("DB_STATEMENT_TIMEOUT_SECONDS", "30"))
+
+_engines: Dict[str, Engine] = {}
+_lock = threading.Lock()
+
+
+def _pool_options(url: str) -> Dict[str, Any]:
+    """Build the pool keyword arguments for the given database URL."""
+    parsed = make_url(url)
+
+    # In-memory SQLite databases live inside a single connection, so a queue of connections makes no sense.
+    if parsed.get_backend_name() == "sqlite" and parsed.database in (None, "", ":memory:"):
+        return {}
+
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+def get_engine(url: Optional[str] = None) -> Engine:
+    """
+    Get the shared engine for a database URL, creating it on first use.
+
+    Args:
+        url: Database URL. Defaults to the DATABASE_URL environment variable.
+
+    Returns:
+        A pooled SQLAlchemy engine shared by the whole process.
+    """
+    url = url or DATABASE_URL
+    engine = _engines.get(url)
+    if engine is not None:
+        return engine
+
+    with _lock:
+        engine = _engines.get(url)
+        if engine is None:
+            engine = create_engine(url, **_pool_options(url))
+            _engines[url] = engine
+            logger.info(f"Created pooled engine for {engine.url.render_as_string(hide_password=True)}")
+    return engine
+
+
+@contextmanager
+def statement_timeout(conn, seconds: Optional[float] = None) -> Iterator[None]:
+    """
+    Stop the statements run on a connection inside this block after `seconds` (DB_STATEMENT_TIMEOUT_SECONDS by
+    default), on the database side: a slow query is cancelled instead of holding a worker thread and a pooled
+    connection after its caller gave up. Timed out statements raise an OperationalError.
+
+    PostgreSQL uses `SET LOCAL statement_timeout` (reset when the transaction ends), MySQL `max_execution_time` and
+    SQLite a progress handler. Other databases have no limit.
+    """
+    seconds = DB_STATEMENT_TIMEOUT_SECONDS if seconds is None else seconds
+    dialect = conn.dialect.name
+    if seconds <= 0 or dialect not in ("postgresql", "mysql", "sqlite"):
+        yield
+        return
+
+    milliseconds = max(1, int(seconds * 1000))
+    if dialect == "postgresql":
+        conn.exec_driver_sql(f"SET LOCAL statement_timeout = {milliseconds}")
+        yield
+        return
+    if dialect == "mysql":
+        conn.exec_driver_sql(f"SET SESSION max_execution_time = {milliseconds}")
+        try:
+            yield
+        finally:
+            conn.exec_driver_sql("SET SESSION max_execution_time = 0")
+        return
+
+    # SQLite calls the handler every N virtual machine instructions, a non-zero return value interrupts the statement
+    deadline = time.monotonic() + seconds
+    dbapi_connection = conn.connection.dbapi_connection
+    dbapi_connection.set_progress_handler(lambda: int(time.monotonic() > deadline), 10000)
+    try:
+        yield
+    finally:
+        dbapi_connection.set_progress_handler(None, 0)
+
+
+def read_only_transaction(conn) -> None:
+    """
+    Make the current transaction of a connection read-only on PostgreSQL (`SET TRANSACTION READ ONLY`), so a
+    statement that got past the SQL validator still cannot write. It must run before the first query of the
+    transaction. Other databases are left as they are.
+    """
+    if conn.dialect.name == "postgresql":
+        conn.exec_driver_sql("SET TRANSACTION READ ONLY")
+
+
+def dispose_engines() -> None:
+    """Close every pooled connection and forget all engines."""
+    with _lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
+
+
+def get_pool_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    Get connection pool statistics for every registered engine.
+
+    Returns:
+        Dictionary keyed by database URL (password hidden) with pool size, checked in/out and overflow counts.
+    """
+    stats = {}
+    for engine in list(_engines.values()):
+        pool = engine.pool
+        pool_stats = {"pool_class": type(pool).__name__, "status": pool.status()}
+
+        # Only QueuePool exposes counters, other pools (e.g. SingletonThreadPool) just report their status.
+        for counter in ("size", "checkedin", "checkedout", "overflow"):
+            if hasattr(pool, counter):
+                pool_stats[counter] = getattr(pool, counter)()
+
+        stats[engine.url.render_as_string(hide_password=True)] = pool_stats
+    return stats
@@ -0,0 +1,243 @@
+"""
+Index advisor. The columns used to filter, join, group and sort the queries run by the agent are counted per table
+(and written to `logs/query_workload.log`), and indexes are proposed for the columns that are used often and are not
+indexed yet: B-tree indexes, or BRIN indexes for date columns on PostgreSQL (small, and well suited to tables loaded
+in date order).
+
+The proposals are available at `GET /db/index_advisor` and can be created with `POST /db/index_advisor/apply`. This
+module can also be run as a command, which reads the workload log of every server process:
+    python -m backend.app.db.index_advisor [--apply] [--min-uses N]
+"""
+import json
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from dotenv import load_dotenv
+import logging
+from logging.handlers import RotatingFileHandler
+
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.types import Date, DateTime
+
+from backend.app.db.engine import get_engine
+from backend.app.db.sql_validator import validate_sql
+
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler("logs/database_operations.log"),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///app.db")
+INDEX_ADVISOR_MIN_USES = int(os.getenv("INDEX_ADVISOR_MIN_USES", "3"))
+# The workload log is rotated at this size, keeping this many old files (so at most ~40MB by default)
+INDEX_ADVISOR_LOG_MAX_BYTES = int(os.getenv("INDEX_ADVISOR_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+INDEX_ADVISOR_LOG_BACKUP_COUNT = int(os.getenv("INDEX_ADVISOR_LOG_BACKUP_COUNT", "3"))
+
+# One JSON line per column use, so the workload of every server process can be aggregated later
+WORKLOAD_LOG_PATH = "logs/query_workload.log"
+workload_logger = logging.getLogger(f"{__name__}.workload")
+workload_logger.propagate = False
+if not workload_logger.handlers:
+    _workload_handler = RotatingFileHandler(
+        WORKLOAD_LOG_PATH, maxBytes=INDEX_ADVISOR_LOG_MAX_BYTES, backupCount=INDEX_ADVISOR_LOG_BACKUP_COUNT
+    )
+    _workload_handler.setFormatter(logging.Formatter("%(message)s"))
+    workload_logger.addHandler(_workload_handler)
+
+CLAUSE_END = r"(?=\b(?:where|group\s+by|having|order\s+by|limit|offset|union|intersect|except|join|inner|left|right|full|cross|on)\b|\)|;|$)"
+
+_workload: Dict[Tuple[str, str], Counter] = defaultdict(Counter)
+_lock = threading.Lock()
+
+
+def _strip_literals(sql_query: str) -> str:
+    return re.sub(r"'(?:[^']|'')*'", "?", sql_query)
+
+
+def _table_aliases(sql_query: str) -> Dict[str, str]:
+    """Map the tables (and their aliases) read by a query to the table names. CTEs are left out."""
+    return dict(validate_sql(sql_query).aliases)
+
+
+def extract_workload(sql_query: str) -> List[Tuple[str, str, str]]:
+    """
+    Find the columns a query filters (WHERE), joins (ON), groups and sorts on.
+
+    Returns:
+        List of (table, column, usage) tuples. Unqualified columns of queries on several tables are attributed to
+        each of them; columns that do not exist are discarded when indexes are proposed.
+    """
+    sql = _strip_literals(sql_query).lower()
+    aliases = _table_aliases(sql)
+    tables = sorted(set(aliases.values()))
+    if not tables:
+        return []
+
+    found = []
+    comparison = r"([a-z_][\w.]*)\s*(?:=|<>|!=|<=|>=|<|>|\bin\b|\bbetween\b|\blike\b|\bilike\b|\bis\b|\bnot\b)"
+    for body in re.findall(r"\bwhere\b(.*?)" + CLAUSE_END, sql, re.DOTALL):
+        found.extend((column, "filter") for column in re.findall(comparison, body))
+    for body in re.findall(r"\bon\b(.*?)" + CLAUSE_END, sql, re.DOTALL):
+        # Both sides of a join condition are usually columns
+        joined = re.findall(comparison, body) + re.findall(r"(?:=|<>|!=)\s*([a-z_][\w.]*)", body)
+        found.extend((column, "join") for column in dict.fromkeys(joined))
+    for usage, clause in (("group_by", r"\bgroup\s+by\b"), ("order_by", r"\border\s+by\b")):
+        for body in re.findall(clause + r"(.*?)" + CLAUSE_END, sql, re.DOTALL):
+            for item in body.split(","):
+                match = re.fullmatch(r"\s*([a-z_][\w.]*)(?:\s+(?:asc|desc))?\s*", item)
+                if match:
+                    found.append((match.group(1), usage))
+
+    workload = []
+    for column, usage in found:
+        if column in ("and", "or", "not", "null"):
+            continue
+        if "." in column:
+            qualifier, column = column.rsplit(".", 1)
+            targets = [aliases[qualifier.split(".")[-1]]] if qualifier.split(".")[-1] in aliases else []
+        else:
+            targets = tables
+        workload.extend((table, column, usage) for table in targets)
+    return workload
+
+
+def record_query(sql_query: str) -> None:
+    """Count the columns used by a query and log them to the workload log"""
+    try:
+        workload = extract_workload(sql_query)
+    except Exception as e:
+        logger.warning(f"Could not analyze query for the index advisor: {e}")
+        return
+
+    with _lock:
+        for table, column, usage in workload:
+            _workload[(table, column)][usage] += 1
+    for table, column, usage in workload:
+        workload_logger.info(json.dumps({"table": table, "column": column, "usage": usage}))
+
+
+def load_workload_log(path: str = WORKLOAD_LOG_PATH) -> Dict[Tuple[str, str], Counter]:
+    """Rebuild the workload statistics from the workload log and its rotated files"""
+    workload: Dict[Tuple[str, str], Counter] = defaultdict(Counter)
+    paths = [path] + [f"{path}.{number}" for number in range(1, INDEX_ADVISOR_LOG_BACKUP_COUNT + 1)]
+    for log_path in paths:
+        if not os.path.exists(log_path):
+            continue
+        with open(log_path, encoding="utf-8") as log_file:
+            for line in log_file:
+                try:
+                    entry = json.loads(line)
+                    workload[(entry["table"], entry["column"])][entry["usage"]] += 1
+                except (ValueError, KeyError):
+                    continue
+    return workload
+
+
+def get_workload() -> List[Dict[str, Any]]:
+    """Get the column usage statistics of this process, most used first"""
+    with _lock:
+        items = [(key, dict(counter)) for key, counter in _workload.items()]
+    return sorted(
+        [{"table": table, "column": column, "uses": uses} for (table, column), uses in items],
+        key=lambda item: -sum(item["uses"].values())
+    )
+
+
+def propose_indexes(min_uses: Optional[int] = None, workload: Optional[Dict[Tuple[str, str], Counter]] = None,
+                    url: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Propose indexes for the columns used at least `min_uses` times that exist and are not the first column of an
+    existing index (or of the primary key).
+
+    Returns:
+        List of proposals with "table", "column", "method" ("btree" or "brin"), "uses" and the "sql" to create them,
+        most used first
+    """
+    min_uses = INDEX_ADVISOR_MIN_USES if min_uses is None else min_uses
+    if workload is None:
+        with _lock:
+            workload = {key: Counter(counter) for key, counter in _workload.items()}
+
+    engine = get_engine(url or DATABASE_URL)
+    inspector = inspect(engine)
+    existing_tables = {name.lower(): name for name in inspector.get_table_names()}
+
+    proposals = []
+    table_info = {}
+    for (table, column), uses in workload.items():
+        if sum(uses.values()) < min_uses or table not in existing_tables:
+            continue
+
+        table = existing_tables[table]
+        if table not in table_info:
+            columns = {col["name"].lower(): col for col in inspector.get_columns(table)}
+            indexed = {
+                index["column_names"][0].lower() for index in inspector.get_indexes(table)
+                if index["column_names"] and index["column_names"][0]
+            }
+            indexed.update(name.lower() for name in inspector.get_pk_constraint(table).get("constrained_columns", [])[:1])
+            table_info[table] = (columns, indexed)
+        columns, indexed = table_info[table]
+
+        if column not in columns or column in indexed:
+            continue
+
+        column_name = columns[column]["name"]
+        is_date = isinstance(columns[column]["type"], (Date, DateTime))
+        method = "brin" if is_date and engine.dialect.name == "postgresql" else "btree"
+        index_name = f"idx_{table.lower()}_{column}"
+        using = " USING BRIN" if method == "brin" else ""
+        proposals.append({
+            "table": table,
+            "column": column_name,
+            "method": method,
+            "uses": dict(uses),
+            "sql": f'CREATE INDEX IF NOT EXISTS "{index_name}" ON "{table}"{using} ("{column_name}")'
+        })
+
+    return sorted(proposals, key=lambda proposal: -sum(proposal["uses"].values()))
+
+
+def apply_indexes(proposals: Iterable[Dict[str, Any]], url: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Create the proposed indexes. Returns the proposals with a "created" flag and an "error" if one failed."""
+    engine = get_engine(url or DATABASE_URL)
+    results = []
+    for proposal in proposals:
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(proposal["sql"]))
+            logger.info(f"Created index: {proposal['sql']}")
+            results.append(dict(proposal, created=True, error=None))
+        except SQLAlchemyError as e:
+            logger.error(f"Error creating index on {proposal['table']}.{proposal['column']}: {e}")
+            results.append(dict(proposal, created=False, error=str(e)))
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Propose (and create) indexes from the logged query workload.")
+    parser.add_argument("--apply", action="store_true", help="Create the proposed indexes")
+    parser.add_argument("--min-uses", type=int, default=INDEX_ADVISOR_MIN_USES, help="Minimum uses of a column")
+    args = parser.parse_args()
+
+    index_proposals = propose_indexes(args.min_uses, workload=load_workload_log())
+    if not index_proposals:
+        print("No indexes to propose.")
+    for index_proposal in index_proposals:
+        print(f"{index_proposal['sql']}  -- uses: {index_proposal['uses']}")
+
+    if args.apply and index_proposals:
+        for index_result in apply_indexes(index_proposals):
+            print(f"{'Created' if index_result['created'] else 'Failed'}: {index_result['sql']}")
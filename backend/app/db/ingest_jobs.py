@@ -0,0 +1,150 @@
+"""
+Background CSV ingestion jobs. An upload is copied to a temporary file and loaded by a small pool of worker threads,
+so the upload request returns right away with a job ID. Clients poll the job for its progress (rows processed,
+throughput) and its outcome (including the inferred schema of the table).
+
+Jobs are kept in memory, so they are only visible from the server process that received the upload.
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, Optional
+from dotenv import load_dotenv
+import logging
+
+from backend.app.db.db_functions import add_csv_to_database
+
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler("logs/database_operations.log"),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+INGEST_MAX_WORKERS = int(os.getenv("INGEST_MAX_WORKERS", "2"))
+INGEST_MAX_JOBS = 100  # Most recent jobs kept for polling
+COPY_BUFFER_BYTES = 1024 * 1024
+
+_executor = ThreadPoolExecutor(max_workers=INGEST_MAX_WORKERS, thread_name_prefix="csv-ingest")
+_jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def _update_job(job_id: str, **fields) -> None:
+    with _lock:
+        if job_id in _jobs:
+            _jobs[job_id].update(fields)
+
+
+def _prune_jobs() -> None:
+    """Forget the oldest finished jobs beyond INGEST_MAX_JOBS (must be called with the lock held)"""
+    finished = [job_id for job_id, job in _jobs.items() if job["status"] in ("succeeded", "failed")]
+    for job_id in finished[:max(0, len(_jobs) - INGEST_MAX_JOBS)]:
+        del _jobs[job_id]
+
+
+def _run_job(job_id: str, table_name: str, temp_file) -> None:
+    """Load a CSV file into a table, reporting the progress in the job"""
+    started_at = time.monotonic()
+    _update_job(job_id, status="running", started_at=datetime.now())
+
+    def on_progress(rows: int, bytes_read: int) -> None:
+        elapsed = max(time.monotonic() - started_at, 1e-6)
+        with _lock:
+            job = _jobs.get(job_id)
+            if job:
+                job["rows_processed"] = rows
+                job["bytes_processed"] = bytes_read
+                job["progress"] = round(min(bytes_read / job["total_bytes"], 1.0), 4) if job["total_bytes"] else 0.0
+                job["rows_per_second"] = round(rows / elapsed, 1)
+
+    try:
+        result = add_csv_to_database(table_name, temp_file, progress_callback=on_progress)
+    except Exception as e:
+        result = {"success": False, "message": str(e)}
+    finally:
+        temp_file.close()
+
+    elapsed = max(time.monotonic() - started_at, 1e-6)
+    if result.get("success"):
+        rows = result.get("rows", 0)
+        _update_job(job_id, status="succeeded", message=result.get("message"), schema=result.get("schema"),
+                    rows_processed=rows,
+                    rows_per_second=round(rows / elapsed, 1), progress=1.0, finished_at=datetime.now())
+        logger.info(f"Ingestion job {job_id} loaded {rows} rows into {table_name} in {elapsed:.1f}s")
+    else:
+        _update_job(job_id, status="failed", error=result.get("message", "Unknown error."), finished_at=datetime.now())
+        logger.error(f"Ingestion job {job_id} for {table_name} failed: {result.get('message')}")
+
+
+def submit_csv_ingest(table_name: str, file) -> Dict[str, Any]:
+    """
+    Queue the ingestion of a CSV file into a table. The file is first copied to a temporary file (in blocks, so it is
+    never fully loaded in memory), since uploads are closed once the request finishes.
+
+    Args:
+        table_name: Name of the table to create (or replace)
+        file: Binary file object with the CSV content
+
+    Returns:
+        The status of the new job (see `get_job`)
+    """
+    temp_file = tempfile.TemporaryFile()
+    try:
+        shutil.copyfileobj(file, temp_file, COPY_BUFFER_BYTES)
+    except Exception:
+        temp_file.close()
+        raise
+
+    job_id = uuid.uuid4().hex
+    job = {
+        "job_id": job_id,
+        "table_name": table_name,
+        "status": "queued",
+        "rows_processed": 0,
+        "bytes_processed": 0,
+        "total_bytes": temp_file.tell(),
+        "progress": 0.0,
+        "rows_per_second": 0.0,
+        "message": None,
+        "error": None,
+        "schema": None,
+        "created_at": datetime.now(),
+        "started_at": None,
+        "finished_at": None,
+    }
+    with _lock:
+        _jobs[job_id] = job
+        _prune_jobs()
+
+    _executor.submit(_run_job, job_id, table_name, temp_file)
+    logger.info(f"Queued ingestion job {job_id} for table {table_name} ({job['total_bytes']} bytes)")
+    return get_job(job_id)
+
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """Get a copy of the status of an ingestion job, or None if it is unknown"""
+    with _lock:
+        job = _jobs.get(job_id)
+        return dict(job) if job else None
+
+
+if __name__ == "__main__":
+    import io
+
+    status = submit_csv_ingest("ingest_demo", io.BytesIO(b"col1,col2\n1,a\n2,b\n"))
+    while status["status"] in ("queued", "running"):
+        time.sleep(0.1)
+        status = get_job(status["job_id"])
+    print(status)
@@ -16,6 +16,7 @@ class GenerateRequest(BaseModel):
     top_p: float
     top_k: int
     session_id: Optional[str] = None
+    chart_format: Optional[str] = None  # "rows" or "columnar", defaults to the backend's CHART_DATA_FORMAT
 
 class GeminiRequest(BaseModel):
     prompt: str
@@ -25,6 +26,7 @@ class GeminiRequest(BaseModel):
     session_id: Optional[str] = None
 
 class ChatMessage(BaseModel):
+    id: Optional[int] = None
     role: str
     content: str
     timestamp: datetime = datetime.now()
@@ -34,6 +36,14 @@ class ChatSession(BaseModel):
     name: Optional[str] = None
     created_at: datetime = datetime.now()
     messages: List[ChatMessage] = []
+    message_count: Optional[int] = None
+    last_message_at: Optional[datetime] = None
+
+class ChatSummary(BaseModel):
+    session_id: str
+    summary: str
+    covered_until: datetime
+    covered_until_id: int
 
 class ChatSessionRequest(BaseModel):
     name: Optional[str] = None
\ No newline at end of file
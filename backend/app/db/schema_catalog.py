@@ -0,0 +1,187 @@
+"""
+Cached catalog of the database schema: tables, columns, types, row counts and the values of low-cardinality text
+columns. The database is introspected once and the result is reused by `list_tables`, the `describe_table` tool
+and the compact schema added to the system prompt, so the model knows the columns of every table (uploads
+included) without spending a tool round trip on it.
+
+Entries are invalidated when a table changes in this process (see `table_versions`), and expire after
+`SCHEMA_CATALOG_TTL_SECONDS` to pick up changes made by other processes.
+"""
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+import logging
+
+from sqlalchemy import inspect, text
+from sqlalchemy.types import String
+
+from backend.app.db.engine import get_engine
+from backend.app.db.schema_inference import CATEGORY_MAX_VALUES
+from backend.app.db.table_versions import get_database_version, get_table_version
+
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler("logs/database_operations.log"),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///app.db")
+SCHEMA_CATALOG_TTL_SECONDS = float(os.getenv("SCHEMA_CATALOG_TTL_SECONDS", "3600"))
+SCHEMA_PROMPT_MAX_CHARS = int(os.getenv("SCHEMA_PROMPT_MAX_CHARS", "4000"))
+
+# Tables used by the application itself, which are left out of the prompt
+INTERNAL_TABLES = {"chat_sessions", "chat_messages", "chat_summaries", "sqlite_sequence"}
+
+
+class SchemaCatalog:
+    """Introspected schema of one database, cached per table"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self._table_names: Optional[Tuple[List[str], int, float]] = None  # (names, database version, loaded at)
+        self._tables: Dict[str, Tuple[Dict[str, Any], int, float]] = {}  # name -> (description, version, loaded at)
+        self._lock = threading.Lock()
+
+    def _is_fresh(self, version: int, current_version: int, loaded_at: float) -> bool:
+        return version == current_version and time.monotonic() - loaded_at < SCHEMA_CATALOG_TTL_SECONDS
+
+    def table_names(self) -> List[str]:
+        """Get the names of the tables in the database. Database errors are raised."""
+        with self._lock:
+            if self._table_names and self._is_fresh(self._table_names[1], get_database_version(), self._table_names[2]):
+                return list(self._table_names[0])
+
+        version = get_database_version()
+        names = inspect(get_engine(self.url)).get_table_names()
+        with self._lock:
+            self._table_names = (names, version, time.monotonic())
+        return list(names)
+
+    def describe(self, table_name: str) -> Optional[Dict[str, Any]]:
+        """
+        Describe a table (see `_introspect_table`), or None if it does not exist. Table names are matched
+        case-insensitively. Database errors are raised.
+        """
+        names = {name.lower(): name for name in self.table_names()}
+        if table_name.lower() not in names:
+            return None
+        table_name = names[table_name.lower()]
+
+        with self._lock:
+            cached = self._tables.get(table_name)
+            if cached and self._is_fresh(cached[1], get_table_version(table_name), cached[2]):
+                return cached[0]
+
+        version = get_table_version(table_name)
+        description = self._introspect_table(table_name)
+        with self._lock:
+            self._tables[table_name] = (description, version, time.monotonic())
+        return description
+
+    def _introspect_table(self, table_name: str) -> Dict[str, Any]:
+        """
+        Returns:
+            Dictionary with the "table" name, its "row_count" and its "columns", each with a "name", its SQL "type",
+            "nullable" and "values" (the sorted distinct values of text columns with at most CATEGORY_MAX_VALUES of
+            them, otherwise None)
+        """
+        engine = get_engine(self.url)
+        quote = engine.dialect.identifier_preparer.quote
+        columns = []
+        with engine.connect() as conn:
+            row_count = conn.execute(text(f"SELECT COUNT(*) FROM {quote(table_name)}")).scalar()
+            for column in inspect(conn).get_columns(table_name):
+                try:
+                    sql_type = column["type"].compile(dialect=engine.dialect)
+                except Exception:
+                    sql_type = str(column["type"])
+
+                values = None
+                if isinstance(column["type"], String) and row_count:
+                    # One extra value is fetched to know if the column has too many of them
+                    distinct = conn.execute(text(
+                        f"SELECT DISTINCT {quote(column['name'])} FROM {quote(table_name)} "
+                        f"WHERE {quote(column['name'])} IS NOT NULL LIMIT {CATEGORY_MAX_VALUES + 1}"
+                    )).scalars().all()
+                    if len(distinct) <= CATEGORY_MAX_VALUES:
+                        values = sorted(str(value) for value in distinct)
+
+                columns.append({
+                    "name": column["name"],
+                    "type": sql_type,
+                    "nullable": column.get("nullable", True),
+                    "values": values
+                })
+
+        logger.info(f"Introspected table {table_name} ({len(columns)} columns, {row_count} rows)")
+        return {"table": table_name, "row_count": row_count, "columns": columns}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._table_names = None
+            self._tables.clear()
+
+
+_catalogs: Dict[str, SchemaCatalog] = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_catalog(url: Optional[str] = None) -> SchemaCatalog:
+    """Get the schema catalog of a database (DATABASE_URL by default)"""
+    url = url or DATABASE_URL
+    with _catalogs_lock:
+        if url not in _catalogs:
+            _catalogs[url] = SchemaCatalog(url)
+        return _catalogs[url]
+
+
+def _format_table(description: Dict[str, Any]) -> str:
+    columns = []
+    for column in description["columns"]:
+        values = f" [{', '.join(column['values'])}]" if column["values"] else ""
+        columns.append(f"{column['name']} {column['type']}{values}")
+    return f"- {description['table']} ({description['row_count']} rows): {', '.join(columns)}"
+
+
+def render_schema_prompt(url: Optional[str] = None, max_chars: Optional[int] = None) -> str:
+    """
+    Compact description of the database tables for the system prompt, one line per table with its row count and
+    columns (and the values of low-cardinality text columns). Tables beyond `max_chars` characters are only
+    counted, the model can use describe_table for them. Returns an empty string if the database cannot be read.
+    """
+    max_chars = SCHEMA_PROMPT_MAX_CHARS if max_chars is None else max_chars
+    catalog = get_catalog(url)
+    try:
+        names = [name for name in catalog.table_names() if name.lower() not in INTERNAL_TABLES]
+        lines = []
+        size = 0
+        for i, name in enumerate(names):
+            description = catalog.describe(name)
+            if description is None:
+                continue  # Dropped since the table list was read
+            line = _format_table(description)
+            if size + len(line) > max_chars:
+                lines.append(f"- ... and {len(names) - i} more tables (use describe_table to see their columns)")
+                break
+            lines.append(line)
+            size += len(line) + 1
+    except Exception as e:
+        # The prompt is still usable without the schema, the model can fall back to the tools
+        logger.error(f"Could not read the database schema for the prompt: {e}")
+        return ""
+
+    if not lines:
+        return ""
+    return "Tables currently in the database (name (row count): column TYPE [values]):\n" + "\n".join(lines)
+
+
+if __name__ == "__main__":
+    print(render_schema_prompt())
@@ -0,0 +1,145 @@
+"""
+Column type inference for CSV imports. A sample of the file (its first chunk) is used to pick the narrowest SQL type
+of each column (SMALLINT/INTEGER/BIGINT, fixed-width CHAR codes, DATE/TIMESTAMP, BOOLEAN), like the hand-written
+`clientes` DDL, instead of the wide defaults of `DataFrame.to_sql` (BIGINT, FLOAT, TEXT). The table is then created
+with an explicit DDL and every chunk is checked against the inferred types before being written.
+"""
+import re
+from typing import Any, Dict, List
+
+import pandas as pd
+from sqlalchemy import (
+    BigInteger, Boolean, CHAR, Column, Date, DateTime, Float, Integer, MetaData, SmallInteger, Table, Text
+)
+
+
+CHAR_MAX_LENGTH = 8  # Longest fixed-width text column stored as CHAR(n)
+CATEGORY_MAX_VALUES = 20  # Text columns with at most this many distinct values are reported as categorical
+
+INTEGER_TYPES = [
+    (SmallInteger, -2 ** 15, 2 ** 15 - 1),
+    (Integer, -2 ** 31, 2 ** 31 - 1),
+    (BigInteger, -2 ** 63, 2 ** 63 - 1),
+]
+
+DATE_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+DATETIME_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}(:\d{2}(\.\d+)?)?$")
+
+
+class SchemaMismatchError(Exception):
+    """Raised when a chunk of the file does not fit the types inferred from the sample"""
+
+
+def _is_integral(values: pd.Series) -> bool:
+    return bool((values == values.round()).all())
+
+
+def _integer_type(values: pd.Series):
+    low, high = values.min(), values.max()
+    for sql_type, type_low, type_high in INTEGER_TYPES:
+        if type_low <= low and high <= type_high:
+            return sql_type()
+    return None
+
+
+def infer_column(name: str, series: pd.Series) -> Dict[str, Any]:
+    """
+    Infer the SQL type of a column from a sample of its values.
+
+    Returns:
+        Dictionary with the column "name", its SQLAlchemy "sql_type", "nullable" (whether the sample had nulls) and
+        "categories" (sorted distinct values of low-cardinality text columns, otherwise None)
+    """
+    values = series.dropna()
+    column = {"name": name, "sql_type": Text(), "nullable": len(values) < len(series), "categories": None}
+    if values.empty:
+        return column
+
+    if pd.api.types.is_bool_dtype(values):
+        column["sql_type"] = Boolean()
+    elif pd.api.types.is_integer_dtype(values) or (pd.api.types.is_float_dtype(values) and _is_integral(values)):
+        column["sql_type"] = _integer_type(values) or Float()
+    elif pd.api.types.is_float_dtype(values):
+        column["sql_type"] = Float()
+    elif pd.api.types.is_datetime64_any_dtype(values):
+        column["sql_type"] = Date() if (values == values.dt.normalize()).all() else DateTime()
+    else:
+        text_values = values.astype(str)
+        lengths = text_values.str.len()
+        if text_values.str.match(DATE_PATTERN).all():
+            column["sql_type"] = Date()
+        elif text_values.str.match(DATETIME_PATTERN).all():
+            column["sql_type"] = DateTime()
+        elif lengths.min() == lengths.max() <= CHAR_MAX_LENGTH:
+            column["sql_type"] = CHAR(int(lengths.max()))
+
+        distinct = text_values.unique()
+        if len(distinct) <= CATEGORY_MAX_VALUES and len(distinct) < len(text_values):
+            column["categories"] = sorted(distinct.tolist())
+    return column
+
+
+def infer_schema(sample: pd.DataFrame) -> List[Dict[str, Any]]:
+    """Infer the SQL type of every column of a sample (see `infer_column`)"""
+    return [infer_column(str(name), sample[name]) for name in sample.columns]
+
+
+def create_table(conn, table_name: str, schema: List[Dict[str, Any]]) -> None:
+    """Create (or replace) a table with the inferred column types"""
+    table = Table(table_name, MetaData(), *[Column(column["name"], column["sql_type"]) for column in schema])
+    table.drop(conn, checkfirst=True)
+    table.create(conn)
+
+
+def coerce_chunk(chunk: pd.DataFrame, schema: List[Dict[str, Any]]) -> pd.DataFrame:
+    """
+    Check that a chunk fits the inferred types and convert its columns where needed (e.g. integers read as floats
+    because of missing values). Raises SchemaMismatchError if a value does not fit its column type.
+    """
+    chunk = chunk.copy()
+    for column in schema:
+        name, sql_type = column["name"], column["sql_type"]
+        values = chunk[name].dropna()
+        if values.empty or isinstance(sql_type, Text):
+            continue
+
+        if isinstance(sql_type, Boolean):
+            if not pd.api.types.is_bool_dtype(values):
+                raise SchemaMismatchError(f"Column '{name}' has non-boolean values")
+
+        elif isinstance(sql_type, (SmallInteger, Integer, BigInteger)):
+            numbers = pd.to_numeric(values, errors="coerce")
+            if numbers.isna().any() or not _is_integral(numbers):
+                raise SchemaMismatchError(f"Column '{name}' has non-integer values")
+            low, high = next((low, high) for type_, low, high in INTEGER_TYPES if type(sql_type) is type_)
+            if numbers.min() < low or numbers.max() > high:
+                raise SchemaMismatchError(f"Column '{name}' has values out of the {sql_type} range")
+            chunk[name] = pd.to_numeric(chunk[name]).astype("Int64")
+
+        elif isinstance(sql_type, Float):
+            if pd.to_numeric(values, errors="coerce").isna().any():
+                raise SchemaMismatchError(f"Column '{name}' has non-numeric values")
+
+        elif isinstance(sql_type, (Date, DateTime)):
+            if not pd.api.types.is_datetime64_any_dtype(values):
+                pattern = DATE_PATTERN if isinstance(sql_type, Date) else DATETIME_PATTERN
+                if not values.astype(str).str.match(pattern).all():
+                    raise SchemaMismatchError(f"Column '{name}' has values that are not {sql_type}")
+
+        elif isinstance(sql_type, CHAR):
+            if values.astype(str).str.len().max() > sql_type.length:
+                raise SchemaMismatchError(f"Column '{name}' has values longer than {sql_type.length} characters")
+    return chunk
+
+
+def describe_schema(schema: List[Dict[str, Any]], dialect) -> List[Dict[str, Any]]:
+    """Serializable description of a schema, with the column types as SQL for the given dialect"""
+    return [
+        {
+            "name": column["name"],
+            "type": column["sql_type"].compile(dialect=dialect),
+            "nullable": column["nullable"],
+            "categories": column["categories"],
+        }
+        for column in schema
+    ]
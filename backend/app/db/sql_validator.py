@@ -0,0 +1,454 @@
+"""
+Token-aware validation of the SQL queries written by the agent. The query is split into tokens (names, quoted
+identifiers, string literals, numbers and symbols, without comments), so keywords are only recognized where they are
+keywords: `SELECT deleted_at` or `WHERE status = 'drop'` are not mistaken for a DELETE or a DROP statement.
+
+A query is accepted when it is a single SELECT (or WITH ... SELECT) statement without write keywords, row locks or
+blocked functions, whose row sources are tables, subqueries, CTEs or allowed table functions (never files or string
+literals). The validation also resolves the tables the query reads, through joins, subqueries and CTEs (CTE names
+are not tables), the table functions and the table aliases. Results are cached per normalized query.
+"""
+import re
+from functools import lru_cache
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, Tuple
+
+
+# Keywords that write data, change the schema or permissions, or lock rows. The query must start with SELECT or WITH,
+# so these are the ones that can still appear inside it (SELECT ... INTO, data-modifying CTEs, FOR UPDATE) or that
+# are dangerous enough to be rejected anywhere.
+WRITE_KEYWORDS = frozenset({
+    "INSERT", "UPDATE", "DELETE", "MERGE", "UPSERT", "DROP", "CREATE", "ALTER", "TRUNCATE", "GRANT", "REVOKE", "INTO",
+    "COPY", "ATTACH", "DETACH", "PRAGMA", "VACUUM", "CALL", "EXEC", "EXECUTE",
+})
+# Functions that read files or environment variables, run SQL strings, affect other sessions or stall the database
+# (PostgreSQL, SQLite and DuckDB), rejected anywhere in the query
+BLOCKED_FUNCTIONS = frozenset({
+    "pg_read_file", "pg_read_binary_file", "pg_ls_dir", "pg_ls_logdir", "pg_ls_waldir", "pg_stat_file", "lo_import",
+    "lo_export", "lo_get", "dblink", "dblink_exec", "pg_terminate_backend", "pg_cancel_backend", "pg_reload_conf",
+    "pg_sleep", "load_extension", "readfile", "writefile", "read_text", "read_blob", "read_csv", "read_csv_auto",
+    "read_parquet", "parquet_scan", "parquet_metadata", "parquet_schema", "parquet_file_metadata",
+    "parquet_kv_metadata", "read_json", "read_json_auto", "read_json_objects", "read_ndjson", "read_ndjson_auto",
+    "read_ndjson_objects", "read_xlsx", "sniff_csv", "glob", "query", "query_table", "getenv", "st_read",
+    "set_config", "pg_advisory_lock", "pg_advisory_lock_shared", "pg_advisory_xact_lock",
+    "pg_advisory_xact_lock_shared", "pg_try_advisory_lock", "pg_try_advisory_lock_shared",
+    "pg_try_advisory_xact_lock", "pg_try_advisory_xact_lock_shared",
+})
+# Table functions that only generate rows, the only functions allowed as row sources in FROM/JOIN
+ALLOWED_TABLE_FUNCTIONS = frozenset({"generate_series", "unnest", "range"})
+# Words after FOR that make a row-locking clause (FOR UPDATE, FOR SHARE, FOR NO KEY UPDATE, FOR KEY SHARE)
+LOCK_KEYWORDS = frozenset({"UPDATE", "SHARE", "NO", "KEY"})
+# Keywords that can follow a table name, so they are not taken for its alias
+CLAUSE_KEYWORDS = frozenset({
+    "WHERE", "JOIN", "INNER", "LEFT", "RIGHT", "FULL", "OUTER", "CROSS", "NATURAL", "ON", "USING", "GROUP", "ORDER",
+    "HAVING", "LIMIT", "OFFSET", "FETCH", "UNION", "INTERSECT", "EXCEPT", "WINDOW", "FOR", "LATERAL", "AS", "TABLESAMPLE",
+    "QUALIFY", "RETURNING", "WITH", "SELECT", "FROM", "AND", "OR", "NOT",
+})
+# Keywords that end a FROM clause
+FROM_CLAUSE_END = frozenset({
+    "SELECT", "WHERE", "GROUP", "HAVING", "ORDER", "LIMIT", "OFFSET", "FETCH", "UNION", "INTERSECT", "EXCEPT",
+    "WINDOW", "QUALIFY", "ON", "USING", "FOR",
+})
+
+# String literals. E'...' (PostgreSQL, DuckDB) takes backslash escapes, so E'\'' is a single quote. Plain strings take
+# them too on MySQL, see `tokenize`.
+ESCAPE_STRING = r"(?<![\w$])[Ee]'(?:[^'\\]|\\.|'')*'"
+STANDARD_STRING = r"'(?:[^']|'')*'"
+BACKSLASH_STRING = r"'(?:[^'\\]|\\.|'')*'"
+
+TOKEN_TEMPLATE = r"""
+    (?P<space>\s+)
+  | (?P<comment>--[^\n]*|/\*.*?\*/)
+  | (?P<string>{escape_string}|{string})
+  | (?P<dollar_string>\$(?P<tag>[A-Za-z_]*)\$.*?\$(?P=tag)\$)
+  | (?P<quoted>"(?:[^"]|"")*"|`(?:[^`]|``)*`)
+  | (?P<number>(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<name>[^\W\d]\w*)
+  | (?P<symbol>[^\s\w'"`$])
+"""
+# Indexed by `backslash_escapes`
+TOKEN_PATTERNS = tuple(
+    re.compile(TOKEN_TEMPLATE.format(escape_string=ESCAPE_STRING, string=string), re.VERBOSE | re.DOTALL)
+    for string in (STANDARD_STRING, BACKSLASH_STRING)
+)
+
+# Parts of a query that are not lowercased by `normalize_sql`, or are removed (comments)
+QUOTED_OR_COMMENT_TEMPLATE = (
+    ESCAPE_STRING + r"|{string}|\"(?:[^\"]|\"\")*\"|\$(?P<tag>[A-Za-z_]*)\$.*?\$(?P=tag)\$|--[^\n]*|/\*.*?\*/"
+)
+QUOTED_OR_COMMENT = tuple(
+    re.compile(QUOTED_OR_COMMENT_TEMPLATE.format(string=string), re.DOTALL)
+    for string in (STANDARD_STRING, BACKSLASH_STRING)
+)
+
+
+class Token(NamedTuple):
+    kind: str  # "name", "quoted", "string", "number" or "symbol"
+    value: str  # Names are uppercased, quoted identifiers are unquoted
+
+    def is_keyword(self, *keywords: str) -> bool:
+        return self.kind == "name" and self.value in keywords
+
+
+class SqlValidation(NamedTuple):
+    """Result of `validate_sql`. It is shared through the cache, so it must not be modified."""
+    valid: bool
+    code: Optional[str]  # Rejection code, e.g. "not_read_only" (None if the query is valid)
+    reason: Optional[str]  # Rejection reason for the agent (None if the query is valid)
+    tables: FrozenSet[str]  # Tables read by the query, lowercased, without the CTE names
+    ctes: FrozenSet[str]  # Names of the CTEs defined by the query, lowercased
+    aliases: Tuple[Tuple[str, str], ...]  # (alias or table name, table name) pairs, lowercased
+    table_functions: FrozenSet[str] = frozenset()  # Table functions used as row sources, lowercased
+
+    def to_error(self) -> dict:
+        """Rejection as an error dictionary for the agent"""
+        return {"error": f"Query rejected: {self.reason}", "code": self.code}
+
+
+class SqlSyntaxError(ValueError):
+    """Raised when a query cannot be tokenized"""
+
+
+def tokenize(sql_query: str, backslash_escapes: bool = False) -> List[Token]:
+    """
+    Split a query into tokens, without whitespace and comments. Raises SqlSyntaxError on unclosed quotes.
+
+    Args:
+        sql_query: The SQL query to split
+        backslash_escapes: Whether a backslash escapes the next character in plain strings, as on MySQL. Otherwise
+            only E'...' strings take backslash escapes, as on PostgreSQL, DuckDB and SQLite.
+    """
+    token_pattern = TOKEN_PATTERNS[backslash_escapes]
+    tokens = []
+    position = 0
+    while position < len(sql_query):
+        match = token_pattern.match(sql_query, position)
+        if match is None:
+            raise SqlSyntaxError(f"unclosed quote or comment at position {position}")
+        kind = match.lastgroup if match.lastgroup != "tag" else "dollar_string"
+        text = match.group(kind)
+        if kind == "name":
+            tokens.append(Token("name", text.upper()))
+        elif kind == "quoted":
+            quote = text[0]
+            tokens.append(Token("quoted", text[1:-1].replace(quote * 2, quote)))
+        elif kind in ("string", "dollar_string"):
+            tokens.append(Token("string", text))
+        elif kind in ("number", "symbol"):
+            tokens.append(Token(kind, text))
+        position = match.end()
+    return tokens
+
+
+def normalize_sql(sql_query: str, backslash_escapes: bool = False) -> str:
+    """
+    Normalize a SQL query for use as a cache key: comments are removed, whitespace is collapsed, keywords and
+    identifiers are lowercased and the trailing semicolon is removed. Quoted literals and identifiers are kept as they
+    are, since they are case-sensitive. `backslash_escapes` is as in `tokenize`.
+    """
+    normalized = []
+    position = 0
+    for match in QUOTED_OR_COMMENT[backslash_escapes].finditer(sql_query):
+        normalized.append(re.sub(r"\s+", " ", sql_query[position:match.start()]).lower())
+        # A comment becomes a space: collapsing the newline that ends a "--" comment would comment out the rest of
+        # the query
+        normalized.append(" " if match.group().startswith(("--", "/*")) else match.group())
+        position = match.end()
+    normalized.append(re.sub(r"\s+", " ", sql_query[position:]).lower())
+    return re.sub(r"[\s;]*$", "", "".join(normalized)).strip()
+
+
+def _identifier(token: Token) -> Optional[str]:
+    if token.kind == "quoted":
+        return token.value.lower()
+    if token.kind == "name":
+        return token.value.lower()
+    return None
+
+
+class TableReference(NamedTuple):
+    table: Optional[str] = None  # Table name, without the schema (None if the row source is not a table)
+    alias: Optional[str] = None
+    function: Optional[str] = None  # Table function name, e.g. generate_series
+    literal: Optional[str] = None  # String literal read as a table, e.g. '/data/file.csv' on DuckDB
+
+
+def _read_table_reference(tokens: List[Token], i: int) -> Tuple[TableReference, int]:
+    """
+    Read a row source (`[ONLY] schema.table [AS] alias`, a table function or a string literal) starting at tokens[i].
+    Subqueries are left to the caller, which reads their own FROM clauses.
+
+    Returns:
+        Tuple of (the reference, index of the next token)
+    """
+    if i < len(tokens) and tokens[i].is_keyword("LATERAL", "ONLY"):
+        i += 1  # LATERAL subqueries or functions, ONLY table (without inherited tables on PostgreSQL)
+    if i >= len(tokens):
+        return TableReference(), i
+    if tokens[i].kind == "string":
+        return TableReference(literal=tokens[i].value), i + 1
+    table = _identifier(tokens[i])
+    if table is None or tokens[i].value in CLAUSE_KEYWORDS:
+        return TableReference(), i  # Subquery, or not a table
+    i += 1
+    while i + 1 < len(tokens) and tokens[i].value == "." and _identifier(tokens[i + 1]):
+        table = _identifier(tokens[i + 1])  # The schema is dropped
+        i += 2
+    if i < len(tokens) and tokens[i].value == "(":
+        # Table function, e.g. generate_series(1, 10). Its arguments are read by the caller.
+        return TableReference(function=table), i
+
+    alias = None
+    if i < len(tokens) and tokens[i].is_keyword("AS"):
+        i += 1
+    if i < len(tokens) and _identifier(tokens[i]) and tokens[i].value not in CLAUSE_KEYWORDS:
+        alias = _identifier(tokens[i])
+        i += 1
+    return TableReference(table, alias), i
+
+
+class _Analysis(NamedTuple):
+    tables: FrozenSet[str]
+    ctes: FrozenSet[str]
+    aliases: Tuple[Tuple[str, str], ...]
+    table_functions: FrozenSet[str]
+    literals: Tuple[str, ...]
+
+
+def _analyze(tokens: List[Token]) -> _Analysis:
+    """
+    Find the row sources after FROM/JOIN (tables and their aliases, table functions and string literals) and the CTE
+    names, at any nesting level
+    """
+    tables, aliases, functions, literals = set(), [], set(), []
+    ctes = _cte_names(tokens)
+    # Kind of each open parenthesis: "function" (arguments, where FROM is not a clause, as in EXTRACT(YEAR FROM x))
+    # or "group" (subqueries and anything else), and whether each level is in a FROM clause (for comma-separated
+    # tables, which can follow a subquery)
+    parentheses = []
+    in_from = [False]
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        previous = tokens[i - 1] if i > 0 else None
+        following = tokens[i + 1] if i + 1 < len(tokens) else None
+        reference = None
+
+        if token.value == "(":
+            is_call = previous is not None and previous.kind in ("name", "quoted") \
+                and previous.value not in CLAUSE_KEYWORDS and previous.value not in ("IN", "EXISTS", "ANY", "ALL")
+            is_query = following is not None and following.is_keyword("SELECT", "WITH")
+            parentheses.append("function" if is_call and not is_query else "group")
+            in_from.append(False)
+        elif token.value == ")":
+            if parentheses:
+                parentheses.pop()
+                in_from.pop()
+        elif parentheses and parentheses[-1] == "function":
+            pass
+        elif token.is_keyword("FROM", "JOIN"):
+            # "a IS [NOT] DISTINCT FROM b" compares values
+            if not (token.value == "FROM" and previous is not None and previous.is_keyword("DISTINCT")
+                    and i >= 2 and tokens[i - 2].is_keyword("IS", "NOT")):
+                in_from[-1] = True
+                reference = i + 1
+        elif token.value == "," and in_from[-1]:
+            reference = i + 1
+        elif token.kind == "name" and token.value in FROM_CLAUSE_END:
+            in_from[-1] = False
+
+        if reference is not None:
+            source, j = _read_table_reference(tokens, reference)
+            table = source.table
+            if table in ctes and reference >= ctes[table]:
+                table = None  # Reference to a CTE
+            if table:
+                tables.add(table)
+                aliases.append((table, table))
+                if source.alias:
+                    aliases.append((source.alias, table))
+            if source.function:
+                functions.add(source.function)
+            if source.literal:
+                literals.append(source.literal)
+            i = max(j, i + 1)
+        else:
+            i += 1
+
+    return _Analysis(
+        frozenset(tables), frozenset(ctes), tuple(dict.fromkeys(aliases)), frozenset(functions), tuple(literals)
+    )
+
+
+def _skip_parentheses(tokens: List[Token], i: int) -> int:
+    """Get the index of the token after the parenthesized group that starts at tokens[i]"""
+    depth = 0
+    for j in range(i, len(tokens)):
+        if tokens[j].value == "(":
+            depth += 1
+        elif tokens[j].value == ")":
+            depth -= 1
+            if depth == 0:
+                return j + 1
+    return len(tokens)
+
+
+def _cte_names(tokens: List[Token]) -> Dict[str, int]:
+    """
+    Find the CTEs: WITH [RECURSIVE] name [(columns)] AS [[NOT] MATERIALIZED] (query), name AS (...), ...
+
+    Returns:
+        Dictionary of the CTE names and the index of the first token where the name refers to the CTE: the end of
+        its definition, or its start for recursive CTEs. Before that, e.g. in `WITH clientes AS (SELECT * FROM
+        clientes)`, the name is a table.
+    """
+    names = {}
+    for i, token in enumerate(tokens):
+        if not token.is_keyword("WITH"):
+            continue
+        j = i + 1
+        recursive = j < len(tokens) and tokens[j].is_keyword("RECURSIVE")
+        if recursive:
+            j += 1
+        while j < len(tokens):
+            name = _identifier(tokens[j])
+            j += 1
+            if j < len(tokens) and tokens[j].value == "(":
+                j = _skip_parentheses(tokens, j)  # Column names
+            if name is None or j >= len(tokens) or not tokens[j].is_keyword("AS"):
+                break
+            j += 1
+            while j < len(tokens) and tokens[j].is_keyword("NOT", "MATERIALIZED"):
+                j += 1
+            if j >= len(tokens) or tokens[j].value != "(":
+                break
+            start = j
+            j = _skip_parentheses(tokens, j)
+            names.setdefault(name, start if recursive else j)
+            if j >= len(tokens) or tokens[j].value != ",":
+                break
+            j += 1
+    return names
+
+
+def _rejected(code: str, reason: str, analysis: Optional[_Analysis] = None) -> SqlValidation:
+    if analysis is None:
+        return SqlValidation(False, code, reason, frozenset(), frozenset(), ())
+    return SqlValidation(False, code, reason, *analysis[:4])
+
+
+@lru_cache(maxsize=1024)
+def _validate_normalized(normalized_query: str, forbidden_keywords: FrozenSet[str],
+                         backslash_escapes: bool = False) -> SqlValidation:
+    try:
+        tokens = tokenize(normalized_query, backslash_escapes)
+    except SqlSyntaxError as e:
+        return _rejected("syntax_error", f"The query could not be parsed ({e}).")
+    if not tokens:
+        return _rejected("empty", "No SQL query provided.")
+
+    # One statement only, a trailing semicolon is allowed
+    statements = [[]]
+    for token in tokens:
+        if token.value == ";":
+            statements.append([])
+        else:
+            statements[-1].append(token)
+    statements = [statement for statement in statements if statement]
+    if len(statements) > 1:
+        return _rejected("multiple_statements", "Only one SQL statement can be run at a time.")
+    tokens = statements[0]
+
+    analysis = _analyze(tokens)
+    first = next((token for token in tokens if token.value != "("), tokens[0])
+    if not first.is_keyword("SELECT", "WITH"):
+        return _rejected(
+            "not_read_only", f"Only SELECT queries are allowed, this query starts with {first.value}.", analysis
+        )
+
+    for i, token in enumerate(tokens):
+        following = tokens[i + 1] if i + 1 < len(tokens) else None
+        # Quoted identifiers can name functions too: "pg_read_file"('/etc/passwd')
+        if token.kind in ("name", "quoted") and following is not None and following.value == "(" \
+                and token.value.lower() in BLOCKED_FUNCTIONS:
+            return _rejected("forbidden_function", f"The function {token.value.lower()} is not allowed.", analysis)
+        if token.kind != "name":
+            continue
+        if token.value == "FOR" and following is not None and following.is_keyword(*LOCK_KEYWORDS):
+            return _rejected("forbidden_keyword", "Row-locking clauses (FOR UPDATE, FOR SHARE) are not allowed.",
+                             analysis)
+        if token.value in forbidden_keywords:
+            return _rejected("forbidden_keyword", f"{token.value} is not allowed, the database is read-only.", analysis)
+
+    if analysis.literals:
+        return _rejected(
+            "forbidden_table", f"Only tables can be queried, not files or string literals ({analysis.literals[0]}).",
+            analysis
+        )
+    disallowed = sorted(analysis.table_functions - ALLOWED_TABLE_FUNCTIONS)
+    if disallowed:
+        return _rejected(
+            "forbidden_table_function", f"The table function {disallowed[0]} is not allowed, query the tables instead.",
+            analysis
+        )
+
+    return SqlValidation(True, None, None, *analysis[:4])
+
+
+def is_single_statement(sql_query: str) -> bool:
+    """
+    Check that a query is one statement (a trailing semicolon is allowed) whether or not strings take backslash
+    escapes. Executors call it right before running a query, so a multi-statement string never reaches a driver that
+    would run every statement.
+    """
+    for backslash_escapes in (False, True):
+        try:
+            tokens = tokenize(sql_query, backslash_escapes)
+        except SqlSyntaxError:
+            return False
+        semicolons = [i for i, token in enumerate(tokens) if token.value == ";"]
+        if any(i != len(tokens) - 1 for i in semicolons):
+            return False
+    return True
+
+
+def validate_sql(sql_query: str, forbidden_keywords: FrozenSet[str] = WRITE_KEYWORDS) -> SqlValidation:
+    """
+    Validate that a query is a single read-only SELECT statement, and resolve the tables it reads. Results are
+    cached per normalized query (see `normalize_sql`).
+
+    Where strings end depends on the database when they contain backslashes ('\'' is a whole string on MySQL, not on
+    PostgreSQL), so such queries must be valid both with and without backslash escapes: otherwise a statement could
+    hide in what one of them reads as a string.
+
+    Args:
+        sql_query: The SQL query to validate
+        forbidden_keywords: Uppercase keywords that reject the query wherever they appear as keywords
+
+    Returns:
+        A SqlValidation with "valid", the rejection "code" and "reason", and the "tables", "ctes", "aliases" and
+        "table_functions"
+    """
+    if not sql_query or not isinstance(sql_query, str):
+        return _rejected("empty", "No SQL query provided.")
+    validation = _validate_normalized(normalize_sql(sql_query), forbidden_keywords)
+    if validation.valid and "\\" in sql_query:
+        escaped = _validate_normalized(normalize_sql(sql_query, True), forbidden_keywords, True)
+        if not escaped.valid:
+            return escaped
+    return validation
+
+
+if __name__ == "__main__":
+    for query in [
+        "SELECT deleted_at, uf FROM clientes WHERE status = 'drop'",
+        "WITH maus AS (SELECT * FROM clientes WHERE target = 1) SELECT m.uf, COUNT(*) FROM maus m "
+        "JOIN public.estados e ON e.uf = m.uf GROUP BY m.uf",
+        "SELECT EXTRACT(YEAR FROM ref_date) FROM clientes",
+        "SELECT 1; DROP TABLE clientes",
+        "SELECT uf FROM clientes WHERE uf = E'\\'' ; DROP VIEW clientes; --'",
+        "DELETE FROM clientes",
+        "SELECT * INTO copia FROM clientes",
+    ]:
+        result = validate_sql(query)
+        print(f"{query}\n  valid={result.valid} code={result.code} tables={sorted(result.tables)} "
+              f"ctes={sorted(result.ctes)}")
@@ -0,0 +1,36 @@
+"""
+In-process version counters for database tables. Whenever a table's content is replaced (e.g. a CSV upload), its
+version is bumped, so caches built on top of query results can tell that their entries are stale.
+"""
+import threading
+from typing import Dict, Iterable
+
+
+_versions: Dict[str, int] = {}
+_database_version = 0  # Bumped with every table, so caches of the table list can tell that tables were added
+_lock = threading.Lock()
+
+
+def get_table_version(table_name: str) -> int:
+    """Get the current version of a table (0 if it was never changed by this process)"""
+    return _versions.get(table_name.lower(), 0)
+
+
+def get_table_versions(table_names: Iterable[str]) -> Dict[str, int]:
+    """Get the current versions of several tables"""
+    return {name.lower(): get_table_version(name) for name in table_names}
+
+
+def get_database_version() -> int:
+    """Get the number of table changes made by this process (0 if no table was changed)"""
+    return _database_version
+
+
+def bump_table_version(table_name: str) -> int:
+    """Mark a table as changed. Returns its new version."""
+    global _database_version
+    with _lock:
+        _database_version += 1
+        version = _versions.get(table_name.lower(), 0) + 1
+        _versions[table_name.lower()] = version
+        return version
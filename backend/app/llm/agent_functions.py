@@ -7,12 +7,27 @@ This approach allows the agent to attempt to handle errors and provide feedback
 """
 import json
 import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional, Union
 from dotenv import load_dotenv
 
-from sqlalchemy import create_engine, text, exc
+from sqlalchemy import text, exc
 from decimal import Decimal
 import logging
 
+from backend.app.db import analytics
+from backend.app.db.engine import get_engine, read_only_transaction, statement_timeout
+from backend.app.db.schema_catalog import get_catalog
+from backend.app.db.table_versions import get_table_versions
+from backend.app.db.index_advisor import record_query
+from backend.app.db.sql_validator import is_single_statement, normalize_sql
+from backend.app.llm.guardrails import validate_sql_query
+from backend.app.llm.tool_context import record_tool_call
+from backend.app.llm.downsampling import downsample_chart_data
+
 
 logging.basicConfig(
     level=logging.INFO,
@@ -27,6 +42,26 @@ logger = logging.getLogger(__name__)
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///app.db")
 
+QUERY_CACHE_MAX_BYTES = int(os.getenv("QUERY_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))  # 0 disables the cache
+QUERY_CACHE_TTL_SECONDS = float(os.getenv("QUERY_CACHE_TTL_SECONDS", "300"))
+
+# Limits of the query results sent back to the LLM. Larger results are truncated to a preview.
+QUERY_MAX_ROWS = int(os.getenv("QUERY_MAX_ROWS", "100"))
+QUERY_MAX_BYTES = int(os.getenv("QUERY_MAX_BYTES", str(16 * 1024)))
+QUERY_FETCH_BATCH_SIZE = 1000
+
+# Full results of truncated queries are kept server-side (up to RESULT_STORE_MAX_ROWS rows) for charts and downloads
+RESULT_STORE_MAX_ROWS = int(os.getenv("RESULT_STORE_MAX_ROWS", "50000"))
+RESULT_STORE_MAX_ENTRIES = int(os.getenv("RESULT_STORE_MAX_ENTRIES", "20"))
+RESULT_STORE_TTL_SECONDS = float(os.getenv("RESULT_STORE_TTL_SECONDS", "1800"))
+
+# Format of the chart data: "rows" (list of dictionaries), "columnar" ({column: [values]}) or "auto" (columnar from
+# CHART_COLUMNAR_MIN_ROWS rows, where repeating the column names in every row gets expensive)
+CHART_DATA_FORMAT = os.getenv("CHART_DATA_FORMAT", "auto")
+CHART_COLUMNAR_MIN_ROWS = int(os.getenv("CHART_COLUMNAR_MIN_ROWS", "1000"))
+# Maximum number of points of a chart (also the upper bound of the max_points argument of generate_chart)
+CHART_MAX_POINTS = int(os.getenv("CHART_MAX_POINTS", "500"))
+
 class DecimalEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, Decimal):
@@ -34,9 +69,125 @@ class DecimalEncoder(json.JSONEncoder):
         return super(DecimalEncoder, self).default(obj)
 
 
+class QueryResultCache:
+    """
+    LRU cache for query results, bounded by the (approximate) JSON size of the results and by a TTL. Each entry keeps
+    the versions of the tables its query reads, and is discarded when one of those tables is replaced.
+    """
+
+    def __init__(self, max_bytes: int, ttl_seconds: float):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Get a cached result, or None if it is missing, expired or refers to a table that changed"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expired = time.monotonic() - entry["stored_at"] > self.ttl_seconds
+                if expired or get_table_versions(entry["table_versions"]) != entry["table_versions"]:
+                    self._remove(key)
+                    entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry["result"]
+
+    def put(self, key, result: list, tables) -> None:
+        """Store a query result. Results larger than the whole cache are not stored."""
+        size = len(json.dumps(result, cls=DecimalEncoder, default=str))
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = {
+                "result": result,
+                "size": size,
+                "stored_at": time.monotonic(),
+                "table_versions": get_table_versions(tables),
+            }
+            self.current_bytes += size
+
+            while self.current_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+    def _remove(self, key) -> None:
+        entry = self._entries.pop(key)
+        self.current_bytes -= entry["size"]
+
+
+query_cache = QueryResultCache(QUERY_CACHE_MAX_BYTES, QUERY_CACHE_TTL_SECONDS)
+
+
+class QueryResultStore:
+    """Keeps the full result of truncated queries, by handle, for the most recent RESULT_STORE_MAX_ENTRIES queries"""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, sql_query: str, result: dict) -> str:
+        """Store a query result and return its handle"""
+        handle = uuid.uuid4().hex
+        with self._lock:
+            self._entries[handle] = dict(result, sql_query=sql_query, stored_at=time.monotonic())
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return handle
+
+    def get(self, handle: str):
+        """Get a stored result, or None if the handle is unknown or expired"""
+        with self._lock:
+            entry = self._entries.get(handle)
+            if entry is None:
+                return None
+            if time.monotonic() - entry["stored_at"] > self.ttl_seconds:
+                del self._entries[handle]
+                return None
+            self._entries.move_to_end(handle)
+            return entry
+
+
+result_store = QueryResultStore(RESULT_STORE_MAX_ENTRIES, RESULT_STORE_TTL_SECONDS)
+
+
 query_database_declaration = {
     "name": "query_database",
-    "description": "Executes a SQL query string and returns the results as a list of dictionaries.",
+    "description": "Executes a single read-only SQL query (SELECT or WITH) and returns the results as a list of dictionaries. Rejected queries return an error with a code and the reason.",
     "parameters": {
         "type": "object",
         "properties": {
@@ -49,49 +200,183 @@ query_database_declaration = {
     }
 }
 
-def query_database(sql_query: str) -> list:
+def _to_columnar(columns: list, rows: list) -> dict:
+    """
+    Transpose result rows into one list of values per column. Decimal values are converted to float (so they can be
+    serialized) column by column, only for the columns that contain them.
     """
-    Executes a SQL query string and returns the results as a list of dictionaries.
+    arrays = zip(*rows) if rows else [() for _ in columns]
+    data = {}
+    for column, values in zip(columns, arrays):
+        if any(isinstance(value, Decimal) for value in values):
+            values = [float(value) if isinstance(value, Decimal) else value for value in values]
+        data[column] = list(values)
+    return data
+
+
+def columnar_to_rows(data: dict, limit: Optional[int] = None) -> list:
+    """Convert columnar data ({column: [values]}) to a list of row dictionaries, optionally only the first rows"""
+    columns = list(data)
+    arrays = [data[column][:limit] if limit is not None else data[column] for column in columns]
+    return [dict(zip(columns, values)) for values in zip(*arrays)]
+
+
+def rows_to_columnar(rows: list) -> dict:
+    """Convert a list of row dictionaries to columnar data ({column: [values]})"""
+    columns = list(dict.fromkeys(key for row in rows[:1] for key in row))
+    return {column: [row.get(column) for row in rows] for column in columns}
 
-    Args:
-        sql_query: The SQL query to execute against the database.
+
+def format_chart_data(chart_data: Optional[dict], data_format: Optional[str]) -> Optional[dict]:
+    """
+    Return a chart payload with its data in the requested format ("rows" or "columnar"). The payload is returned
+    unchanged if it already uses that format, if no format is requested or if it has no data.
+    """
+    if not chart_data or not data_format or "data" not in chart_data:
+        return chart_data
+    current_format = chart_data.get("data_format", "rows")
+    if data_format == current_format:
+        return chart_data
+
+    if data_format == "columnar":
+        data = rows_to_columnar(chart_data["data"])
+    elif data_format == "rows":
+        data = columnar_to_rows(chart_data["data"])
+    else:
+        return chart_data
+    return dict(chart_data, data=data, data_format=data_format)
+
+
+def _count_rows(conn, sql_query: str):
+    """Count the rows of a query result on the database side. Returns None if the query cannot be wrapped."""
+    try:
+        return conn.execute(text(f"SELECT COUNT(*) FROM ({sql_query.strip().rstrip(';')}) AS query_rows")).scalar()
+    except exc.SQLAlchemyError as e:
+        logger.warning(f"Could not count query rows: {e}")
+        return None
+
+
+def _fetch_rows(engine, sql_query: str, max_rows: int) -> dict:
+    """
+    Execute a query and fetch at most `max_rows` rows. Rows are fetched in batches (with a server-side cursor when the
+    driver supports it), so a large result is never loaded in memory as a whole. Database errors are raised.
 
     Returns:
-        A list of dictionaries representing [columns, rows] from the query result, or a dictionary with an error message if the query fails.
+        A dictionary with the result "columns", the fetched rows as columnar "data" ({column: [values]}), "row_count",
+        "total_rows" (None if they could not be counted) and "complete" (False when the result had more than
+        `max_rows` rows).
     """
-    if not sql_query or not isinstance(sql_query, str):
-        logger.warning("No SQL query provided.")
-        return [{"warning": "No SQL query provided."}]
-    
-    dangerous_keywords = ["DROP", "DELETE", "TRUNCATE", "ALTER", "GRANT", "REVOKE"]
-    for keyword in dangerous_keywords:
-        if keyword in sql_query.upper():
-            logger.warning(f"Potentially dangerous SQL query blocked: {sql_query}")
-            return [{"warning": "This query contains potentially harmful operations and has been blocked for security reasons."}]
-    
+    if not is_single_statement(sql_query):
+        raise ValueError("Only one SQL statement can be run at a time.")
+    # The database stops slow queries, so a timed out tool call does not keep its worker thread and connection
+    with engine.connect() as conn, statement_timeout(conn):
+        read_only_transaction(conn)
+        result = conn.execution_options(stream_results=True).execute(text(sql_query))
+        columns = list(result.keys())
+
+        rows = []
+        complete = True
+        while True:
+            # One extra row is fetched to know if the result goes beyond the limit
+            batch = result.fetchmany(min(QUERY_FETCH_BATCH_SIZE, max_rows + 1 - len(rows)))
+            if not batch:
+                break
+            rows.extend(batch)
+            if len(rows) > max_rows:
+                complete = False
+                rows = rows[:max_rows]
+                break
+        result.close()
+
+        total_rows = len(rows) if complete else _count_rows(conn, sql_query)
+
+    data = _to_columnar(columns, rows)
+    return {
+        "columns": list(data),
+        "data": data,
+        "row_count": len(rows),
+        "total_rows": total_rows,
+        "complete": complete
+    }
+
+
+def _fetch_analytics(sql_query: str, max_rows: int) -> dict:
+    """Run a query on the analytics engine (see `analytics`). Same result as `_fetch_rows`, DuckDB errors are raised."""
+    fetched = analytics.fetch(sql_query, max_rows, QUERY_FETCH_BATCH_SIZE)
+    data = _to_columnar(fetched["columns"], fetched["rows"])
+    return {
+        "columns": list(data),
+        "data": data,
+        "row_count": len(fetched["rows"]),
+        "total_rows": fetched["total_rows"],
+        "complete": fetched["complete"]
+    }
+
+
+def _build_preview(result: dict) -> list:
+    """Get the first rows of a result, as row dictionaries, that fit in QUERY_MAX_ROWS and QUERY_MAX_BYTES"""
+    preview = []
+    size = 2
+    for row in columnar_to_rows(result["data"], limit=QUERY_MAX_ROWS):
+        size += len(json.dumps(row, cls=DecimalEncoder, default=str)) + 2
+        if size > QUERY_MAX_BYTES:
+            break
+        preview.append(row)
+    return preview
+
+
+def _execute_query(sql_query: str):
+    """
+    Validate and run a query, using the query cache when possible.
+
+    Returns:
+        The result dictionary of `_fetch_rows`, or a list with a single error dictionary for the agent (with a
+        "code" when the query is rejected by the SQL validator).
+    """
+    # Only single read-only statements get here, so every query can be cached. The validation is cached as well.
+    validation = validate_sql_query(sql_query)
+    if not validation.valid:
+        logger.warning(f"SQL query rejected ({validation.code}): {sql_query}")
+        return [validation.to_error()]
+
+    cacheable = QUERY_CACHE_MAX_BYTES > 0
+    cache_key = (DATABASE_URL, normalize_sql(sql_query))
+    if cacheable:
+        cached = query_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"Query cache hit: {sql_query}")
+            # Cached queries are part of the workload too: they reach the database again once their entry expires
+            record_query(sql_query)
+            return cached
+
+    # Read queries on tables with a Parquet snapshot run on the analytics engine, when it is enabled. Every row
+    # source must be a snapshot view, table functions (even the allowed ones) run on the main database.
+    if not validation.table_functions and analytics.has_snapshots(validation.tables):
+        try:
+            result = _fetch_analytics(sql_query, RESULT_STORE_MAX_ROWS)
+            logger.info(f"Executed SQL query on the analytics engine: {sql_query}")
+            if cacheable and result["complete"]:
+                query_cache.put(cache_key, result, validation.tables)
+            return result
+        except Exception as e:
+            # e.g. SQL specific to the main database, which DuckDB does not support
+            logger.warning(f"Analytics engine query failed, using the database: {e}")
+
     logger.info(f"Executing SQL query: {sql_query}")
     
     try:
-        engine = create_engine(DATABASE_URL)
+        engine = get_engine(DATABASE_URL)
 
         try:
             # Ensure the SQL query is safe to execute. Errors will be returned to the agent.
-            with engine.connect() as conn:
-                result = conn.execute(text(sql_query))
-
-                rows = result.fetchall()
-                columns = result.keys()
-
-                result_dicts = []
-                for row in rows:
-                    row_dict = dict(zip(columns, row))
-
-                    # Convert any Decimal objects to float so they can be serialized to JSON
-                    for key, value in row_dict.items():
-                        if isinstance(value, Decimal):
-                            row_dict[key] = float(value)
-                    result_dicts.append(row_dict)
-                return result_dicts
+            result = _fetch_rows(engine, sql_query, RESULT_STORE_MAX_ROWS)
+            # Columns filtered/grouped on by queries that reach the database feed the index advisor
+            record_query(sql_query)
+
+            # Only complete results are cached, so a cached entry never refers to an expired result handle
+            if cacheable and result["complete"]:
+                query_cache.put(cache_key, result, validation.tables)
+            return result
                
         except exc.OperationalError as e:
             logger.error(f"Database operational query error: {e}")
@@ -114,6 +399,54 @@ def query_database(sql_query: str) -> list:
         return [{"error": f"Unexpected error during DB connection: {str(e)}"}]
 
 
+@record_tool_call
+def query_database(sql_query: str) -> Union[list, dict]:
+    """
+    Executes a SQL query string and returns the results as a list of dictionaries. Large results are truncated: only
+    the first rows are returned, together with the total number of rows and a result_handle that can be passed to
+    generate_chart to plot the full result. Prefer aggregations (GROUP BY, COUNT, AVG) or LIMIT over large results.
+    Only a single read-only statement (SELECT or WITH) is run, other queries are rejected with an error "code" and
+    the reason.
+
+    Args:
+        sql_query: The SQL query to execute against the database.
+
+    Returns:
+        A list of dictionaries representing [columns, rows] from the query result, or a dictionary with an error message if the query fails.
+        When the result is too large, a dictionary with "truncated", "rows" (the first rows), "total_rows" and "result_handle".
+    """
+    result = _execute_query(sql_query)
+    if isinstance(result, list):
+        return result
+
+    preview = _build_preview(result)
+    if result["complete"] and len(preview) == result["row_count"]:
+        return preview
+
+    handle = result_store.put(sql_query, result)
+    logger.info(f"Query result truncated to {len(preview)} of {result['total_rows']} rows (handle {handle})")
+    return {
+        "truncated": True,
+        "rows": preview,
+        "returned_rows": len(preview),
+        "total_rows": result["total_rows"],
+        "result_handle": handle,
+        "note": f"Only the first {len(preview)} rows are shown. Use aggregations or LIMIT for a smaller result, "
+                f"or pass result_handle to generate_chart to plot the full result."
+    }
+
+
+def parse_y_columns(y_column) -> list:
+    """Parse the y_column argument of generate_chart, which can be a column name or a list formatted as a string"""
+    if isinstance(y_column, list):
+        return [str(column) for column in y_column]
+    try:
+        columns = json.loads(str(y_column).replace("'", '"'))
+    except ValueError:
+        return [y_column]
+    return [str(column) for column in columns] if isinstance(columns, list) else [y_column]
+
+
 generate_chart_declaration = {
     "name": "generate_chart",
     "description": "Generates a chart based on the provided SQL query and parameters.",
@@ -140,13 +473,23 @@ generate_chart_declaration = {
             "y_column": {
                 "type": "string",
                 "description": "The columns names for the y-axis. To set one column, send just the string like 'col_1'. You can set more than one column if format the list as a string like '['col_1', ...]'. Make sure that this column exists in the query result. If needed make the query forehand to ensure the columns are present."
+            },
+            "result_handle": {
+                "type": "string",
+                "description": "Optional result_handle returned by query_database for a truncated result. When set, the full stored result is plotted instead of running sql_query again."
+            },
+            "max_points": {
+                "type": "integer",
+                "description": "Optional maximum number of points of the chart. Line charts are downsampled and bar charts keep the largest categories plus an 'Other' bar. Defaults to the server setting."
             }
         },
         "required": ["chart_type", "sql_query", "title", "x_column", "y_column"]
     }
 }
 
-def generate_chart(chart_type: str, sql_query: str, title: str, x_column: str, y_column: str) -> dict:
+@record_tool_call
+def generate_chart(chart_type: str, sql_query: str, title: str, x_column: str, y_column: str, result_handle: str = "",
+                   max_points: int = 0) -> dict:
     """
     Executes SQL query and returns structured data for creating charts in the frontend. Feel free to query beforehand using query_database to ensure the columns are present.
 
@@ -156,17 +499,42 @@ def generate_chart(chart_type: str, sql_query: str, title: str, x_column: str, y
         title: The title of the chart.
         x_column: The column name for the x-axis. Make sure it is a valid column in the query result.
         y_column: The columns names for the y-axis. To set one column, send just the string like 'col_1'. You can set more than one column if format the list as a string like '["col_1", ...]'. Make sure that this column exists in the query result. If needed make the query forehand to ensure the columns are present.
+        result_handle: Optional result_handle returned by query_database for a truncated result. When set, the full stored result is plotted instead of running sql_query again.
+        max_points: Optional maximum number of points of the chart. Line charts are downsampled and bar charts keep the largest categories plus an 'Other' bar. Defaults to the server setting.
     
     Returns:
         A dictionary containing the chart type, title, x_column, y_column, and data for the chart.
+        When the data was reduced to max_points, "downsampling" reports the method and the number of points, and for bar charts how the 'Other' bar combines each column ("sum", or "mean" for rates and averages).
         If an error occurs, it returns a dictionary with success set to False and an error message.
     """
     logger.info(f"Generating chart with type: {chart_type}, title: {title}, x_column: {x_column}, y_column: {y_column}")
     try:
-        # Get data from database using the provided SQL query. Errors will be returned to the agent.
-        data = query_database(sql_query)
-        if not data or len(data) == 0:
+        # Get data from the stored result or from the database using the provided SQL query.
+        # Errors will be returned to the agent.
+        result = result_store.get(result_handle) if result_handle else None
+        if result is None:
+            result = _execute_query(sql_query)
+        if isinstance(result, list):
+            return {"success": False, "error": next(iter(result[0].values()))}
+
+        if not result["complete"]:
+            logger.warning(f"Chart data limited to the first {result['row_count']} of {result['total_rows']} rows")
+        if result["row_count"] == 0:
             return {"success": False, "error": "No data returned from query"}
+
+        # Reduce the data to the maximum number of points, so the payload stays small for any query cardinality
+        max_points = min(int(max_points), CHART_MAX_POINTS) if max_points and int(max_points) > 0 else CHART_MAX_POINTS
+        data, downsampling = downsample_chart_data(
+            chart_type, result["data"], x_column, parse_y_columns(y_column), max_points
+        )
+        if downsampling:
+            logger.info(f"Chart data reduced with {downsampling['method']} from {downsampling['original_points']} "
+                        f"to {downsampling['returned_points']} points")
+        row_count = len(next(iter(data.values()), []))
+
+        data_format = CHART_DATA_FORMAT
+        if data_format == "auto":
+            data_format = "columnar" if row_count >= CHART_COLUMNAR_MIN_ROWS else "rows"
         
         return {
             "success": True,
@@ -174,7 +542,10 @@ def generate_chart(chart_type: str, sql_query: str, title: str, x_column: str, y
             "title": title,
             "x_column": x_column,
             "y_column": y_column,
-            "data": data
+            "columns": list(data),
+            "data_format": data_format,
+            "data": dict(data) if data_format == "columnar" else columnar_to_rows(data),
+            "downsampling": downsampling
         }
     
     except Exception as e:
@@ -192,40 +563,73 @@ list_tables_declaration = {
     }
 }
 
+@record_tool_call
 def list_tables() -> list:
     """
-    Lists all tables in the connected database. Works with both PostgreSQL and SQLite databases.
+    Lists all tables in the connected database. Works with both PostgreSQL and SQLite databases. The list comes from
+    the schema catalog, so the database is only introspected again after a table changes.
 
     Returns:
         A list of table names.
     """
     logger.info("Listing all tables in the database.")
-    engine = create_engine(DATABASE_URL)
     try:
-        # Connect to the database and retrieve the list of tables. Errors will be returned to the agent.
-        with engine.connect() as conn:
-            if engine.dialect.name == "postgresql":
-                result = conn.execute(
-                    text("SELECT table_name FROM information_schema.tables WHERE table_schema = 'public'")
-                )
-            elif engine.dialect.name == "sqlite":
-                result = conn.execute(
-                    text("SELECT name FROM sqlite_master WHERE type='table'")
-                )
-            else:
-                return ["Unsupported database type"]
-            tables = [row[0] for row in result.fetchall()]
-            return tables
+        # Errors will be returned to the agent.
+        return get_catalog(DATABASE_URL).table_names()
     
     except exc.SQLAlchemyError as e:
         logger.error(f"Error listing tables: {e}")
-        return ["Error listing tables: {str(e)}"]
+        return [f"Error listing tables: {str(e)}"]
 
     except Exception as e:
         logger.error(f"Unknown error listing tables: {e}")
-        return ["Unknown error listing tables: {str(e)}"]
+        return [f"Unknown error listing tables: {str(e)}"]
 
 
+describe_table_declaration = {
+    "name": "describe_table",
+    "description": "Describes a table: its number of rows and its columns, with their types and, for text columns "
+                   "with few distinct values, the possible values.",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "table_name": {
+                "type": "string",
+                "description": "The name of the table to describe."
+            }
+        },
+        "required": ["table_name"]
+    }
+}
+
+@record_tool_call
+def describe_table(table_name: str) -> dict:
+    """
+    Describes a table of the connected database: its number of rows and its columns, with their SQL types and, for
+    text columns with few distinct values, the possible values.
+
+    Args:
+        table_name: The name of the table to describe.
+
+    Returns:
+        A dictionary with the "table" name, its "row_count" and its "columns" ("name", "type", "nullable" and
+        "values"), or a dictionary with an "error".
+    """
+    logger.info(f"Describing table: {table_name}")
+    try:
+        description = get_catalog(DATABASE_URL).describe(table_name)
+        if description is None:
+            return {"error": f"Table '{table_name}' does not exist. Use list_tables to see the available tables."}
+        return description
+
+    except exc.SQLAlchemyError as e:
+        logger.error(f"Error describing table {table_name}: {e}")
+        return {"error": f"Error describing table: {str(e)}"}
+
+    except Exception as e:
+        logger.error(f"Unknown error describing table {table_name}: {e}")
+        return {"error": f"Unknown error describing table: {str(e)}"}
+
 if __name__ == "__main__":
     sql_query = "SELECT count(sexo) FROM clientes LIMIT 5"
     results = query_database(sql_query)
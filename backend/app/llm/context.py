@@ -0,0 +1,167 @@
+"""
+Context window assembly for LLM providers. Instead of sending the whole session history on every turn, the most
+recent messages are kept within a per-provider/model token budget and older messages are folded into a rolling
+summary, which is persisted per session so each message is only summarized once.
+"""
+import math
+import os
+import re
+from typing import Dict, Any, List, Optional, Tuple
+
+import backend.app.llm.session as session_manager
+from backend.app.db.models import ChatMessage, ChatSummary
+import logging
+
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler("logs/database_operations.log"),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+# Context policies. The "default" entry applies to every provider, and can be overridden by a provider's "default"
+# entry and then by a specific model entry.
+#   max_tokens: Token budget for the history (summary included)
+#   min_recent_messages: Most recent messages that are always sent, even if they exceed the budget
+#   summary_max_tokens: Token budget reserved for the rolling summary
+#   summarization: "extractive" to summarize older messages, "none" to just drop them
+CONTEXT_POLICIES: Dict[str, Dict[str, Any]] = {
+    "default": {
+        "max_tokens": 8000,
+        "min_recent_messages": 2,
+        "summary_max_tokens": 600,
+        "summarization": "extractive",
+    },
+    "gemini": {
+        "default": {"max_tokens": 30000},
+    },
+    "groq": {
+        # Groq free tier limits tokens per minute, so the history is kept much shorter
+        "default": {"max_tokens": 6000},
+        "qwen-qwq-32b": {"max_tokens": 5000},
+    },
+}
+
+CONTEXT_MAX_TOKENS = os.getenv("CONTEXT_MAX_TOKENS")
+
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+SUMMARY_LINE_CHARS = 240
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate the number of tokens of a text (about 4 characters per token for most tokenizers)"""
+    return math.ceil(len(text or "") / 4)
+
+
+def estimate_message_tokens(message: ChatMessage) -> int:
+    """Approximate the number of tokens a message uses, including the role/formatting overhead"""
+    return estimate_tokens(message.content) + MESSAGE_OVERHEAD_TOKENS
+
+
+def get_context_policy(provider_name: str, model: Optional[str] = None) -> Dict[str, Any]:
+    """Get the context policy for a provider and model"""
+    policy = dict(CONTEXT_POLICIES["default"])
+    provider_policies = CONTEXT_POLICIES.get(provider_name, {})
+    policy.update(provider_policies.get("default", {}))
+    if model:
+        policy.update(provider_policies.get(model, {}))
+
+    if CONTEXT_MAX_TOKENS:
+        policy["max_tokens"] = int(CONTEXT_MAX_TOKENS)
+    return policy
+
+
+def summarize_extractive(previous_summary: str, messages: List[ChatMessage], max_tokens: int) -> str:
+    """
+    Fold messages into a rolling summary without calling an LLM. Each message becomes one line with its first
+    sentence(s); when the summary exceeds its budget, the oldest lines are dropped first.
+    """
+    lines = [line for line in (previous_summary or "").splitlines() if line.strip()]
+    for message in messages:
+        content = re.sub(r"\s+", " ", message.content or "").strip()
+        if len(content) > SUMMARY_LINE_CHARS:
+            content = content[:SUMMARY_LINE_CHARS].rsplit(" ", 1)[0] + "..."
+        speaker = "User" if message.role == "user" else "Assistant"
+        lines.append(f"- {speaker}: {content}")
+
+    while len(lines) > 1 and estimate_tokens("\n".join(lines)) > max_tokens:
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+SUMMARIZERS = {
+    "extractive": summarize_extractive,
+}
+
+
+def fit_history(messages: List[ChatMessage], previous_summary: Optional[str],
+                policy: Dict[str, Any]) -> Tuple[List[ChatMessage], List[ChatMessage], Optional[str]]:
+    """
+    Fit a conversation into the policy's token budget.
+
+    Args:
+        messages: Messages not covered by the summary yet, in chronological order
+        previous_summary: Current rolling summary text, if any
+        policy: Context policy (see `get_context_policy`)
+
+    Returns:
+        Tuple of (recent messages to send, messages dropped from the window, updated summary text)
+    """
+    summarizer = SUMMARIZERS.get(policy["summarization"])
+    budget = policy["max_tokens"] - (policy["summary_max_tokens"] if summarizer else 0)
+
+    kept = []
+    used_tokens = 0
+    for message in reversed(messages):
+        cost = estimate_message_tokens(message)
+        if len(kept) >= policy["min_recent_messages"] and used_tokens + cost > budget:
+            break
+        kept.append(message)
+        used_tokens += cost
+    kept.reverse()
+
+    dropped = messages[:len(messages) - len(kept)]
+    summary = previous_summary
+    if dropped and summarizer:
+        # The summary is sent as a message with a prefix, which also counts towards its budget
+        summary_budget = policy["summary_max_tokens"] - estimate_tokens(SUMMARY_PREFIX) - MESSAGE_OVERHEAD_TOKENS
+        summary = summarizer(previous_summary, dropped, summary_budget)
+    return kept, dropped, summary
+
+
+def build_context(session_id: str, provider_name: str, model: Optional[str] = None) -> List[ChatMessage]:
+    """
+    Build the history sent to a provider for a session: the rolling summary (as a first message) followed by the
+    most recent messages that fit in the budget. Only messages not yet covered by the stored summary are loaded.
+    """
+    policy = get_context_policy(provider_name, model)
+    stored_summary = session_manager.get_summary(session_id)
+
+    after = None
+    if stored_summary:
+        after = session_manager.encode_cursor(stored_summary.covered_until, stored_summary.covered_until_id)
+    messages = session_manager.get_messages(session_id, after=after)
+
+    previous_text = stored_summary.summary if stored_summary else None
+    recent, dropped, summary_text = fit_history(messages, previous_text, policy)
+
+    # Messages without an ID (legacy SQLite tables) cannot be used as a cursor, so the summary is not persisted
+    if dropped and summary_text and dropped[-1].id is not None:
+        session_manager.save_summary(ChatSummary(
+            session_id=session_id,
+            summary=summary_text,
+            covered_until=dropped[-1].timestamp,
+            covered_until_id=dropped[-1].id
+        ))
+        logger.info(f"Summarized {len(dropped)} older messages of session {session_id}")
+
+    context = []
+    if summary_text:
+        context.append(ChatMessage(role="user", content=SUMMARY_PREFIX + summary_text))
+    context.extend(recent)
+    return context
@@ -0,0 +1,224 @@
+"""
+Server-side reduction of chart data, so chart payloads stay small regardless of how many rows a query returns.
+Line charts are downsampled with Largest-Triangle-Three-Buckets (LTTB), which keeps the visual shape of a series
+(peaks and valleys) with a fraction of the points. Bar charts keep their largest categories and group the rest
+into an "Other" bar, which adds up counts and averages rates.
+
+All functions work on columnar data ({column: [values]}) and return new lists, never modifying their input.
+"""
+import re
+from datetime import date, datetime
+from numbers import Number
+from typing import Any, Dict, List, Optional, Tuple
+
+
+OTHER_LABEL = "Other"
+# Names of columns holding rates, ratios or averages (English or Portuguese), which are averaged instead of added up
+NON_ADDITIVE_COLUMN = re.compile(
+    r"(?:^|[_\W])(?:rate|ratio|avg|average|mean|median|pct|percent|percentage|share|taxa|media|medio|mediana|"
+    r"percentual|proporcao|razao)(?:$|[_\W])",
+    re.IGNORECASE
+)
+
+
+def _to_number(value: Any) -> Optional[float]:
+    """Convert a value to a number usable as a coordinate. Returns None if it is not a number or a date."""
+    if isinstance(value, bool):
+        return float(value)
+    if isinstance(value, Number):
+        return float(value)
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, date):
+        return float(value.toordinal() * 86400)
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value).timestamp()
+        except ValueError:
+            return None
+    return None
+
+
+def _x_coordinates(values: List[Any]) -> List[float]:
+    """Numeric x coordinates for LTTB: the values themselves (or their timestamps), or their positions otherwise"""
+    numbers = [_to_number(value) for value in values]
+    if any(number is None for number in numbers):
+        return [float(i) for i in range(len(values))]
+    return numbers
+
+
+def lttb_indices(x: List[float], y: List[float], threshold: int) -> List[int]:
+    """
+    Select `threshold` points of a series with the Largest-Triangle-Three-Buckets algorithm.
+
+    Args:
+        x: Numeric x coordinates, in plotting order
+        y: Numeric y values
+        threshold: Number of points to keep
+
+    Returns:
+        The sorted indexes of the selected points (always including the first and last points)
+    """
+    n = len(x)
+    if threshold >= n:
+        return list(range(n))
+    if threshold < 3:
+        return [0, n - 1][:max(threshold, 0)]
+
+    # The first and last points are always kept, the others are split in threshold - 2 buckets
+    bucket_size = (n - 2) / (threshold - 2)
+    indices = [0]
+    a = 0
+    for i in range(threshold - 2):
+        # Average point of the next bucket
+        next_start = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, n)
+        avg_x = sum(x[next_start:next_end]) / (next_end - next_start)
+        avg_y = sum(y[next_start:next_end]) / (next_end - next_start)
+
+        # Point of the current bucket forming the largest triangle with the previous selected point and the average
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+        max_area = -1.0
+        selected = start
+        for j in range(start, end):
+            area = abs((x[a] - avg_x) * (y[j] - y[a]) - (x[a] - x[j]) * (avg_y - y[a]))
+            if area > max_area:
+                max_area = area
+                selected = j
+        indices.append(selected)
+        a = selected
+
+    indices.append(n - 1)
+    return indices
+
+
+def downsample_line(data: Dict[str, list], x_column: str, y_columns: List[str],
+                    max_points: int) -> Tuple[Dict[str, list], bool]:
+    """
+    Downsample line chart data with LTTB. With several y columns, each series gets an equal share of the points and
+    the union of the selected points is kept, so every series keeps its shape. Null values are left out of LTTB, and
+    the first point of each run of nulls is kept so the gaps of the series stay visible.
+
+    Returns:
+        Tuple of (data, whether it was downsampled)
+    """
+    n = len(data.get(x_column, []))
+    if n <= max_points or not y_columns:
+        return data, False
+
+    x = _x_coordinates(data[x_column])
+    threshold = max(3, max_points // len(y_columns))
+    selected = set()
+    for y_column in y_columns:
+        y = [_to_number(value) for value in data[y_column]]
+        if any(value is None and raw is not None for value, raw in zip(y, data[y_column])):
+            return data, False  # Non-numeric series cannot be downsampled
+        present = [i for i, value in enumerate(y) if value is not None]
+        kept = lttb_indices([x[i] for i in present], [y[i] for i in present], threshold)
+        selected.update(present[i] for i in kept)
+        selected.update(i for i, value in enumerate(y) if value is None and (i == 0 or y[i - 1] is not None))
+
+    indices = sorted(selected)
+    return {column: [values[i] for i in indices] for column, values in data.items()}, True
+
+
+def column_aggregation(column: str) -> str:
+    """How the rows of a y column are combined into one bar: "mean" for rates, ratios and averages, "sum" otherwise"""
+    return "mean" if NON_ADDITIVE_COLUMN.search(column) else "sum"
+
+
+def bucket_top_n(data: Dict[str, list], x_column: str, y_columns: List[str],
+                 max_points: int) -> Tuple[Dict[str, list], bool]:
+    """
+    Reduce bar chart data to its `max_points - 1` largest categories (by the y columns) plus an "Other" category
+    with the remaining ones. Rows with the same category are combined first, and a category already named "Other" is
+    added to the "Other" bar. Rows are combined with `column_aggregation`: counts and totals are added up, rates and
+    averages are averaged (a summed rate means nothing), without their null values. Kept categories stay in their
+    original order, and only the x and y columns are returned.
+
+    Returns:
+        Tuple of (data, whether it was bucketed)
+    """
+    if not y_columns or max_points < 2:
+        return data, False
+
+    aggregations = [column_aggregation(y_column) for y_column in y_columns]
+    # Sum and number of non-null values of each y column, per category
+    totals: Dict[Any, List[List[float]]] = {}
+    for i, category in enumerate(data.get(x_column, [])):
+        values = [data[y_column][i] for y_column in y_columns]
+        numbers = [_to_number(value) if value is not None else None for value in values]
+        if any(number is None and value is not None for number, value in zip(numbers, values)):
+            return data, False  # Non-numeric values cannot be added up
+        sums = totals.setdefault(category, [[0.0, 0] for _ in y_columns])
+        for total, number in zip(sums, numbers):
+            if number is not None:
+                total[0] += number
+                total[1] += 1
+
+    if len(totals) <= max_points:
+        return data, False
+
+    def combine(sums: List[List[float]]) -> List[float]:
+        return [
+            (total / count if count else None) if aggregation == "mean" else total
+            for (total, count), aggregation in zip(sums, aggregations)
+        ]
+
+    combined = {category: combine(sums) for category, sums in totals.items()}
+    ranked = sorted(
+        (category for category in totals if category != OTHER_LABEL),
+        key=lambda category: sum(abs(value or 0.0) for value in combined[category]), reverse=True
+    )
+    kept = set(ranked[:max_points - 1])
+    other = [[0.0, 0] for _ in y_columns]
+    result = {column: [] for column in [x_column] + y_columns}
+    for category, sums in totals.items():
+        if category in kept:
+            result[x_column].append(category)
+            for y_column, value in zip(y_columns, combined[category]):
+                result[y_column].append(value)
+        else:
+            for total, (category_total, count) in zip(other, sums):
+                total[0] += category_total
+                total[1] += count
+
+    result[x_column].append(OTHER_LABEL)
+    for y_column, value in zip(y_columns, combine(other)):
+        result[y_column].append(value)
+    return result, True
+
+
+def downsample_chart_data(chart_type: str, data: Dict[str, list], x_column: str, y_columns: List[str],
+                          max_points: int) -> Tuple[Dict[str, list], Optional[Dict[str, Any]]]:
+    """
+    Reduce chart data to about `max_points` points, depending on the chart type.
+
+    Returns:
+        Tuple of (data, reduction report or None if the data was not reduced)
+    """
+    columns = [x_column] + y_columns
+    if max_points <= 0 or any(column not in data for column in columns):
+        return data, None
+
+    original_points = len(data[x_column])
+    if chart_type == "line":
+        method = "lttb"
+        reduced, changed = downsample_line(data, x_column, y_columns, max_points)
+    elif chart_type == "bar":
+        method = "top_n"
+        reduced, changed = bucket_top_n(data, x_column, y_columns, max_points)
+    else:
+        return data, None
+
+    if not changed:
+        return data, None
+    report = {
+        "method": method,
+        "original_points": original_points,
+        "returned_points": len(reduced[x_column]),
+    }
+    if method == "top_n":
+        report["aggregation"] = {y_column: column_aggregation(y_column) for y_column in y_columns}
+    return reduced, report
@@ -4,6 +4,7 @@ classes (like Gemini, Groq, etc.) in a unified way. It abstracts the creation of
 LLM provider instances and largely improves the system's scalability.
 """
 import os
+import threading
 from typing import List, Dict, Optional
 
 from backend.app.llm.providers.base import LLMProvider
@@ -12,8 +13,14 @@ from backend.app.llm.providers.groq import GroqProvider
 
 
 class LLMProviderFactory:
-    """Factory class to create and manage LLM providers"""
+    """
+    Factory class to create and manage LLM providers. Providers are built lazily, once per process, and reused
+    so their HTTP clients keep warm connections to the LLM APIs. A cached provider is rebuilt when its API key
+    environment variable changes, and `invalidate` drops cached providers explicitly.
+    """
     _providers: Dict[str, LLMProvider] = {}
+    _provider_api_keys: Dict[str, str] = {}
+    _lock = threading.Lock()
 
     _provider_classes = {
         "gemini": (GeminiProvider, "GEMINI_API_KEY"),
@@ -21,20 +28,47 @@ class LLMProviderFactory:
     }
 
     @classmethod
-    def _initialize_providers(self):
-        for name, (provider_cls, env_var) in self._provider_classes.items():
-            api_key = os.getenv(env_var)
-            if api_key:
-                self._providers[name] = provider_cls(api_key=api_key)
+    def _get_or_create_provider(self, provider_name: str) -> Optional[LLMProvider]:
+        provider_cls, env_var = self._provider_classes[provider_name]
+        api_key = os.getenv(env_var)
+
+        provider = self._providers.get(provider_name)
+        if provider is not None and self._provider_api_keys.get(provider_name) == api_key:
+            return provider
+
+        with self._lock:
+            # Another thread may have built the provider while we were waiting for the lock
+            provider = self._providers.get(provider_name)
+            if provider is not None and self._provider_api_keys.get(provider_name) == api_key:
+                return provider
+
+            self._providers.pop(provider_name, None)
+            self._provider_api_keys.pop(provider_name, None)
+            if not api_key:
+                return None
+
+            provider = provider_cls(api_key=api_key)
+            self._providers[provider_name] = provider
+            self._provider_api_keys[provider_name] = api_key
+            return provider
 
     @classmethod
     def get_provider(self, provider_name: str) -> Optional[LLMProvider]:
         """Get an instance of the specified LLM provider"""
-        self._initialize_providers()
-        return self._providers.get(provider_name, None)
+        if provider_name not in self._provider_classes:
+            return None
+        return self._get_or_create_provider(provider_name)
     
     @classmethod
     def get_available_providers(self) -> List[str]:
-        """Get a list of available LLM providers"""
-        self._initialize_providers()
-        return list(self._providers.keys())
\ No newline at end of file
+        """Get a list of available LLM providers (the ones with an API key set)"""
+        return [name for name, (_, env_var) in self._provider_classes.items() if os.getenv(env_var)]
+
+    @classmethod
+    def invalidate(self, provider_name: Optional[str] = None) -> None:
+        """Drop cached provider instances so they are rebuilt on next use (all of them if no name is given)"""
+        with self._lock:
+            names = [provider_name] if provider_name else list(self._providers.keys())
+            for name in names:
+                self._providers.pop(name, None)
+                self._provider_api_keys.pop(name, None)
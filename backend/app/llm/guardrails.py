@@ -1,48 +1,238 @@
 """
 Content moderation and safety controls for LLM interactions. This module implements a template for moderating
 LLM interactions. It only covers basic content moderation and SQL query validation.
+
+All the patterns of a check are compiled once into a single case-insensitive alternation, so prompts and responses
+are scanned in one pass whatever the number of patterns. SQL queries are checked by the token-aware validator of
+`sql_validator`, with the dangerous SQL keywords added to its read-only rules. The pattern sets can be replaced with a JSON
+file given by `GUARDRAILS_CONFIG`, for example:
+    {"banned_terms": ["hack", "credit card"], "banned_patterns": ["cpf[ .:]*[0-9]{3}"], "dangerous_sql_keywords": ["DROP"]}
 """
+import json
+import os
 import re
-from typing import Dict, Any, Tuple, List
+from typing import Iterable, Iterator, List, Optional, Tuple
+from dotenv import load_dotenv
+import logging
+
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+except ImportError:
+    import sre_parse
+
+from backend.app.db.sql_validator import WRITE_KEYWORDS, SqlValidation, validate_sql
+
 
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler("logs/database_operations.log"),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
 
-BANNED_PATTERNS = [
-    r'(?i)(hack|crack|steal|illegal|exploit)',
-    r'(?i)(personal data|credit card|social security)',
-    r'(?i)(hate speech|racial slur|offensive)'
+load_dotenv()
+GUARDRAILS_CONFIG = os.getenv("GUARDRAILS_CONFIG")
+
+# Literal terms are matched as one flat alternation, which is much faster to scan than nested regular expressions
+BANNED_TERMS = [
+    "hack", "crack", "steal", "illegal", "exploit",
+    "personal data", "credit card", "social security",
+    "hate speech", "racial slur", "offensive"
 ]
+BANNED_PATTERNS: List[str] = []  # Regular expressions, for what literal terms cannot express
+# Longest text held back by `StreamModerator` when a pattern has no maximum length (e.g. "a+")
+STREAM_HOLDBACK_MAX_CHARS = 256
+DANGEROUS_SQL_KEYWORDS = ["DROP", "DELETE", "TRUNCATE", "ALTER", "GRANT", "REVOKE"]
+
+
+class PatternSet:
+    """
+    Regular expressions compiled into a single alternation. When the patterns have no uppercase letters (like the
+    default ones), the text is lowercased and scanned with a case-sensitive pattern: the regex engine can then skip
+    to the possible first characters of a match, which IGNORECASE prevents, and long responses are scanned several
+    times faster. Other patterns, and the rare texts whose lowercase form has a different length, are matched with
+    IGNORECASE.
+    """
+
+    def __init__(self, alternatives: List[str]):
+        # Alternatives must be self-contained (literals or groups), they are joined without a group around them
+        source = "|".join(alternatives)
+        self.ignorecase_pattern = re.compile(source, re.IGNORECASE)
+        self.lowercase_pattern = None if re.search(r"(?<!\\)[A-Z]", source) else re.compile(source)
+        # Longest possible match, capped for patterns without a maximum length
+        self.max_length = min(sre_parse.parse(source, re.IGNORECASE).getwidth()[1], STREAM_HOLDBACK_MAX_CHARS)
+
+    def _scan(self, text: str) -> Tuple[re.Pattern, str]:
+        if self.lowercase_pattern is not None:
+            lowered = text.lower()
+            # Same length means every character maps to one character, so match positions stay valid
+            if len(lowered) == len(text):
+                return self.lowercase_pattern, lowered
+        return self.ignorecase_pattern, text
+
+    def finditer(self, text: str) -> Iterator[Tuple[int, int]]:
+        """Get the (start, end) positions of every match in a text"""
+        pattern, scanned = self._scan(text)
+        for match in pattern.finditer(scanned):
+            yield match.start(), match.end()
+
+    def search(self, text: str) -> Optional[str]:
+        """Get the first match in a text (as written in the text), or None"""
+        pattern, scanned = self._scan(text)
+        match = pattern.search(scanned)
+        return text[match.start():match.end()] if match else None
+
+    def sub(self, replacement: str, text: str) -> str:
+        """Replace every match in a text"""
+        parts = []
+        position = 0
+        for start, end in self.finditer(text):
+            parts.append(text[position:start])
+            parts.append(replacement)
+            position = end
+        parts.append(text[position:])
+        return "".join(parts)
+
+
+def compile_patterns(patterns: Iterable[str], terms: Iterable[str] = ()) -> Optional[PatternSet]:
+    """
+    Compile literal terms and regular expressions into a single case-insensitive alternation. A leading `(?i)` flag
+    is dropped from each pattern, since inline global flags are only allowed at the start of the combined pattern.
+
+    Returns:
+        The compiled patterns, or None if there is nothing to match
+    """
+    # Longer terms first, so "credit card" wins over a shorter term starting at the same position
+    alternatives = [re.escape(term.lower()) for term in sorted(terms, key=len, reverse=True)]
+    alternatives += ["(?:" + re.sub(r"^\(\?i\)", "", pattern) + ")" for pattern in patterns]
+    return PatternSet(alternatives) if alternatives else None
+
+
+class GuardrailEngine:
+    """Precompiled prompt, response and SQL checks"""
+
+    def __init__(self, banned_patterns: List[str], banned_terms: List[str], dangerous_sql_keywords: List[str]):
+        self.banned = compile_patterns(banned_patterns, banned_terms)
+        # Built once, the validator caches its results per query and keyword set
+        self.forbidden_sql_keywords = WRITE_KEYWORDS | {keyword.upper() for keyword in dangerous_sql_keywords}
+
+    def is_safe(self, text: str) -> bool:
+        return self.banned is None or self.banned.search(text) is None
+
+    def moderate(self, text: str) -> str:
+        return text if self.banned is None else self.banned.sub("[filtered]", text)
+
+    def validate_sql(self, sql_query: str) -> SqlValidation:
+        return validate_sql(sql_query, self.forbidden_sql_keywords)
+
+
+class StreamModerator:
+    """
+    Moderates a response streamed in pieces. A banned term can be split across pieces ("cre" + "dit card"), so the
+    last characters of the text, as many as the longest possible match, are held back until the next piece shows
+    whether they start a match. Every emitted piece is final: joined, they equal the moderated full response.
+    """
+
+    def __init__(self, engine: Optional[GuardrailEngine] = None):
+        self.engine = engine or guardrails
+        self.pending = ""  # Text received but not emitted yet
+
+    def _moderate(self, final: bool) -> str:
+        banned = self.engine.banned
+        if banned is None:
+            emitted, self.pending = self.pending, ""
+            return emitted
+        # A match starting before `cut` cannot grow with the next pieces, anything after it still can
+        cut = len(self.pending) if final else len(self.pending) - banned.max_length
+        parts = []
+        position = 0
+        for start, end in banned.finditer(self.pending):
+            if start >= cut:
+                break
+            parts.append(self.pending[position:start])
+            parts.append("[filtered]")
+            position = end
+        if position < cut:
+            parts.append(self.pending[position:cut])
+            position = cut
+        self.pending = self.pending[position:]
+        return "".join(parts)
+
+    def feed(self, text: str) -> str:
+        """Add a piece of the response, and get the moderated text that can be emitted (possibly empty)"""
+        self.pending += text
+        return self._moderate(final=False)
+
+    def flush(self) -> str:
+        """Get the rest of the moderated response, once the stream is over"""
+        return self._moderate(final=True)
+
+
+def load_guardrails(path: Optional[str] = None) -> GuardrailEngine:
+    """
+    Build the guardrail engine from the default pattern sets, replaced by the ones of the JSON config file (if any).
+    An unreadable or invalid config is logged and the defaults are used.
+    """
+    defaults = {
+        "banned_patterns": BANNED_PATTERNS,
+        "banned_terms": BANNED_TERMS,
+        "dangerous_sql_keywords": DANGEROUS_SQL_KEYWORDS,
+    }
+    path = path or GUARDRAILS_CONFIG
+    if path:
+        try:
+            with open(path, encoding="utf-8") as config_file:
+                loaded = json.load(config_file)
+            engine = GuardrailEngine(**{key: list(loaded.get(key, value)) for key, value in defaults.items()})
+            logger.info(f"Loaded guardrails config from {path}")
+            return engine
+        except (OSError, ValueError, TypeError, AttributeError, re.error) as e:
+            logger.error(f"Invalid guardrails config {path}, using the default patterns: {e}")
+    return GuardrailEngine(**defaults)
+
+
+guardrails = load_guardrails()
+
 
 def validate_user_prompt(prompt: str) -> bool:
     """
     Check if the prompt contains inappropriate content.
-    
+
     Args:
         prompt: The user input to check
-        
+
     Returns:
-        Tuple of (is_safe, message)
+        True if the prompt is safe
     """
-    for pattern in BANNED_PATTERNS:
-        if re.search(pattern, prompt):
-            return False
-    
-    return True
+    return guardrails.is_safe(prompt)
 
 def moderate_response(response: str) -> str:
     """
     Filter out potentially harmful content from responses.
-    
+
     Args:
         response: The LLM response to filter
-        
+
     Returns:
         Filtered response
     """
     # TODO: Replace with more sophisticated filtering
-    for pattern in BANNED_PATTERNS:
-        response = re.sub(pattern, "[filtered]", response, flags=re.IGNORECASE)
-    
-    return response
+    return guardrails.moderate(response)
+
+def validate_sql_query(sql_query: str) -> SqlValidation:
+    """
+    Check that a SQL query is a single read-only SELECT statement, without dangerous keywords.
+
+    Args:
+        sql_query: The SQL query to check
+
+    Returns:
+        The validation result, with the rejection "code" and "reason" and the tables read by the query
+    """
+    return guardrails.validate_sql(sql_query)
 
 
 ALLOWED_TABLES = ["clientes"]
@@ -50,32 +240,65 @@ ALLOWED_TABLES = ["clientes"]
 def validate_table_access(sql_query: str) -> Tuple[bool, str]:
     """
     Validate that the query only accesses allowed tables.
-    
+
     Args:
         sql_query: The SQL query to validate
-        
+
     Returns:
         Tuple of (is_allowed, message)
     """
-    tables_in_query = re.findall(r'(?i)from\s+([a-z0-9_]+)', sql_query)
-    tables_in_query += re.findall(r'(?i)join\s+([a-z0-9_]+)', sql_query)
-    
-    for table in tables_in_query:
-        if table.lower() not in ALLOWED_TABLES:
+    # Tables read through joins, subqueries and CTEs, without the CTE names
+    for table in sorted(validate_sql(sql_query).tables):
+        if table not in ALLOWED_TABLES:
             return False, f"Access to table '{table}' is not allowed."
-    
+
     return True, ""
 
 
+def _benchmark(repeat: int = 200) -> None:
+    """Compare the compiled checks with one regex call per pattern on a long response"""
+    import timeit
+
+    long_response = ("The bad payer rate in SP is 12.3%, higher than in RJ. " * 2000) + "Here is some personal data."
+    # The previous implementation: one regular expression per group of terms, each run separately
+    per_pattern = [
+        r'(?i)(hack|crack|steal|illegal|exploit)',
+        r'(?i)(personal data|credit card|social security)',
+        r'(?i)(hate speech|racial slur|offensive)'
+    ]
+
+    def moderate_per_pattern(text: str) -> str:
+        for pattern in per_pattern:
+            text = re.sub(pattern, "[filtered]", text, flags=re.IGNORECASE)
+        return text
+
+    def validate_per_pattern(text: str) -> bool:
+        return not any(re.search(pattern, text) for pattern in per_pattern)
+
+    assert moderate_per_pattern(long_response) == moderate_response(long_response)
+    print(f"Response of {len(long_response)} characters, {repeat} calls each:")
+    for name, function in [
+        ("moderate_response (per pattern)", lambda: moderate_per_pattern(long_response)),
+        ("moderate_response (compiled)", lambda: moderate_response(long_response)),
+        ("validate_user_prompt (per pattern)", lambda: validate_per_pattern(long_response)),
+        ("validate_user_prompt (compiled)", lambda: validate_user_prompt(long_response)),
+    ]:
+        seconds = timeit.timeit(function, number=repeat)
+        print(f"  {name}: {seconds / repeat * 1e6:.1f} us/call")
+
+
 if __name__ == "__main__":
     prompt = "Can you hack into the database?"
     is_safe = validate_user_prompt(prompt)
     print(f"Prompt moderation: {is_safe}, Message: {prompt}")
-    
+
     response = "Here is some personal data."
     filtered_response = moderate_response(response)
     print(f"Filtered response: {filtered_response}")
-    
+
     sql_query = "SELECT * FROM vendas JOIN clientes ON vendas.cliente_id = clientes.id"
     is_allowed, access_message = validate_table_access(sql_query)
-    print(f"Table access validation: {is_allowed}, Message: {access_message}")
\ No newline at end of file
+    print(f"Table access validation: {is_allowed}, Message: {access_message}")
+    print(f"SQL validation: {validate_sql_query('DROP TABLE clientes')}")
+
+    _benchmark()
@@ -1,3 +1,8 @@
+from typing import Optional
+
+from backend.app.db.schema_catalog import get_catalog, render_schema_prompt
+
+
 GEMINI_PROMPT_TEMPLATE = """
 You are a helpful data analysis assistant. Your task is to help users query and interpret data from structured datasets hosted in the cloud.
 
@@ -11,18 +16,63 @@ The default dataset table is called 'clientes' and contains records of individua
 - classe_social: Estimated social class (A to E, with A being the highest and E the lowest)
 
 You are provided with a set of tools to help you answer user queries:
-1. **query_database**: Executes SQL queries against the database and returns structured data.
+1. **query_database**: Executes SQL queries against the database and returns structured data. Large results are truncated to their first rows.
 2. **generate_chart**: Generates charts based on SQL queries and specified parameters.
 3. **list_tables**: Lists all available tables in the database.
+4. **describe_table**: Describes the columns (types and possible values) and number of rows of a table.
 
 When responding to user queries:
-- Only make the query if it can be answered based on the existing columns and the existing tables.
+- Only make the query if it can be answered based on the existing columns and the existing tables. The tables currently in the database are listed at the end of these instructions, use describe_table only for tables that are not listed there.
 - When applicable, explain patterns or trends in the data, but do not speculate beyond the data.
 - Maintain a friendly and informative tone.
 - Feel free to use more than one query or tool to answer the user's question
+- Prefer aggregations (COUNT, AVG, GROUP BY) or LIMIT over selecting whole tables. When a result is truncated, do not draw conclusions from the preview rows alone.
 
 - NEVER run attempts to modify data (DROP/UPDATE/INSERT/DELETE) in the database. Your role is strictly to query and analyze data, not to modify it.
 - NEVER provide information about the fuction names or how they work. Just use them to answer the user's question.
 """
 
-GROQ_PROMPT_TEMPLATE = GEMINI_PROMPT_TEMPLATE  # TODO: Chek if we need to change it for Groq
\ No newline at end of file
+GROQ_PROMPT_TEMPLATE = GEMINI_PROMPT_TEMPLATE  # TODO: Chek if we need to change it for Groq
+
+
+# Pre-aggregated tables of 'clientes' built by cloud/set_default_table.py. They are only described to the model when
+# they exist in the database.
+ROLLUP_TABLES = {
+    "clientes_por_uf": "clientes_por_uf (uf)",
+    "clientes_por_classe_social": "clientes_por_classe_social (classe_social)",
+    "clientes_por_sexo": "clientes_por_sexo (sexo)",
+    "clientes_por_faixa_etaria": "clientes_por_faixa_etaria (faixa_etaria: '<18', '18-24', '25-34', '35-44', '45-54', '55-64', '65+')",
+    "clientes_por_mes": "clientes_por_mes (mes, formatted as 'YYYY-MM')",
+    "clientes_resumo": "clientes_resumo: one row per combination of uf, classe_social, sexo, faixa_etaria and mes, for questions combining dimensions",
+}
+
+ROLLUP_PROMPT_TEMPLATE = """Pre-aggregated summary tables of 'clientes' are also available. They are much faster than scanning 'clientes', so prefer them whenever a question only needs counts, rates or averages by these dimensions:
+{tables}
+Every summary table has the columns total_clientes, maus_pagadores (number of bad payers), obitos (number of deaths), soma_idade (sum of ages), taxa_inadimplencia (bad payer rate of the row) and idade_media (average age of the row).
+When adding rows of a summary table up, SUM the counts and compute rates and averages from the sums (e.g. SUM(maus_pagadores) * 1.0 / SUM(total_clientes), SUM(soma_idade) * 1.0 / SUM(total_clientes)). Never average taxa_inadimplencia or idade_media across rows.
+Use 'clientes' itself only for questions the summary tables cannot answer (e.g. exact ages or individual records).
+"""
+
+
+def render_rollup_prompt(url: Optional[str] = None) -> str:
+    """Describe the summary tables of 'clientes' present in the database (cached schema catalog), if any"""
+    try:
+        existing = {name.lower() for name in get_catalog(url).table_names()}
+    except Exception:
+        return ""  # The schema part of the prompt logs the error
+    tables = [description for name, description in ROLLUP_TABLES.items() if name in existing]
+    if not tables:
+        return ""
+    return ROLLUP_PROMPT_TEMPLATE.format(tables="\n".join(f"- {table}" for table in tables))
+
+
+def build_system_prompt(template: str, url: Optional[str] = None) -> str:
+    """
+    Add the summary tables that exist and the compact schema of the database tables (from the cached schema catalog)
+    to a prompt template
+    """
+    prompt = template
+    for part in (render_rollup_prompt(url), render_schema_prompt(url)):
+        if part:
+            prompt = f"{prompt}\n{part}\n"
+    return prompt
@@ -2,13 +2,72 @@
 Script to define the base class for LLM providers. This class outlines the methods that any LLM provider 
 must implement, such as generating responses and retrieving available models.
 """
+import asyncio
+import contextvars
+import json
+import os
+import threading
+import time
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any, Optional
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import List, Dict, Any, Callable, Iterator, Optional, Tuple, Union
+from backend.app.db.engine import DB_MAX_OVERFLOW, DB_POOL_SIZE
 from backend.app.db.models import ChatMessage
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+# As many tools as the database pool has connections can run at once, more would only wait for a connection
+TOOL_MAX_WORKERS = int(os.getenv("TOOL_MAX_WORKERS", str(DB_POOL_SIZE + DB_MAX_OVERFLOW)))
+TOOL_TIMEOUT_SECONDS = float(os.getenv("TOOL_TIMEOUT_SECONDS", "30"))
+
+# Limits of the agent loop (model call -> tool calls -> model call ...). Once either is reached, the model is
+# asked for a final answer without tools.
+AGENT_MAX_ITERATIONS = int(os.getenv("AGENT_MAX_ITERATIONS", "5"))
+AGENT_DEADLINE_SECONDS = float(os.getenv("AGENT_DEADLINE_SECONDS", "60"))
+# Between the texts of successive rounds of the agent loop
+ROUND_SEPARATOR = "\n\n"
+
+# Shared by all providers, so the number of tools querying the database at the same time stays bounded. A running
+# tool cannot be stopped from here, the queries are stopped by the database statement timeout (see `engine`).
+_tool_executor = ThreadPoolExecutor(max_workers=TOOL_MAX_WORKERS, thread_name_prefix="agent-tool")
+
+
+class _ToolRun:
+    """A tool call submitted to the executor, which records when it starts running (its timeout starts then)"""
+
+    def __init__(self, function: Callable, *args: Any, on_start: Optional[Callable[[], None]] = None):
+        # Each call gets its own copy of the context (a context cannot be entered by two threads at once)
+        self.context = contextvars.copy_context()
+        self.function = function
+        self.args = args
+        self.on_start = on_start
+        self.started_at: Optional[float] = None
+        self.started = threading.Event()
+
+    def __call__(self) -> Any:
+        self.started_at = time.monotonic()
+        self.started.set()
+        if self.on_start:
+            self.on_start()
+        return self.context.run(self.function, *self.args)
+
+
+def _timeout_error(function_name: str, timeout: float, queued: bool = False) -> Dict[str, str]:
+    if queued:
+        message = f"Tool {function_name} could not start within {timeout} seconds, the server is busy"
+    else:
+        message = f"Tool {function_name} timed out after {timeout} seconds"
+    logger.warning(message)
+    return {"error": message}
 
 
 class LLMProvider(ABC):
     """Base class for LLM providers"""
+
+    # Tools the provider can execute itself, by name (used by `execute_tool_calls`)
+    available_functions: Dict[str, Callable] = {}
     
     @abstractmethod
     def generate_response(self, 
@@ -28,10 +87,277 @@ class LLMProvider(ABC):
             top_k: Controls diversity by limiting to top K tokens
             
         Returns:
-            Dictionary containing the response text and any additional data (charts, etc.)
+            Dictionary containing the response text and any additional data (charts, etc.). Failed generations set
+            "error" to True, so their text is not cached.
         """
         pass
     
+    async def agenerate_response(self,
+                                 prompt: str,
+                                 messages: List[ChatMessage],
+                                 model: Optional[str] = None,
+                                 temperature: float = 0.2,
+                                 top_p: float = 0.95,
+                                 top_k: int = 30) -> Dict[str, Any]:
+        """
+        Async version of `generate_response`. Providers with async clients override this method so no thread is
+        held while waiting for the LLM, the default implementation runs `generate_response` in a worker thread.
+        """
+        kwargs = {"model": model} if model else {}
+        return await asyncio.to_thread(self.generate_response, prompt=prompt, messages=messages,
+                                       temperature=temperature, top_p=top_p, top_k=top_k, **kwargs)
+
+    def stream_response(self,
+                        prompt: str,
+                        messages: List[ChatMessage],
+                        model: Optional[str] = None,
+                        temperature: float = 0.2,
+                        top_p: float = 0.95,
+                        top_k: int = 30) -> Iterator[Dict[str, Any]]:
+        """
+        Generate a response as a stream of events. Providers that support streaming override this method, the
+        default implementation yields the whole response of `generate_response` as a single delta.
+
+        Events are dictionaries with a "type" key:
+            delta: {"text"} - A piece of the response text
+            tool_start: {"name", "args"} - A tool started running
+            tool_end: {"name", "success"} - A tool finished running
+            chart: {"chart_data"} - Chart payload produced by generate_chart
+            done: {"response", "chart_data", "error"} - Full response text, always the last event ("error" is
+                True when the generation failed)
+        """
+        kwargs = {"model": model} if model else {}
+        result = self.generate_response(prompt=prompt, messages=messages, temperature=temperature,
+                                        top_p=top_p, top_k=top_k, **kwargs)
+        yield {"type": "delta", "text": result["response"]}
+        if result.get("chart_data"):
+            yield {"type": "chart", "chart_data": result["chart_data"]}
+        yield {"type": "done", "response": result["response"], "chart_data": result.get("chart_data"),
+               "error": result.get("error", False)}
+
+    def execute_tool(self, function_name: str, arguments: Union[str, Dict[str, Any], None]) -> Any:
+        """
+        Run one of the available functions. Arguments can be a dictionary or a JSON string. Errors are returned
+        as a dictionary with an "error" key so the model can react to them.
+        """
+        function_to_call = self.available_functions.get(function_name)
+        if not function_to_call:
+            return {"error": f"Unknown function: {function_name}"}
+
+        try:
+            function_args = json.loads(arguments or "{}") if isinstance(arguments, str) else (arguments or {})
+            return function_to_call(**function_args)
+        except Exception as e:
+            logger.error(f"Error executing tool {function_name}: {e}")
+            return {"error": str(e)}
+
+    def execute_tool_calls(self, tool_calls: List[Tuple[str, Any]], timeout: Optional[float] = None) -> List[Any]:
+        """
+        Run the tool calls of one model turn concurrently on the shared, bounded executor.
+
+        Args:
+            tool_calls: List of (function name, arguments) tuples
+            timeout: Seconds each tool may run, counted from when it starts (TOOL_TIMEOUT_SECONDS by default). A tool
+                that waits as long for a free worker is not run.
+
+        Returns:
+            The result of each tool call, in the same order as `tool_calls`. Tools that time out get an error result.
+        """
+        timeout = TOOL_TIMEOUT_SECONDS if timeout is None else timeout
+        submitted_at = time.monotonic()
+        runs = []
+        for function_name, arguments in tool_calls:
+            run = _ToolRun(self.execute_tool, function_name, arguments)
+            runs.append((run, _tool_executor.submit(run)))
+
+        results = []
+        for (function_name, _), (run, future) in zip(tool_calls, runs):
+            if not run.started.wait(timeout=max(0.0, submitted_at + timeout - time.monotonic())) and future.cancel():
+                results.append(_timeout_error(function_name, timeout, queued=True))
+                continue
+            run.started.wait()  # Started just as it was cancelled
+            try:
+                results.append(future.result(timeout=max(0.0, run.started_at + timeout - time.monotonic())))
+            except FutureTimeoutError:
+                results.append(_timeout_error(function_name, timeout))
+        return results
+
+    async def aexecute_tool_calls(self, tool_calls: List[Tuple[str, Any]], timeout: Optional[float] = None) -> List[Any]:
+        """Async version of `execute_tool_calls`, awaiting the tools without blocking the event loop"""
+        timeout = TOOL_TIMEOUT_SECONDS if timeout is None else timeout
+        loop = asyncio.get_running_loop()
+
+        async def run(function_name: str, arguments: Any) -> Any:
+            started = asyncio.Event()
+            tool_run = _ToolRun(self.execute_tool, function_name, arguments,
+                                on_start=lambda: loop.call_soon_threadsafe(started.set))
+            future = _tool_executor.submit(tool_run)
+            try:
+                await asyncio.wait_for(started.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                if future.cancel():
+                    return _timeout_error(function_name, timeout, queued=True)
+                await started.wait()  # Started just as it was cancelled
+            try:
+                remaining = max(0.0, tool_run.started_at + timeout - time.monotonic())
+                return await asyncio.wait_for(asyncio.wrap_future(future), timeout=remaining)
+            except asyncio.TimeoutError:
+                return _timeout_error(function_name, timeout)
+
+        return list(await asyncio.gather(*(run(name, arguments) for name, arguments in tool_calls)))
+
+    def _agent_loop_steps(self,
+                          append_tool_results: Callable[[Dict[str, Any], List[Any]], None],
+                          max_iterations: Optional[int] = None,
+                          deadline_seconds: Optional[float] = None) -> Iterator[Tuple]:
+        """
+        The agent loop logic (iterations, deadline, metrics), shared by the sync, streaming and async loops, which
+        only run what it asks for. Yields the steps:
+            ("call_model", allow_tools, separator): the turn must be sent back. `separator` is the text to stream
+                before the turn's text, so the streamed text matches the final response.
+            ("run_tools", tool_calls, timeout): the tool results must be sent back
+            ("event", event): an event of `stream_response`, the last one is "done"
+
+        The final response joins the text of every round (e.g. "Let me check the data." before the tool calls and
+        the answer after them), so the streamed and the stored answers are the same.
+        """
+        max_iterations = max_iterations or AGENT_MAX_ITERATIONS
+        deadline_seconds = deadline_seconds or AGENT_DEADLINE_SECONDS
+        started_at = time.monotonic()
+        deadline = started_at + deadline_seconds
+
+        rounds = []
+        chart_data = None
+        texts = []
+        for iteration in range(1, max_iterations + 1):
+            remaining = deadline - time.monotonic()
+            # The last round, or a round started after the deadline, must produce the final answer
+            allow_tools = iteration < max_iterations and remaining > 0
+
+            round_started_at = time.monotonic()
+            turn = yield ("call_model", allow_tools, ROUND_SEPARATOR if texts else "")
+            round_metrics = {"round": iteration, "model_seconds": round(time.monotonic() - round_started_at, 3),
+                             "tool_seconds": 0.0, "tool_calls": [call["name"] for call in turn["tool_calls"]]}
+            rounds.append(round_metrics)
+            if turn["content"]:
+                texts.append(turn["content"])
+
+            if not turn["tool_calls"]:
+                break
+
+            for call in turn["tool_calls"]:
+                yield ("event", {"type": "tool_start", "name": call["name"], "args": call["arguments"]})
+
+            tools_started_at = time.monotonic()
+            results = yield (
+                "run_tools",
+                [(call["name"], call["arguments"]) for call in turn["tool_calls"]],
+                max(1.0, min(TOOL_TIMEOUT_SECONDS, deadline - tools_started_at))
+            )
+            round_metrics["tool_seconds"] = round(time.monotonic() - tools_started_at, 3)
+
+            for call, result in zip(turn["tool_calls"], results):
+                failed = isinstance(result, dict) and ("error" in result or result.get("success") is False)
+                yield ("event", {"type": "tool_end", "name": call["name"], "success": not failed})
+                if call["name"] == "generate_chart" and not failed:
+                    chart_data = result
+                    yield ("event", {"type": "chart", "chart_data": chart_data})
+
+            append_tool_results(turn, results)
+
+        metrics = {"total_seconds": round(time.monotonic() - started_at, 3), "rounds": rounds}
+        logger.info(f"Agent loop finished in {metrics['total_seconds']}s after {len(rounds)} round(s): {rounds}")
+        yield ("event", {"type": "done", "response": ROUND_SEPARATOR.join(texts), "chart_data": chart_data,
+                         "metrics": metrics})
+
+    def iter_agent_loop(self,
+                        call_model: Callable[[bool], Iterator[Dict[str, Any]]],
+                        append_tool_results: Callable[[Dict[str, Any], List[Any]], None],
+                        max_iterations: Optional[int] = None,
+                        deadline_seconds: Optional[float] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Run the agent loop: call the model, run the tools it asks for, feed the results back and repeat until the
+        model answers without tools. Yields the same events as `stream_response`, ending with a "done" event that
+        also carries per-round timing metrics.
+
+        Args:
+            call_model: Generator function called with `allow_tools`. It may yield delta events while the model
+                answers, and must return the turn as {"content": str, "tool_calls": [{"id", "name", "arguments"}]}
+            append_tool_results: Called with the turn and its tool results to add them to the conversation
+            max_iterations: Maximum number of model calls (AGENT_MAX_ITERATIONS by default)
+            deadline_seconds: Wall-clock budget for the whole loop (AGENT_DEADLINE_SECONDS by default)
+        """
+        steps = self._agent_loop_steps(append_tool_results, max_iterations, deadline_seconds)
+        reply = None
+        while True:
+            try:
+                step = steps.send(reply)
+            except StopIteration:
+                return
+            reply = None
+            if step[0] == "event":
+                yield step[1]
+            elif step[0] == "call_model":
+                reply = yield from self._stream_turn(call_model(step[1]), step[2])
+            else:
+                reply = self.execute_tool_calls(step[1], timeout=step[2])
+
+    def _stream_turn(self, turn_events: Iterator[Dict[str, Any]], separator: str) -> Iterator[Dict[str, Any]]:
+        """Forward the events of a model turn, with the separator before its first text, and return the turn"""
+        while True:
+            try:
+                event = next(turn_events)
+            except StopIteration as stop:
+                return stop.value
+            if separator and event["type"] == "delta" and event["text"]:
+                yield {"type": "delta", "text": separator}
+                separator = ""
+            yield event
+
+    def run_agent_loop(self,
+                       call_model: Callable[[bool], Dict[str, Any]],
+                       append_tool_results: Callable[[Dict[str, Any], List[Any]], None],
+                       max_iterations: Optional[int] = None,
+                       deadline_seconds: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Non-streaming version of `iter_agent_loop`, where `call_model` simply returns the turn.
+
+        Returns:
+            Dictionary with the final response, the last chart payload and the loop metrics
+        """
+        def call_model_once(allow_tools: bool):
+            return call_model(allow_tools)
+            yield  # Makes this function a generator without yielding anything
+
+        for event in self.iter_agent_loop(call_model_once, append_tool_results, max_iterations, deadline_seconds):
+            if event["type"] == "done":
+                return {"response": event["response"], "chart_data": event["chart_data"], "metrics": event["metrics"]}
+
+    async def arun_agent_loop(self,
+                              call_model: Callable[[bool], Any],
+                              append_tool_results: Callable[[Dict[str, Any], List[Any]], None],
+                              max_iterations: Optional[int] = None,
+                              deadline_seconds: Optional[float] = None) -> Dict[str, Any]:
+        """Async version of `run_agent_loop`, where `call_model` is a coroutine function"""
+        steps = self._agent_loop_steps(append_tool_results, max_iterations, deadline_seconds)
+        reply = None
+        result = None
+        while True:
+            try:
+                step = steps.send(reply)
+            except StopIteration:
+                return result
+            reply = None
+            if step[0] == "event":
+                if step[1]["type"] == "done":
+                    event = step[1]
+                    result = {"response": event["response"], "chart_data": event["chart_data"],
+                              "metrics": event["metrics"]}
+            elif step[0] == "call_model":
+                reply = await call_model(step[1])
+            else:
+                reply = await self.aexecute_tool_calls(step[1], timeout=step[2])
+
     @abstractmethod
     def get_available_models(self) -> List[str]:
         """Return a list of available models for this provider"""
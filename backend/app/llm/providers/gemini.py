@@ -2,13 +2,15 @@
 Google Gemini LLM Provider Implementation. This module implements the GeminiProvider class, which interacts with the 
 Google Gemini API to generate responses based on user prompts and conversation history.
 """
+import asyncio
 from google import genai
 from google.genai import types
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterator, Optional
 
 from backend.app.llm.providers.base import LLMProvider
-from backend.app.llm.agent_functions import query_database, generate_chart, list_tables
-from backend.app.llm.prompt_templates import GEMINI_PROMPT_TEMPLATE
+from backend.app.llm.agent_functions import query_database, generate_chart, list_tables, describe_table
+from backend.app.llm.prompt_templates import GEMINI_PROMPT_TEMPLATE, build_system_prompt
+from backend.app.llm.tool_context import ToolInvocationContext
 
 from backend.app.db.models import ChatMessage
 import logging
@@ -24,6 +26,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+TOOLS = (query_database, generate_chart, list_tables, describe_table)
+
+
 class GeminiProvider(LLMProvider):
     """Google Gemini provider implementation"""
 
@@ -33,19 +38,17 @@ class GeminiProvider(LLMProvider):
             "gemini-2.0-flash", "gemini-1.5-flash", "gemini-1.5-pro",
         ]
 
-    def generate_response(self, prompt: str, messages: List[ChatMessage], model: str = "gemini-2.0-flash",
-                          temperature: float = 0.2, top_p: float = 0.95, top_k: int = 30) -> Dict[str, Any]:
-        """Generate a response using Google Gemini"""
-        
-        logger.info(f"Generating response with model: {model}, temperature: {temperature}, top_p: {top_p}, top_k: {top_k}")
-        config = types.GenerateContentConfig(
-            system_instruction=GEMINI_PROMPT_TEMPLATE,
-            tools=[query_database, generate_chart, list_tables],
+    def _build_config(self, tools: list, system_prompt: str, temperature: float, top_p: float,
+                      top_k: int) -> types.GenerateContentConfig:
+        return types.GenerateContentConfig(
+            system_instruction=system_prompt,
+            tools=tools,
             temperature=temperature,
             top_p=top_p,
             top_k=top_k
         )
 
+    def _build_history(self, messages: List[ChatMessage]) -> List[types.Content]:
         # Create a conversation history in Gemini format
         history = []
         for msg in messages:
@@ -54,39 +57,112 @@ class GeminiProvider(LLMProvider):
                 parts=[types.Part(text=msg.content)]
             )
             history.append(content)
+        return history
+
+    def generate_response(self, prompt: str, messages: List[ChatMessage], model: str = "gemini-2.0-flash",
+                          temperature: float = 0.2, top_p: float = 0.95, top_k: int = 30) -> Dict[str, Any]:
+        """Generate a response using Google Gemini"""
+        
+        logger.info(f"Generating response with model: {model}, temperature: {temperature}, top_p: {top_p}, top_k: {top_k}")
+        config = self._build_config(list(TOOLS), build_system_prompt(GEMINI_PROMPT_TEMPLATE), temperature, top_p, top_k)
+        history = self._build_history(messages)
 
         try:
-            response = self.client.models.generate_content(
-                model=model,
-                contents=history,
-                config=config,
-            )
+            # Tool results are captured as the SDK runs them, so charts do not need to be queried again
+            with ToolInvocationContext() as tool_context:
+                response = self.client.models.generate_content(
+                    model=model,
+                    contents=history,
+                    config=config,
+                )
         except Exception as e:
             # TODO: Handle specific exceptions if needed. Stop sending the error to the frontend.
             logger.error(f"Error generating response: {str(e)}")
-            return {"response": f"Error generating response: {str(e)}", "chart_data": None}
+            return {"response": f"Error generating response: {str(e)}", "chart_data": None, "error": True}
         
         response_text = str(response.text)
 
-        # As the agent cannot directly return function call results, we need to check the response for function calls
-        # and responses. So we will look for function calls to produce charts on the frontend.
-        chart_data = None
-        if hasattr(response, 'automatic_function_calling_history'):
-            for content in response.automatic_function_calling_history:
-                if hasattr(content, 'parts'):
-                    for part in content.parts:
-                        if hasattr(part, 'function_call') and part.function_call and part.function_call.name == "generate_chart":
-                            params = part.function_call.args
-                            chart_data = generate_chart(**params)
-                        
-                        if hasattr(part, 'function_response') and part.function_response and part.function_response.name == "generate_chart":
-                            if 'result' in part.function_response.response:
-                                chart_data = part.function_response.response['result']
+        # As the agent cannot directly return function call results, we take the chart payload
+        # recorded when the SDK executed generate_chart to produce charts on the frontend.
+        chart_data = tool_context.last_result("generate_chart")
         
         return {
             "response": response_text,
             "chart_data": chart_data
         }
+
+    async def agenerate_response(self, prompt: str, messages: List[ChatMessage], model: str = "gemini-2.0-flash",
+                                 temperature: float = 0.2, top_p: float = 0.95, top_k: int = 30) -> Dict[str, Any]:
+        """Generate a response using the async Google Gemini client"""
+        logger.info(f"Generating async response with model: {model}, temperature: {temperature}, top_p: {top_p}, top_k: {top_k}")
+
+        # Tools are awaited by the SDK and run in worker threads, recording their results in the context
+        tool_context = ToolInvocationContext()
+        tools = [tool_context.bind_async(tool) for tool in TOOLS]
+        # The schema catalog may have to introspect the database, which must not block the event loop
+        system_prompt = await asyncio.to_thread(build_system_prompt, GEMINI_PROMPT_TEMPLATE)
+        config = self._build_config(tools, system_prompt, temperature, top_p, top_k)
+        history = self._build_history(messages)
+
+        try:
+            response = await self.client.aio.models.generate_content(
+                model=model,
+                contents=history,
+                config=config,
+            )
+        except Exception as e:
+            # TODO: Handle specific exceptions if needed. Stop sending the error to the frontend.
+            logger.error(f"Error generating response: {str(e)}")
+            return {"response": f"Error generating response: {str(e)}", "chart_data": None, "error": True}
+
+        return {
+            "response": str(response.text),
+            "chart_data": tool_context.last_result("generate_chart")
+        }
+
+    def stream_response(self, prompt: str, messages: List[ChatMessage], model: str = "gemini-2.0-flash",
+                        temperature: float = 0.2, top_p: float = 0.95, top_k: int = 30) -> Iterator[Dict[str, Any]]:
+        """Generate a response using Google Gemini, streaming text deltas and tool events"""
+        logger.info(f"Streaming response with model: {model}, temperature: {temperature}, top_p: {top_p}, top_k: {top_k}")
+
+        # The stream may be consumed from different threads, so the tools are bound to the context explicitly
+        tool_context = ToolInvocationContext()
+        tools = [tool_context.bind(tool) for tool in TOOLS]
+        config = self._build_config(tools, build_system_prompt(GEMINI_PROMPT_TEMPLATE), temperature, top_p, top_k)
+        history = self._build_history(messages)
+
+        response_text = ""
+        failed = False
+        try:
+            for chunk in self.client.models.generate_content_stream(model=model, contents=history, config=config):
+                # Tools run inside the SDK between chunks, so their events are forwarded before the next text
+                yield from self._tool_events(tool_context)
+
+                text = self._chunk_text(chunk)
+                if text:
+                    response_text += text
+                    yield {"type": "delta", "text": text}
+        except Exception as e:
+            logger.error(f"Error streaming response: {str(e)}")
+            response_text = f"Error generating response: {str(e)}"
+            failed = True
+            yield {"type": "delta", "text": response_text}
+
+        yield from self._tool_events(tool_context)
+        yield {"type": "done", "response": response_text, "chart_data": tool_context.last_result("generate_chart"),
+               "error": failed}
+
+    def _tool_events(self, tool_context: ToolInvocationContext) -> Iterator[Dict[str, Any]]:
+        for event in tool_context.drain_events():
+            yield event
+            if event["type"] == "tool_end" and event["name"] == "generate_chart" and event["success"]:
+                yield {"type": "chart", "chart_data": tool_context.last_result("generate_chart")}
+
+    def _chunk_text(self, chunk: types.GenerateContentResponse) -> str:
+        # Reading chunk.text logs a warning when the chunk only has function calls, so the parts are read directly
+        if not chunk.candidates or not chunk.candidates[0].content or not chunk.candidates[0].content.parts:
+            return ""
+        return "".join(part.text for part in chunk.candidates[0].content.parts if part.text and not part.thought)
     
     def get_available_models(self) -> List[str]:
         """Return a list of available models for Gemini"""
@@ -1,18 +1,19 @@
 """
 Groq LLM Provider. Groq is a cloud-based LLM provider that offers several models for generating text responses.
 """
+import asyncio
 import json
-from groq import Groq
+from groq import Groq, AsyncGroq
 from google import genai
 from google.genai import types
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterator, Optional
 
 from backend.app.llm.providers.base import LLMProvider
 from backend.app.llm.agent_functions import (
-    query_database, generate_chart, list_tables,
-    query_database_declaration, generate_chart_declaration, list_tables_declaration
+    query_database, generate_chart, list_tables, describe_table,
+    query_database_declaration, generate_chart_declaration, list_tables_declaration, describe_table_declaration
 )
-from backend.app.llm.prompt_templates import GROQ_PROMPT_TEMPLATE
+from backend.app.llm.prompt_templates import GROQ_PROMPT_TEMPLATE, build_system_prompt
 
 from backend.app.db.models import ChatMessage
 import logging
@@ -34,6 +35,7 @@ class GroqProvider(LLMProvider):
     def __init__(self, api_key: str):
         self.api_key = api_key
         self.client = Groq(api_key=api_key)
+        self.async_client = AsyncGroq(api_key=api_key)
         self.available_models = [
             "llama-3.3-70b-versatile", "qwen-qwq-32b", "deepseek-r1-distill-llama-70b"
         ]
@@ -63,26 +65,31 @@ class GroqProvider(LLMProvider):
                     "description": list_tables_declaration["description"],
                     "parameters": list_tables_declaration["parameters"]
                 }
+            },
+            {
+                "type": "function",
+                "function": {
+                    "name": describe_table_declaration["name"],
+                    "description": describe_table_declaration["description"],
+                    "parameters": describe_table_declaration["parameters"]
+                }
             }
         ]
 
         self.available_functions = {
             "query_database": query_database,
             "generate_chart": generate_chart,
-            "list_tables": list_tables
+            "list_tables": list_tables,
+            "describe_table": describe_table
         }
     
-    def generate_response(self, prompt: str, messages: List[ChatMessage], model: str = "llama-3.3-70b-versatile",
-                          temperature: float = 0.2, top_p: float = 0.95, top_k: int = 30) -> Dict[str, Any]:
-        """Generate a response using Groq API"""
-        logger.info(f"Generating response with model: {model}, temperature: {temperature}, top_p: {top_p}, top_k: {top_k}")
-
+    def _format_messages(self, prompt: str, messages: List[ChatMessage]) -> List[Dict[str, Any]]:
         # Format messages for Groq API
         formatted_messages = []
-        # Add system message
+        # Add system message, with the schema of the database tables
         formatted_messages.append({
             "role": "system",
-            "content": GROQ_PROMPT_TEMPLATE
+            "content": build_system_prompt(GROQ_PROMPT_TEMPLATE)
         })
         for msg in messages:
             formatted_messages.append({
@@ -96,87 +103,148 @@ class GroqProvider(LLMProvider):
                 "role": "user",
                 "content": prompt
             })
+        return formatted_messages
 
-        try:
+    def _completion_kwargs(self, model: str, formatted_messages: List[Dict[str, Any]], allow_tools: bool,
+                           temperature: float, top_p: float) -> Dict[str, Any]:
+        kwargs = {
+            "model": model,
+            "messages": formatted_messages,
+            "max_tokens": 1024,
+            "temperature": temperature,
+            "top_p": top_p
+        }
+        # Without tools the model has to answer with the information it already has
+        if allow_tools:
+            kwargs.update({"tools": self.tools, "tool_choice": "auto"})
+        return kwargs
+
+    def _parse_turn(self, response_message) -> Dict[str, Any]:
+        return {
+            "content": response_message.content,
+            "tool_calls": [
+                {"id": tool_call.id, "name": tool_call.function.name, "arguments": tool_call.function.arguments}
+                for tool_call in response_message.tool_calls or []
+            ]
+        }
+
+    def _append_tool_results(self, formatted_messages: List[Dict[str, Any]], turn: Dict[str, Any],
+                             function_responses: List[Any]) -> None:
+        """Add the assistant turn with its tool calls, followed by one tool message per call, to the conversation"""
+        formatted_messages.append({
+            "role": "assistant",
+            "content": turn["content"],
+            "tool_calls": [
+                {"id": call["id"], "type": "function", "function": {"name": call["name"], "arguments": call["arguments"]}}
+                for call in turn["tool_calls"]
+            ]
+        })
+        for call, function_response in zip(turn["tool_calls"], function_responses):
+            formatted_messages.append({
+                "role": "tool",
+                "content": json.dumps(function_response, default=str),
+                "tool_call_id": call["id"]
+            })
+
+    def generate_response(self, prompt: str, messages: List[ChatMessage], model: str = "llama-3.3-70b-versatile",
+                          temperature: float = 0.2, top_p: float = 0.95, top_k: int = 30) -> Dict[str, Any]:
+        """
+        Generate a response using Groq API. The model can chain several rounds of tool calls (e.g. list_tables,
+        then query_database, then generate_chart) within the agent loop limits.
+        """
+        logger.info(f"Generating response with model: {model}, temperature: {temperature}, top_p: {top_p}, top_k: {top_k}")
+        formatted_messages = self._format_messages(prompt, messages)
+
+        def call_model(allow_tools: bool) -> Dict[str, Any]:
             response = self.client.chat.completions.create(
-                model=model,
-                messages=formatted_messages,
-                tools=self.tools,
-                tool_choice="auto",
-                max_tokens=1024,
-                temperature=temperature,
-                top_p=top_p
+                **self._completion_kwargs(model, formatted_messages, allow_tools, temperature, top_p)
+            )
+            return self._parse_turn(response.choices[0].message)
+
+        try:
+            return self.run_agent_loop(
+                call_model, lambda turn, results: self._append_tool_results(formatted_messages, turn, results)
             )
             
-            response_message = response.choices[0].message
-            
-            # Check if the model wants to call functions
-            chart_data = None
-            if hasattr(response_message, 'tool_calls') and response_message.tool_calls:
-                # Add the response with tool calls to messages
-                formatted_messages.append({
-                    "role": "assistant",
-                    "content": response_message.content,
-                    "tool_calls": response_message.tool_calls
-                })
-                
-                # Process each tool call
-                for tool_call in response_message.tool_calls:
-                    function_name = tool_call.function.name
-                    function_to_call = self.available_functions.get(function_name)
-                    
-                    if function_to_call:
-                        try:
-                            function_args = json.loads(tool_call.function.arguments)
-                            function_response = function_to_call(**function_args)
-                            
-                            # If this is a chart generation function, save the chart data
-                            if function_name == "generate_chart" and isinstance(function_response, dict) and function_response.get("success"):
-                                chart_data = function_response
-                            
-                            # Add tool response to messages
-                            formatted_messages.append({
-                                "role": "tool",
-                                "content": json.dumps(function_response),
-                                "tool_call_id": tool_call.id
-                            })
-                        except Exception as e:
-                            # If function execution fails, return error
-                            formatted_messages.append({
-                                "role": "tool",
-                                "content": json.dumps({"error": str(e)}),
-                                "tool_call_id": tool_call.id
-                            })
-                
-                # Make a second request with function results
-                final_response = self.client.chat.completions.create(
-                    model=model,
-                    messages=formatted_messages,
-                    max_tokens=1024,
-                    temperature=temperature,
-                    top_p=top_p
-                )
-                
-                response_text = final_response.choices[0].message.content
-            else:
-                # No tool calls, just use the initial response
-                response_text = response_message.content
+        except Exception as e:
+            logger.error(f"Error generating response with Groq: {str(e)}")
             
+            # TODO: Handle specific exceptions if needed. Stop sending the error to the frontend.
             return {
-                "response": response_text,
-                "chart_data": chart_data
+                "response": f"Error with Groq model {model}: {str(e)}",
+                "chart_data": None,
+                "error": True,
             }
-            
+
+    async def agenerate_response(self, prompt: str, messages: List[ChatMessage], model: str = "llama-3.3-70b-versatile",
+                                 temperature: float = 0.2, top_p: float = 0.95, top_k: int = 30) -> Dict[str, Any]:
+        """Generate a response using the async Groq client"""
+        logger.info(f"Generating async response with model: {model}, temperature: {temperature}, top_p: {top_p}, top_k: {top_k}")
+        # The schema catalog may have to introspect the database, which must not block the event loop
+        formatted_messages = await asyncio.to_thread(self._format_messages, prompt, messages)
+
+        async def call_model(allow_tools: bool) -> Dict[str, Any]:
+            response = await self.async_client.chat.completions.create(
+                **self._completion_kwargs(model, formatted_messages, allow_tools, temperature, top_p)
+            )
+            return self._parse_turn(response.choices[0].message)
+
+        try:
+            return await self.arun_agent_loop(
+                call_model, lambda turn, results: self._append_tool_results(formatted_messages, turn, results)
+            )
+
         except Exception as e:
             logger.error(f"Error generating response with Groq: {str(e)}")
-            logger()
-            
-            # TODO: Handle specific exceptions if needed. Stop sending the error to the frontend.
             return {
                 "response": f"Error with Groq model {model}: {str(e)}",
                 "chart_data": None,
+                "error": True,
             }
-    
+
+    def stream_response(self, prompt: str, messages: List[ChatMessage], model: str = "llama-3.3-70b-versatile",
+                        temperature: float = 0.2, top_p: float = 0.95, top_k: int = 30) -> Iterator[Dict[str, Any]]:
+        """Generate a response using Groq API, streaming text deltas and tool events"""
+        logger.info(f"Streaming response with model: {model}, temperature: {temperature}, top_p: {top_p}, top_k: {top_k}")
+        formatted_messages = self._format_messages(prompt, messages)
+
+        def call_model(allow_tools: bool):
+            stream = self.client.chat.completions.create(
+                **self._completion_kwargs(model, formatted_messages, allow_tools, temperature, top_p), stream=True
+            )
+
+            content = ""
+            # Tool calls arrive in pieces (name first, then the arguments), indexed by their position
+            tool_calls: Dict[int, Dict[str, Any]] = {}
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if delta.content:
+                    content += delta.content
+                    yield {"type": "delta", "text": delta.content}
+                for tool_call_delta in delta.tool_calls or []:
+                    tool_call = tool_calls.setdefault(tool_call_delta.index, {"id": None, "name": "", "arguments": ""})
+                    if tool_call_delta.id:
+                        tool_call["id"] = tool_call_delta.id
+                    if tool_call_delta.function and tool_call_delta.function.name:
+                        tool_call["name"] += tool_call_delta.function.name
+                    if tool_call_delta.function and tool_call_delta.function.arguments:
+                        tool_call["arguments"] += tool_call_delta.function.arguments
+
+            return {"content": content or None, "tool_calls": [tool_calls[index] for index in sorted(tool_calls)]}
+
+        try:
+            yield from self.iter_agent_loop(
+                call_model, lambda turn, results: self._append_tool_results(formatted_messages, turn, results)
+            )
+
+        except Exception as e:
+            logger.error(f"Error streaming response with Groq: {str(e)}")
+            error_text = f"Error with Groq model {model}: {str(e)}"
+            yield {"type": "delta", "text": error_text}
+            yield {"type": "done", "response": error_text, "chart_data": None, "error": True}
+
     def get_available_models(self) -> List[str]:
         """Return available Groq models with descriptions"""
         return self.available_models
\ No newline at end of file
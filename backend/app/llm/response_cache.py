@@ -0,0 +1,251 @@
+"""
+Semantic cache of LLM responses. The same questions are often asked in different sessions with different words
+("bad payer rate by state", "What is the bad payer rate by state?"). Each prompt is turned into a hashed vector of
+its words and word pairs (without accents, punctuation or stopwords). A new question whose cosine similarity with a
+cached question of the same provider/model reaches `RESPONSE_CACHE_THRESHOLD` gets the cached answer and chart,
+without any LLM or database call. The filter values of both questions must be the same, though: numbers (years, top-N
+counts), quoted values, codes such as UFs or social classes and words such as "highest"/"lowest" weigh as much as any
+other word in the vector, so "... in 2023" and "... in 2024" are very similar, but they do not have the same answer.
+
+Only the first question of a conversation is cached, since follow-ups ("and by gender?") depend on the history.
+Entries are dropped when any table changes in this process (see `table_versions`), and expire after
+`RESPONSE_CACHE_TTL_SECONDS` to pick up changes made by other processes.
+"""
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+from dotenv import load_dotenv
+import logging
+
+from backend.app.db.table_versions import get_database_version
+
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler("logs/database_operations.log"),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "500"))  # 0 disables the cache
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600"))
+RESPONSE_CACHE_THRESHOLD = float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.9"))
+
+VECTOR_DIMENSIONS = 2 ** 18
+# English and Portuguese words that do not change the meaning of a data question
+STOPWORDS = {
+    "a", "an", "the", "of", "in", "on", "for", "to", "by", "per", "and", "with", "from", "is", "are", "what", "which",
+    "me", "show", "give", "tell", "please", "can", "you", "i", "want", "list", "get", "does", "how",
+    "o", "os", "as", "um", "uma", "de", "do", "da", "dos", "das", "em", "no", "na", "nos", "nas", "por", "para", "e",
+    "com", "qual", "quais", "mostre", "mostra", "quero", "ver", "favor", "voce", "pode", "como",
+}
+
+# Words that reverse or narrow the answer of an otherwise identical question ("highest" and "lowest" rate, "male" and
+# "female" clients). Like filter values, they must be the same in both questions.
+POLARITY_WORDS = {
+    "highest", "lowest", "higher", "lower", "max", "min", "maximum", "minimum", "most", "least", "more", "less",
+    "fewer", "greater", "smaller", "largest", "top", "bottom", "best", "worst", "first", "last", "above", "below",
+    "over", "under", "before", "after", "including", "excluding", "without", "not", "only", "male", "female", "men",
+    "women", "good", "bad", "asc", "ascending", "desc", "descending", "increase", "decrease",
+    "maior", "menor", "maximo", "minimo", "mais", "menos", "melhor", "pior", "primeiro", "ultimo", "acima", "abaixo",
+    "antes", "depois", "incluindo", "excluindo", "sem", "nao", "apenas", "masculino", "feminino", "homens",
+    "mulheres", "bons", "maus", "crescente", "decrescente",
+}
+# Words after which a single letter is a code, e.g. "class a" (classe_social A to E)
+CODE_PREFIXES = {"class", "classe", "classes", "letter", "letra", "grade", "category", "categoria"}
+
+Vector = Dict[int, float]
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Lowercase a prompt, remove accents and punctuation and collapse whitespace"""
+    text = unicodedata.normalize("NFKD", prompt.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return " ".join(re.findall(r"\w+", text))
+
+
+def literal_tokens(prompt: str) -> FrozenSet[str]:
+    """
+    Get the filter values of a prompt, which must match exactly for a cached answer to be reused: numbers, quoted
+    values, uppercase codes ("SP", and single letters such as the social class "A" but not "I"), two-letter words
+    (lowercase UF codes, "sp"), single letters after "class" and the POLARITY_WORDS, normalized
+    """
+    quoted = re.findall(r"'([^']+)'|\"([^\"]+)\"", prompt)
+    literals = {normalize_prompt(single or double) for single, double in quoted}
+    literals.update(code for code in re.findall(r"\b[A-Z]+\b", unicodedata.normalize("NFKD", prompt)) if code != "I")
+    tokens = normalize_prompt(prompt).split()
+    for i, token in enumerate(tokens):
+        if any(char.isdigit() for char in token) or (len(token) == 2 and token.isalpha() and token not in STOPWORDS):
+            literals.add(token)
+        elif token in POLARITY_WORDS or (len(token) == 1 and i > 0 and tokens[i - 1] in CODE_PREFIXES):
+            literals.add(token)
+    return frozenset(literal.lower() for literal in literals)
+
+
+def _tokens(normalized_prompt: str) -> List[str]:
+    tokens = []
+    for token in normalized_prompt.split():
+        if token in STOPWORDS:
+            continue
+        # Plurals ("states", "clientes") match their singular
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def embed(prompt: str) -> Vector:
+    """
+    Hashed bag of the words and word pairs of a prompt, as a sparse unit vector ({dimension: weight}). Word pairs
+    keep some of the word order, so "rate by state" and "state by rate" are close but not identical.
+    """
+    tokens = _tokens(normalize_prompt(prompt))
+    features = tokens + [f"{first} {second}" for first, second in zip(tokens, tokens[1:])]
+    vector: Vector = {}
+    for feature in features:
+        # crc32 is stable across processes, unlike hash()
+        index = zlib.crc32(feature.encode("utf-8")) % VECTOR_DIMENSIONS
+        vector[index] = vector.get(index, 0.0) + 1.0
+    norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+    return {index: weight / norm for index, weight in vector.items()} if norm else {}
+
+
+def cosine_similarity(first: Vector, second: Vector) -> float:
+    """Cosine similarity of two unit vectors"""
+    if len(first) > len(second):
+        first, second = second, first
+    return sum(weight * second.get(index, 0.0) for index, weight in first.items())
+
+
+class ResponseCache:
+    """
+    LRU cache of responses, looked up by exact normalized prompt first and then by vector similarity within the same
+    provider/model scope. Thread-safe.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, threshold: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.threshold = threshold
+        self._entries: "OrderedDict[Tuple[str, str, str], Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _is_valid(self, entry: Dict[str, Any], database_version: int) -> bool:
+        return entry["database_version"] == database_version and time.monotonic() < entry["expires_at"]
+
+    def get(self, provider: str, model: str, prompt: str) -> Optional[Dict[str, Any]]:
+        """
+        Find the cached response of the same or a similar prompt.
+
+        Returns:
+            Dictionary with the cached "response", "chart_data", the "similarity" of the matched prompt and the
+            "matched_prompt", or None
+        """
+        if self.max_entries <= 0:
+            return None
+        normalized = normalize_prompt(prompt)
+        vector = embed(prompt)
+        literals = literal_tokens(prompt)
+        database_version = get_database_version()
+
+        with self._lock:
+            best_key, best_similarity = None, 0.0
+            exact_key = (provider, model or "", normalized)
+            if exact_key in self._entries and self._is_valid(self._entries[exact_key], database_version):
+                best_key, best_similarity = exact_key, 1.0
+            elif vector:
+                for key, entry in list(self._entries.items()):
+                    if not self._is_valid(entry, database_version):
+                        del self._entries[key]
+                        continue
+                    # Questions with other filter values (another year, state or top-N) have other answers
+                    if key[:2] != exact_key[:2] or entry["literals"] != literals:
+                        continue
+                    similarity = cosine_similarity(vector, entry["vector"])
+                    if similarity > best_similarity:
+                        best_key, best_similarity = key, similarity
+
+            if best_key is None or best_similarity < self.threshold:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._entries.move_to_end(best_key)
+            entry = self._entries[best_key]
+            logger.info(f"Response cache hit for {prompt!r} (similarity {best_similarity:.3f} to {entry['prompt']!r})")
+            return {
+                "response": entry["response"],
+                "chart_data": entry["chart_data"],
+                "similarity": round(best_similarity, 3),
+                "matched_prompt": entry["prompt"]
+            }
+
+    def put(self, provider: str, model: str, prompt: str, response: str, chart_data: Optional[Dict[str, Any]],
+            database_version: Optional[int] = None) -> None:
+        """
+        Cache the response of a prompt, evicting the least recently used entries beyond `max_entries`. Pass the
+        `database_version` read before generating the response, so an answer computed while a table changed is not
+        served after the change.
+        """
+        if self.max_entries <= 0:
+            return
+        entry = {
+            "prompt": prompt,
+            "vector": embed(prompt),
+            "literals": literal_tokens(prompt),
+            "response": response,
+            "chart_data": chart_data,
+            "database_version": get_database_version() if database_version is None else database_version,
+            "expires_at": time.monotonic() + self.ttl_seconds
+        }
+        with self._lock:
+            key = (provider, model or "", normalize_prompt(prompt))
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+
+response_cache = ResponseCache(RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL_SECONDS, RESPONSE_CACHE_THRESHOLD)
+
+
+if __name__ == "__main__":
+    questions = [
+        ("bad payer rate by state", "What is the bad payer rate by state?"),
+        ("bad payer rate by state", "Show me the bad payer rates per state"),
+        ("bad payer rate in SP", "bad payer rate in RJ"),
+        ("taxa de inadimplência por UF", "qual a taxa de inadimplencia por uf?"),
+        ("bad payer rate of clients older than 60 in 2023", "bad payer rate of clients older than 60 in 2024"),
+        ("bad payer rate of social class A clients by state", "bad payer rate of social class E clients by state"),
+        ("which state has the highest bad payer rate", "which state has the lowest bad payer rate"),
+    ]
+    for first_question, second_question in questions:
+        same_literals = literal_tokens(first_question) == literal_tokens(second_question)
+        print(f"{cosine_similarity(embed(first_question), embed(second_question)):.3f}  "
+              f"{'same' if same_literals else 'different'} filter values  {first_question!r} vs {second_question!r}")
@@ -4,15 +4,19 @@ functions to create, retrieve, delete chat sessions and deal with chat messages.
 """
 
 from datetime import datetime
-from backend.app.db.models import ChatSession, ChatMessage
-from typing import Dict, List, Optional
-from sqlalchemy import create_engine, text
+from backend.app.db.models import ChatSession, ChatMessage, ChatSummary
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import text, bindparam
+import base64
+import threading
 import uuid
 import os
 from sqlalchemy.exc import SQLAlchemyError
 import logging
 from dotenv import load_dotenv
 
+from backend.app.db.engine import get_engine
+
 
 logging.basicConfig(
     level=logging.INFO,
@@ -26,7 +30,54 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///app.db")
-engine = create_engine(DATABASE_URL)
+engine = get_engine(DATABASE_URL)
+
+# Databases created before the rolling summaries do not have this table, it is created on first use
+CHAT_SUMMARIES_DDL = """
+    CREATE TABLE IF NOT EXISTS chat_summaries (
+        session_id TEXT PRIMARY KEY,
+        summary TEXT,
+        covered_until TIMESTAMP,
+        covered_until_id INTEGER,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY(session_id) REFERENCES chat_sessions(id)
+    )
+"""
+_summaries_table_engines = set()  # Engines on which chat_summaries is known to exist
+_summaries_table_lock = threading.Lock()
+
+
+def ensure_summaries_table() -> bool:
+    """Create the chat_summaries table if it does not exist yet. Returns False if it could not be created."""
+    with _summaries_table_lock:
+        if engine in _summaries_table_engines:
+            return True
+        try:
+            with engine.connect() as conn:
+                conn.execute(text(CHAT_SUMMARIES_DDL))
+                conn.commit()
+            _summaries_table_engines.add(engine)
+            return True
+        except SQLAlchemyError as e:
+            logger.error(f"Error creating the chat_summaries table: {e}")
+            return False
+
+# Pagination cursors ---------------------------------------------------------------------------------
+def encode_cursor(timestamp: datetime, row_id) -> str:
+    """Encode a (timestamp, id) position as an opaque URL-safe cursor"""
+    raw = f"{timestamp.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """Decode a cursor created by `encode_cursor`. Raises ValueError if the cursor is malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        timestamp, row_id = raw.split("|", 1)
+        return datetime.fromisoformat(timestamp), row_id
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
 
 # Session related functions --------------------------------------------------------------------------
 def create_session(name: Optional[str] = None) -> Optional[ChatSession]:
@@ -51,8 +102,8 @@ def create_session(name: Optional[str] = None) -> Optional[ChatSession]:
         raise ValueError(f"Failed to create session: {e}")
 
 
-def get_session(session_id: str) -> Optional[ChatSession]:
-    """Get a chat session by ID"""
+def get_session(session_id: str, include_messages: bool = True) -> Optional[ChatSession]:
+    """Get a chat session by ID, optionally without loading its messages"""
     try:
         with engine.connect() as conn:
             result = conn.execute(
@@ -64,7 +115,7 @@ def get_session(session_id: str) -> Optional[ChatSession]:
                 logger.warning(f"Session with ID {session_id} not found.")
                 return None
 
-            messages = get_messages(session_id)
+            messages = get_messages(session_id) if include_messages else []
             return ChatSession(
                 id=result[0],
                 name=result[1],
@@ -79,9 +130,16 @@ def get_session(session_id: str) -> Optional[ChatSession]:
 
 def delete_session(session_id: str) -> bool:
     """Delete a chat session and its messages"""
+    # Without the summaries table (it could not be created), there are no summaries to delete
+    has_summaries = ensure_summaries_table()
     try:
         with engine.connect() as conn:
-            # Deleting messages first due to foreign key constraints
+            # Deleting summaries and messages first due to foreign key constraints
+            if has_summaries:
+                conn.execute(
+                    text("DELETE FROM chat_summaries WHERE session_id = :session_id"),
+                    {"session_id": session_id}
+                )
             conn.execute(
                 text("DELETE FROM chat_messages WHERE session_id = :session_id"),
                 {"session_id": session_id}
@@ -98,30 +156,80 @@ def delete_session(session_id: str) -> bool:
         return False
 
 
-def list_sessions() -> List[ChatSession]:
-    """Get all chat sessions"""
+def list_sessions(limit: Optional[int] = None, cursor: Optional[str] = None,
+                  include_messages: bool = False) -> List[ChatSession]:
+    """
+    Get chat sessions ordered by creation date, with a message count and last message date for each one.
+    Summaries are computed in a single aggregate query.
+
+    Args:
+        limit: Maximum number of sessions to return (all of them if not set)
+        cursor: Cursor of the last session of the previous page (see `encode_cursor`)
+        include_messages: Also load every message of the returned sessions (in one extra query)
+    """
+    query = """
+        SELECT s.id, s.name, s.created_at,
+               COUNT(m.session_id) AS message_count, MAX(m.timestamp) AS last_message_at
+        FROM chat_sessions s
+        LEFT JOIN chat_messages m ON m.session_id = s.id
+    """
+    params = {}
+
+    if cursor:
+        cursor_created_at, cursor_id = decode_cursor(cursor)
+        query += " WHERE s.created_at > :cursor_created_at OR (s.created_at = :cursor_created_at AND s.id > :cursor_id)"
+        params.update({"cursor_created_at": cursor_created_at, "cursor_id": cursor_id})
+
+    query += " GROUP BY s.id, s.name, s.created_at ORDER BY s.created_at, s.id"
+    if limit:
+        query += " LIMIT :limit"
+        params["limit"] = limit
+
     try:
         with engine.connect() as conn:
-            result = conn.execute(
-                text("SELECT id, name, created_at FROM chat_sessions")
-            ).fetchall()
-
+            result = conn.execute(text(query), params).fetchall()
             logger.info(f"Found {len(result)} sessions in the database.")
-            sessions = []
-            for row in result:
-                messages = get_messages(row[0])
-                sessions.append(ChatSession(
+
+            sessions = [
+                ChatSession(
                     id=row[0],
                     name=row[1],
                     created_at=row[2],
-                    messages=messages
-                ))
+                    message_count=row[3],
+                    last_message_at=row[4]
+                )
+                for row in result
+            ]
+
+            if include_messages and sessions:
+                messages_by_session = _get_messages_for_sessions(conn, [session.id for session in sessions])
+                for session in sessions:
+                    session.messages = messages_by_session.get(session.id, [])
+
             return sessions
     
     except SQLAlchemyError as e:
         logger.error(f"Error listing sessions: {e}")
         return []
 
+
+def _get_messages_for_sessions(conn, session_ids: List[str]) -> Dict[str, List[ChatMessage]]:
+    """Load the messages of several sessions in one query, grouped by session ID"""
+    result = conn.execute(
+        text(
+            "SELECT session_id, id, role, content, timestamp FROM chat_messages "
+            "WHERE session_id IN :session_ids ORDER BY timestamp, id"
+        ).bindparams(bindparam("session_ids", expanding=True)),
+        {"session_ids": session_ids}
+    ).fetchall()
+
+    messages_by_session: Dict[str, List[ChatMessage]] = {}
+    for row in result:
+        messages_by_session.setdefault(row[0], []).append(
+            ChatMessage(id=row[1], role=row[2], content=row[3], timestamp=row[4])
+        )
+    return messages_by_session
+
 # Message related functions --------------------------------------------------------------------------
 def add_message(session_id: str, role: str, content: str) -> Optional[ChatMessage]:
     """Add a message to a chat session"""
@@ -141,16 +249,96 @@ def add_message(session_id: str, role: str, content: str) -> Optional[ChatMessag
         return None
 
 
-def get_messages(session_id: str) -> List[ChatMessage]:
-    """Get all messages in a chat session"""    
+def get_messages(session_id: str, limit: Optional[int] = None, before: Optional[str] = None,
+                 after: Optional[str] = None) -> List[ChatMessage]:
+    """
+    Get the messages of a chat session in chronological order. Pages are selected with keyset pagination on
+    (timestamp, id), which is served by the chat_messages (session_id, timestamp, id) index.
+
+    Args:
+        session_id: ID of the session
+        limit: Maximum number of messages to return. Without cursors, the most recent messages are returned.
+        before: Cursor of a message; only older messages are returned (the most recent ones first, up to limit)
+        after: Cursor of a message; only newer messages are returned (the oldest ones first, up to limit)
+    """
+    query = "SELECT id, role, content, timestamp FROM chat_messages WHERE session_id = :session_id"
+    params = {"session_id": session_id}
+
+    if before:
+        before_timestamp, before_id = decode_cursor(before)
+        query += " AND (timestamp < :before_timestamp OR (timestamp = :before_timestamp AND id < :before_id))"
+        params.update({"before_timestamp": before_timestamp, "before_id": int(before_id)})
+
+    if after:
+        after_timestamp, after_id = decode_cursor(after)
+        query += " AND (timestamp > :after_timestamp OR (timestamp = :after_timestamp AND id > :after_id))"
+        params.update({"after_timestamp": after_timestamp, "after_id": int(after_id)})
+
+    # A limited window without an "after" cursor is the tail of the conversation, so it is read backwards
+    newest_first = bool(limit) and not after
+    query += " ORDER BY timestamp DESC, id DESC" if newest_first else " ORDER BY timestamp, id"
+    if limit:
+        query += " LIMIT :limit"
+        params["limit"] = limit
+
+    try:
+        with engine.connect() as conn:
+            result = conn.execute(text(query), params).fetchall()
+            messages = [ChatMessage(id=row[0], role=row[1], content=row[2], timestamp=row[3]) for row in result]
+            if newest_first:
+                messages.reverse()
+            return messages
+    
+    except SQLAlchemyError as e:
+        logger.error(f"Error retrieving messages for session {session_id}: {e}")
+        return []
+
+# Summary related functions --------------------------------------------------------------------------
+def get_summary(session_id: str) -> Optional[ChatSummary]:
+    """Get the rolling summary of the older messages of a chat session, if there is one"""
+    if not ensure_summaries_table():
+        return None
     try:
         with engine.connect() as conn:
             result = conn.execute(
-                text("SELECT role, content, timestamp FROM chat_messages WHERE session_id = :session_id ORDER BY timestamp"),
+                text("SELECT summary, covered_until, covered_until_id FROM chat_summaries WHERE session_id = :session_id"),
                 {"session_id": session_id}
-            ).fetchall()
-            return [ChatMessage(role=row[0], content=row[1], timestamp=row[2]) for row in result]
+            ).fetchone()
+
+            if not result:
+                return None
+            return ChatSummary(session_id=session_id, summary=result[0], covered_until=result[1], covered_until_id=result[2])
     
     except SQLAlchemyError as e:
-        logger.error(f"Error retrieving messages for session {session_id}: {e}")
-        return []
\ No newline at end of file
+        logger.error(f"Error retrieving summary for session {session_id}: {e}")
+        return None
+
+
+def save_summary(summary: ChatSummary) -> bool:
+    """Create or replace the rolling summary of a chat session"""
+    if not ensure_summaries_table():
+        return False
+    try:
+        with engine.connect() as conn:
+            conn.execute(
+                text("""
+                    INSERT INTO chat_summaries (session_id, summary, covered_until, covered_until_id, updated_at)
+                    VALUES (:session_id, :summary, :covered_until, :covered_until_id, :updated_at)
+                    ON CONFLICT (session_id) DO UPDATE SET
+                        summary = excluded.summary,
+                        covered_until = excluded.covered_until,
+                        covered_until_id = excluded.covered_until_id,
+                        updated_at = excluded.updated_at
+                """),
+                {
+                    "session_id": summary.session_id, "summary": summary.summary,
+                    "covered_until": summary.covered_until, "covered_until_id": summary.covered_until_id,
+                    "updated_at": datetime.now()
+                }
+            )
+            conn.commit()
+        return True
+    
+    except SQLAlchemyError as e:
+        logger.error(f"Error saving summary for session {summary.session_id}: {e}")
+        return False
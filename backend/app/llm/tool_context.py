@@ -0,0 +1,127 @@
+"""
+Per-request capture of agent tool results. Some providers (like Gemini with automatic function calling) run the
+agent functions internally and only hand back the conversation, so the backend has no direct access to what a tool
+returned. Tools decorated with `record_tool_call` store their return values in the active `ToolInvocationContext`,
+which lets providers reuse them (e.g. chart payloads) without executing the tool a second time.
+
+The context also keeps a list of tool start/end events, which streaming responses forward to the client.
+"""
+import asyncio
+import functools
+import inspect
+import threading
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional
+
+
+_current_context: ContextVar[Optional["ToolInvocationContext"]] = ContextVar("tool_invocation_context", default=None)
+
+
+class ToolInvocationContext:
+    """Records every top-level tool call made while the context is active"""
+
+    def __init__(self, on_event: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self.calls: List[Dict[str, Any]] = []
+        self.events: List[Dict[str, Any]] = []
+        self.on_event = on_event
+        self._local = threading.local()  # Tool nesting depth, tracked per thread so tools can run in parallel
+        self._token = None
+
+    def __enter__(self) -> "ToolInvocationContext":
+        self._token = _current_context.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        _current_context.reset(self._token)
+        self._token = None
+
+    def emit(self, event: Dict[str, Any]) -> None:
+        """Queue a tool event (and forward it to the on_event callback, if any)"""
+        self.events.append(event)
+        if self.on_event:
+            self.on_event(event)
+
+    def drain_events(self) -> List[Dict[str, Any]]:
+        """Return and clear the queued tool events"""
+        events, self.events = self.events, []
+        return events
+
+    def record(self, name: str, args: Dict[str, Any], result: Any) -> None:
+        """Store the result of a tool call"""
+        self.calls.append({"name": name, "args": args, "result": result})
+
+    def call(self, func: Callable, *args, **kwargs) -> Any:
+        """Run a tool, recording its result and start/end events unless it was called from inside another tool"""
+        depth = getattr(self._local, "depth", 0)
+        if depth > 0:
+            return func(*args, **kwargs)
+
+        call_args = dict(inspect.signature(func).bind_partial(*args, **kwargs).arguments)
+        self.emit({"type": "tool_start", "name": func.__name__, "args": call_args})
+
+        self._local.depth = depth + 1
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            self.emit({"type": "tool_end", "name": func.__name__, "success": False})
+            raise
+        finally:
+            self._local.depth = depth
+
+        self.record(func.__name__, call_args, result)
+        success = not (isinstance(result, dict) and result.get("success") is False)
+        self.emit({"type": "tool_end", "name": func.__name__, "success": success})
+        return result
+
+    def bind(self, func: Callable) -> Callable:
+        """
+        Wrap a tool so its calls are recorded in this context even when the context is not active in the calling
+        thread (e.g. generators iterated from a thread pool). The wrapper keeps the tool's name and signature.
+        """
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return self.call(func, *args, **kwargs)
+
+        return wrapper
+
+    def bind_async(self, func: Callable) -> Callable:
+        """
+        Like `bind`, but returns a coroutine function that runs the tool in a worker thread, so async providers can
+        await tools (and their blocking database calls) without stalling the event loop.
+        """
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await asyncio.to_thread(self.call, func, *args, **kwargs)
+
+        return wrapper
+
+    def results(self, name: str) -> List[Any]:
+        """Return the results of every call to the given tool, in execution order"""
+        return [call["result"] for call in self.calls if call["name"] == name]
+
+    def last_result(self, name: str, default: Any = None) -> Any:
+        """Return the result of the most recent call to the given tool"""
+        results = self.results(name)
+        return results[-1] if results else default
+
+
+def get_current_context() -> Optional[ToolInvocationContext]:
+    """Return the tool invocation context active for this request, if any"""
+    return _current_context.get()
+
+
+def record_tool_call(func: Callable) -> Callable:
+    """
+    Decorator for agent functions. When a `ToolInvocationContext` is active, the function's return value is recorded
+    in it. Calls made from inside another tool (e.g. generate_chart running query_database) are not recorded, so the
+    context only reflects what the LLM asked for. The wrapped function keeps its name, signature and docstring, which
+    providers use to build the tool declarations.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        context = _current_context.get()
+        if context is None:
+            return func(*args, **kwargs)
+        return context.call(func, *args, **kwargs)
+
+    return wrapper
@@ -3,21 +3,35 @@ FastAPI backend for Data Science LLM application.
 This module provides endpoints for managing chat sessions, uploading CSV files, and interacting with a Gemini LLM.
 """
 
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Query, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 
+import csv
+import io
+import json
 import logging
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-from typing import List
+from typing import List, Optional, Tuple, Dict, Any
 
 from backend.app.llm.factory import LLMProviderFactory
 import backend.app.llm.session as session_manager
-from backend.app.llm.guardrails import validate_user_prompt, moderate_response, validate_table_access
+from backend.app.llm.context import build_context
+from backend.app.llm.guardrails import validate_user_prompt, moderate_response, validate_table_access, StreamModerator
 
 from backend.app.db.models import (
     ChatSession, ChatMessage, ChatSessionRequest, 
     GenerateRequest
 )
 from backend.app.db.db_functions import add_csv_to_database
+from backend.app.db.ingest_jobs import submit_csv_ingest, get_job
+from backend.app.db.index_advisor import get_workload, propose_indexes, apply_indexes
+from backend.app.db.engine import get_pool_stats, dispose_engines
+from backend.app.llm.agent_functions import query_cache, result_store, format_chart_data
+from backend.app.llm.response_cache import response_cache
+from backend.app.db.table_versions import get_database_version
 
 
 logging.basicConfig(
@@ -32,7 +46,13 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
-app = FastAPI(debug=True, title="Data Science LLM Backend", description="A backend service for interacting with SQL data and LLMs.")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Close pooled database connections when the server shuts down
+    dispose_engines()
+
+app = FastAPI(lifespan=lifespan, debug=True, title="Data Science LLM Backend", description="A backend service for interacting with SQL data and LLMs.")
 
 @app.get("/")
 def read_root():
@@ -63,26 +83,48 @@ def delete_session(session_id: str):
     return {"success": True, "message": "Session deleted"}
 
 @app.get("/sessions", response_model=List[ChatSession])
-def list_sessions():
-    """Get all chat sessions"""
-    return session_manager.list_sessions()
+def list_sessions(response: Response, limit: Optional[int] = Query(None, ge=1, le=1000), cursor: Optional[str] = None,
+                  include_messages: bool = False):
+    """
+    Get chat sessions with their message count and last message date. Messages are only included if requested.
+    When a page is full, the cursor for the next page is returned in the X-Next-Cursor header.
+    """
+    try:
+        sessions = session_manager.list_sessions(limit=limit, cursor=cursor, include_messages=include_messages)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if limit and len(sessions) == limit:
+        last_session = sessions[-1]
+        response.headers["X-Next-Cursor"] = session_manager.encode_cursor(last_session.created_at, last_session.id)
+    return sessions
 
 # Message related endpoints --------------------------------------------------------------------------
 @app.get("/sessions/{session_id}/messages", response_model=List[ChatMessage])
-def get_messages(session_id: str):
-    """Get all messages in a chat session"""
-    session = session_manager.get_session(session_id)
+def get_messages(session_id: str, response: Response, limit: Optional[int] = Query(None, ge=1, le=1000),
+                 before: Optional[str] = None, after: Optional[str] = None):
+    """
+    Get the messages in a chat session (all of them, or a page when limit/before/after are set). The cursors of the
+    first and last returned messages are sent in the X-Before-Cursor and X-After-Cursor headers.
+    """
+    session = session_manager.get_session(session_id, include_messages=False)
 
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    return session.messages
+    try:
+        messages = session_manager.get_messages(session_id, limit=limit, before=before, after=after)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-# Agent related endpoints ----------------------------------------------------------------------------
-@app.post("/generate")
-def generate_response(request: GenerateRequest):
-    """Generate a response using the specified LLM provider"""
+    if messages and messages[0].id is not None:
+        response.headers["X-Before-Cursor"] = session_manager.encode_cursor(messages[0].timestamp, messages[0].id)
+        response.headers["X-After-Cursor"] = session_manager.encode_cursor(messages[-1].timestamp, messages[-1].id)
+    return messages
 
+# Agent related endpoints ----------------------------------------------------------------------------
+def _prepare_generation(request: GenerateRequest) -> Tuple[Any, str]:
+    """Validate a generation request and resolve its provider and session. Raises HTTPException on failure."""
     is_safe = validate_user_prompt(request.prompt)
     if not is_safe:
         logger.warning(f"Blocked unsafe prompt: {request.prompt}")
@@ -100,38 +142,155 @@ def generate_response(request: GenerateRequest):
     if not session_id:
         session = session_manager.create_session()
         session_id = session.id
-    elif not session_manager.get_session(session_id):
+    elif not session_manager.get_session(session_id, include_messages=False):
         raise HTTPException(status_code=404, detail="Session not found")
     
+    return provider, session_id
+
+@app.post("/generate")
+async def generate_response(request: GenerateRequest):
+    """
+    Generate a response using the specified LLM provider. The LLM call is awaited, so no worker thread is held while
+    waiting for the model; the short database operations run in the thread pool.
+    """
+    provider, session_id = await run_in_threadpool(_prepare_generation, request)
+    
     try:
         # Store user message
-        session_manager.add_message(session_id, "user", request.prompt)
-        # Get conversation history for context
-        messages = session_manager.get_messages(session_id)
-
-        result = provider.generate_response(
-            prompt=request.prompt,  # For Gemini, prompt will not be used. The hustory already contains the last user message.
-            messages=messages,
-            model=request.model,
-            temperature=request.temperature,
-            top_p=request.top_p,
-            top_k=request.top_k
-        )
+        await run_in_threadpool(session_manager.add_message, session_id, "user", request.prompt)
+        # Get conversation history for context, fitted to the provider/model token budget
+        messages = await run_in_threadpool(build_context, session_id, request.provider, request.model)
+
+        # Only the first question of a conversation is answered from the response cache, later ones depend on the history
+        cacheable = len(messages) == 1
+        result = response_cache.get(request.provider, request.model, request.prompt) if cacheable else None
+        cached = result is not None
+        if not cached:
+            database_version = get_database_version()
+            result = await provider.agenerate_response(
+                prompt=request.prompt,  # For Gemini, prompt will not be used. The hustory already contains the last user message.
+                messages=messages,
+                model=request.model,
+                temperature=request.temperature,
+                top_p=request.top_p,
+                top_k=request.top_k
+            )
+            if cacheable and not result.get("error"):
+                response_cache.put(request.provider, request.model, request.prompt, result["response"],
+                                   result.get("chart_data"), database_version)
 
         # Store assistant's response
-        session_manager.add_message(session_id, "assistant", result["response"])
+        await run_in_threadpool(session_manager.add_message, session_id, "assistant", result["response"])
 
         moderated_response = moderate_response(result["response"])
 
         return {
             "response": moderated_response,
             "session_id": session_id,
-            "chart_data": result.get("chart_data", None)
+            "chart_data": format_chart_data(result.get("chart_data", None), request.chart_format),
+            "cached": cached
         }
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def _sse_event(event: Dict[str, Any]) -> str:
+    """Format an event as a server-sent event"""
+    return f"event: {event['type']}\ndata: {json.dumps(jsonable_encoder(event))}\n\n"
+
+@app.post("/generate/stream")
+def generate_response_stream(request: GenerateRequest):
+    """
+    Generate a response using the specified LLM provider, streamed as server-sent events: "delta" events carry pieces
+    of the answer, "tool_start"/"tool_end" report tool calls, "chart" carries the chart payload and the final "done"
+    event carries the full (moderated) response and the session ID. Errors are sent as an "error" event.
+    """
+    provider, session_id = _prepare_generation(request)
+
+    # Store user message
+    session_manager.add_message(session_id, "user", request.prompt)
+    # Get conversation history for context, fitted to the provider/model token budget
+    messages = build_context(session_id, request.provider, request.model)
+
+    # Only the first question of a conversation is answered from the response cache, later ones depend on the history
+    cacheable = len(messages) == 1
+    cached = response_cache.get(request.provider, request.model, request.prompt) if cacheable else None
+    database_version = get_database_version()
+
+    def cached_events():
+        yield {"type": "delta", "text": cached["response"]}
+        if cached["chart_data"]:
+            yield {"type": "chart", "chart_data": cached["chart_data"]}
+        yield {"type": "done", "response": cached["response"], "chart_data": cached["chart_data"]}
+
+    def event_stream():
+        response_text = ""
+        streamed_text = ""
+        chart_data = None
+        # Banned terms can be split across deltas, so they are moderated as one text
+        moderator = StreamModerator()
+        try:
+            events = cached_events() if cached else provider.stream_response(
+                prompt=request.prompt,
+                messages=messages,
+                model=request.model,
+                temperature=request.temperature,
+                top_p=request.top_p,
+                top_k=request.top_k
+            )
+            for event in events:
+                if event["type"] == "done":
+                    response_text = event["response"]
+                    chart_data = format_chart_data(event.get("chart_data"), request.chart_format)
+                    if cacheable and not cached and not event.get("error"):
+                        response_cache.put(request.provider, request.model, request.prompt, response_text,
+                                           event.get("chart_data"), database_version)
+                    continue
+                if event["type"] == "chart":
+                    event = dict(event, chart_data=format_chart_data(event["chart_data"], request.chart_format))
+                elif event["type"] == "delta":
+                    streamed_text += event["text"]
+                    text = moderator.feed(event["text"])
+                    if not text:
+                        continue  # Held back until the next delta
+                    event = {"type": "delta", "text": text}
+                yield _sse_event(event)
+
+            text = moderator.flush()
+            if text:
+                yield _sse_event({"type": "delta", "text": text})
+
+            # Store assistant's response
+            session_manager.add_message(session_id, "assistant", response_text)
+
+        except Exception as e:
+            logger.error(f"Error streaming response: {e}")
+            text = moderator.flush()
+            if text:
+                yield _sse_event({"type": "delta", "text": text})
+            yield _sse_event({"type": "error", "message": str(e), "session_id": session_id})
+            # The user message is already stored, the history must not be left without an answer
+            try:
+                session_manager.add_message(
+                    session_id, "assistant", streamed_text or f"Error generating response: {str(e)}"
+                )
+            except Exception as store_error:
+                logger.error(f"Error storing the assistant message: {store_error}")
+            return
+
+        yield _sse_event({
+            "type": "done",
+            "response": moderate_response(response_text),
+            "session_id": session_id,
+            "chart_data": chart_data,
+            "cached": cached is not None
+        })
+
+    return StreamingResponse(
+        event_stream(), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/providers")
 def get_available_providers():
     """Get a list of available LLM providers and models"""
@@ -147,16 +306,91 @@ def get_available_providers():
 
 # Database related endpoints -------------------------------------------------------------------------
 @app.post("/upload_csv")
-async def upload_csv(table_name: str = Form(...), file: UploadFile = File(...)):
-    """Upload a CSV file and create a new table in the database."""
+async def upload_csv(table_name: str = Form(...), file: UploadFile = File(...), background: bool = Form(False)):
+    """
+    Upload a CSV file and create a new table in the database. The upload is streamed from its spooled temporary file
+    in a worker thread, without reading the whole file in memory.
+
+    With background=true, the table is loaded by a background ingestion job: the response carries the job ID right
+    away, and the progress can be polled at /ingest/{job_id}.
+    """
     try:
-        contents = await file.read()
-        result = add_csv_to_database(table_name, contents)
+        if background:
+            job = await run_in_threadpool(submit_csv_ingest, table_name, file.file)
+            return {"success": True, "job_id": job["job_id"], "message": f"Loading table '{table_name}'."}
+
+        result = await run_in_threadpool(add_csv_to_database, table_name, file.file)
         if result.get("success"):
-            return {"success": True, "message": f"Table '{table_name}' created successfully."}
+            return {
+                "success": True,
+                "message": f"Table '{table_name}' created successfully.",
+                "schema": result.get("schema")
+            }
         else:
             return {"success": False, "message": result.get("message", "Unknown error.")}
     
     except Exception as e:
         logger.error(f"Error uploading CSV: {e}")
         return {"success": False, "message": str(e)}
+
+@app.get("/ingest/{job_id}")
+def get_ingest_job(job_id: str):
+    """Get the status of a background CSV ingestion job (rows processed, throughput, errors)"""
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Ingestion job not found")
+    return job
+
+@app.get("/db/pool")
+def get_database_pool_stats():
+    """Get connection pool statistics for the shared database engines"""
+    return get_pool_stats()
+
+
+@app.get("/db/index_advisor")
+def get_index_proposals(min_uses: Optional[int] = Query(None, ge=1)):
+    """Get the column usage of the agent queries and the indexes proposed for the most used columns"""
+    return {"workload": get_workload(), "proposals": propose_indexes(min_uses)}
+
+@app.post("/db/index_advisor/apply")
+def apply_index_proposals(min_uses: Optional[int] = Query(None, ge=1)):
+    """Create the indexes proposed by the index advisor"""
+    results = apply_indexes(propose_indexes(min_uses))
+    return {"indexes": results}
+
+
+@app.get("/db/query_cache")
+def get_query_cache_stats():
+    """Get hit/miss counters and size of the agent query result cache"""
+    return query_cache.stats()
+
+@app.get("/response_cache")
+def get_response_cache_stats():
+    """Get hit/miss counters and size of the semantic response cache"""
+    return response_cache.stats()
+
+
+@app.get("/query_results/{result_handle}")
+def download_query_result(result_handle: str):
+    """Download, as CSV, the full result of a query that was truncated before being sent to the LLM"""
+    result = result_store.get(result_handle)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Query result not found or expired")
+
+    def iter_csv():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(result["columns"])
+        for row in zip(*(result["data"][column] for column in result["columns"])):
+            writer.writerow(row)
+            if buffer.tell() > 64 * 1024:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    return StreamingResponse(
+        iter_csv(),
+        media_type="text/csv",
+        headers={"Content-Disposition": f"attachment; filename=query_result_{result_handle}.csv"}
+    )
@@ -1,3 +1,4 @@
+import json
 import sys
 import os
 
@@ -83,3 +84,578 @@ def test_list_tables():
     tables = list_tables()
     assert isinstance(tables, list)
     assert "test_table" in tables
+
+def test_tool_context_records_top_level_calls():
+    from backend.app.llm.tool_context import ToolInvocationContext
+
+    with ToolInvocationContext() as context:
+        chart = generate_chart(
+            chart_type="line",
+            sql_query="SELECT name, value FROM test_table",
+            title="Recorded Chart",
+            x_column="name",
+            y_column="value"
+        )
+
+    # Only the call made by the LLM is recorded, not the query_database call made inside generate_chart
+    assert [call["name"] for call in context.calls] == ["generate_chart"]
+    assert context.last_result("generate_chart") is chart
+    assert context.last_result("query_database") is None
+
+def test_execute_tool_calls_runs_concurrently_in_order():
+    import time
+    from backend.app.llm.providers.base import LLMProvider
+
+    def slow_echo(value: str, delay: float) -> dict:
+        time.sleep(delay)
+        return {"value": value}
+
+    class EchoProvider(LLMProvider):
+        available_functions = {"slow_echo": slow_echo}
+
+        def generate_response(self, prompt, messages, temperature=0.2, top_p=0.95, top_k=30):
+            return {}
+
+        def get_available_models(self):
+            return []
+
+    provider = EchoProvider()
+    started_at = time.monotonic()
+    results = provider.execute_tool_calls([
+        ("slow_echo", '{"value": "first", "delay": 0.3}'),
+        ("slow_echo", {"value": "second", "delay": 0.1}),
+        ("unknown_tool", "{}"),
+    ])
+    assert time.monotonic() - started_at < 0.5
+    assert results[0] == {"value": "first"}
+    assert results[1] == {"value": "second"}
+    assert "error" in results[2]
+
+    results = provider.execute_tool_calls([("slow_echo", {"value": "late", "delay": 0.5})], timeout=0.1)
+    assert "timed out" in results[0]["error"]
+
+
+def test_tool_timeout_starts_when_the_tool_runs(monkeypatch):
+    import asyncio
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    from sqlalchemy import exc
+    from backend.app.db.engine import get_engine, statement_timeout
+    from backend.app.llm.providers import base
+
+    class EchoProvider(base.LLMProvider):
+        available_functions = {"sleep": lambda delay: time.sleep(delay) or {"slept": delay}}
+
+        def generate_response(self, prompt, messages, temperature=0.2, top_p=0.95, top_k=30):
+            return {}
+
+        def get_available_models(self):
+            return []
+
+    # With one worker, the second call waits 0.3s in the queue, which does not count against its timeout
+    monkeypatch.setattr(base, "_tool_executor", ThreadPoolExecutor(max_workers=1))
+    calls = [("sleep", {"delay": 0.3}), ("sleep", {"delay": 0.3})]
+    assert EchoProvider().execute_tool_calls(calls, timeout=0.5) == [{"slept": 0.3}, {"slept": 0.3}]
+    assert asyncio.run(EchoProvider().aexecute_tool_calls(calls, timeout=0.5)) == [{"slept": 0.3}, {"slept": 0.3}]
+
+    # Slow queries are stopped by the database
+    with get_engine(TEST_DB_URL).connect() as conn, statement_timeout(conn, 0.1):
+        with pytest.raises(exc.OperationalError):
+            conn.execute(text(
+                "WITH RECURSIVE r(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM r) SELECT COUNT(*) FROM r"
+            )).fetchall()
+
+def test_agent_loop_chains_tool_rounds_until_answer():
+    from backend.app.llm.providers.base import LLMProvider
+
+    class ScriptedProvider(LLMProvider):
+        available_functions = {"query_database": query_database, "generate_chart": generate_chart}
+
+        def generate_response(self, prompt, messages, temperature=0.2, top_p=0.95, top_k=30):
+            return {}
+
+        def get_available_models(self):
+            return []
+
+    turns = [
+        {"content": None, "tool_calls": [{"id": "1", "name": "query_database", "arguments": '{"sql_query": "SELECT name FROM test_table"}'}]},
+        {"content": None, "tool_calls": [{"id": "2", "name": "generate_chart", "arguments": {
+            "chart_type": "bar", "sql_query": "SELECT name, value FROM test_table",
+            "title": "Values", "x_column": "name", "y_column": "value"}}]},
+        {"content": "Here is the chart.", "tool_calls": []},
+    ]
+    allow_tools_calls = []
+    tool_results = []
+
+    def call_model(allow_tools):
+        allow_tools_calls.append(allow_tools)
+        return turns[len(allow_tools_calls) - 1]
+
+    provider = ScriptedProvider()
+    result = provider.run_agent_loop(call_model, lambda turn, results: tool_results.append(results))
+    assert result["response"] == "Here is the chart."
+    assert result["chart_data"]["success"] is True
+    assert len(tool_results) == 2 and tool_results[0][0][0]["name"] == "Victor"
+    assert [r["tool_calls"] for r in result["metrics"]["rounds"]] == [["query_database"], ["generate_chart"], []]
+
+    # With a cap of two iterations, the second model call is made without tools to force an answer
+    allow_tools_calls.clear()
+    provider.run_agent_loop(call_model, lambda turn, results: None, max_iterations=2)
+    assert allow_tools_calls == [True, False]
+
+def test_streamed_agent_loop_text_matches_response():
+    import asyncio
+    from backend.app.llm.providers.base import LLMProvider
+
+    class ScriptedProvider(LLMProvider):
+        available_functions = {"query_database": query_database}
+
+        def generate_response(self, prompt, messages, temperature=0.2, top_p=0.95, top_k=30):
+            return {}
+
+        def get_available_models(self):
+            return []
+
+    turns = [
+        {"content": "Let me check.", "tool_calls": [{"id": "1", "name": "query_database", "arguments": {"sql_query": "SELECT name FROM test_table"}}]},
+        {"content": "Victor is the only name.", "tool_calls": []},
+    ]
+
+    def call_model(allow_tools):
+        turn = turns[call_model.count]
+        call_model.count += 1
+        for word in turn["content"].split(" "):
+            yield {"type": "delta", "text": word if word == turn["content"].split(" ")[0] else " " + word}
+        return turn
+
+    call_model.count = 0
+    provider = ScriptedProvider()
+    events = list(provider.iter_agent_loop(call_model, lambda turn, results: None))
+    streamed = "".join(event["text"] for event in events if event["type"] == "delta")
+    assert events[-1]["response"] == streamed == "Let me check.\n\nVictor is the only name."
+
+    # The async loop shares the same logic
+    async def acall_model(allow_tools):
+        turn = turns[acall_model.count]
+        acall_model.count += 1
+        return turn
+
+    acall_model.count = 0
+    result = asyncio.run(provider.arun_agent_loop(acall_model, lambda turn, results: None))
+    assert result["response"] == streamed
+    assert [r["tool_calls"] for r in result["metrics"]["rounds"]] == [["query_database"], []]
+
+
+def test_query_cache_hits_and_table_version_invalidation():
+    import backend.app.llm.agent_functions as agent_functions
+    from backend.app.db.table_versions import bump_table_version
+
+    agent_functions.query_cache.clear()
+    hits, misses = agent_functions.query_cache.hits, agent_functions.query_cache.misses
+
+    first = query_database("SELECT name FROM test_table WHERE name = 'Bob'")
+    # Same query with different whitespace/case is served from the cache, but literals stay case-sensitive
+    second = query_database("select  name\nFROM test_table where name = 'Bob';")
+    other = query_database("SELECT name FROM test_table WHERE name = 'bob'")
+    assert first == second == [{"name": "Bob"}]
+    assert other == []
+    assert agent_functions.query_cache.hits - hits == 1
+    assert agent_functions.query_cache.misses - misses == 2
+
+    # Replacing the table invalidates every cached result that reads it
+    bump_table_version("test_table")
+    assert query_database("SELECT name FROM test_table WHERE name = 'Bob'") == [{"name": "Bob"}]
+    assert agent_functions.query_cache.hits - hits == 1
+    assert agent_functions.query_cache.stats()["entries"] == 2
+
+
+def test_query_database_truncates_large_results(monkeypatch):
+    import backend.app.llm.agent_functions as agent_functions
+
+    monkeypatch.setattr(agent_functions, "QUERY_MAX_ROWS", 1)
+    agent_functions.query_cache.clear()
+
+    result = query_database("SELECT name, value FROM test_table ORDER BY id")
+    assert result["truncated"] is True
+    assert result["rows"] == [{"name": "Victor", "value": 10.5}]
+    assert result["total_rows"] == 2
+
+    # The full result stays available by handle, e.g. for charts
+    stored = agent_functions.result_store.get(result["result_handle"])
+    assert stored["row_count"] == 2
+    chart = generate_chart("bar", "", "Values", "name", "value", result_handle=result["result_handle"])
+    assert chart["success"] is True and len(chart["data"]) == 2
+
+    # Beyond RESULT_STORE_MAX_ROWS the rows are counted on the database side
+    monkeypatch.setattr(agent_functions, "RESULT_STORE_MAX_ROWS", 1)
+    result = query_database("SELECT name FROM test_table")
+    assert result["total_rows"] == 2
+    assert agent_functions.result_store.get(result["result_handle"])["row_count"] == 1
+
+
+def test_generate_chart_columnar_format(monkeypatch):
+    import backend.app.llm.agent_functions as agent_functions
+    from decimal import Decimal
+
+    monkeypatch.setattr(agent_functions, "CHART_DATA_FORMAT", "columnar")
+    chart = generate_chart("line", "SELECT name, value FROM test_table ORDER BY id", "Values", "name", "value")
+    assert chart["data_format"] == "columnar"
+    assert chart["columns"] == ["name", "value"]
+    assert chart["data"] == {"name": ["Victor", "Bob"], "value": [10.5, 20.0]}
+
+    # Payloads can be converted to the format requested by the client
+    rows_chart = agent_functions.format_chart_data(chart, "rows")
+    assert rows_chart["data"] == [{"name": "Victor", "value": 10.5}, {"name": "Bob", "value": 20.0}]
+    assert agent_functions.format_chart_data(rows_chart, "columnar")["data"] == chart["data"]
+
+    # Decimal columns are converted to float
+    assert agent_functions._to_columnar(["x"], [(Decimal("1.5"),), (None,)]) == {"x": [1.5, None]}
+
+
+def test_chart_downsampling():
+    from backend.app.llm.downsampling import downsample_chart_data, lttb_indices
+
+    # LTTB keeps the first/last points and the peak of the series
+    x = list(range(1000))
+    y = [0.0] * 1000
+    y[500] = 100.0
+    indices = lttb_indices(x, y, 50)
+    assert len(indices) == 50 and indices[0] == 0 and indices[-1] == 999 and 500 in indices
+
+    line = {"day": [f"2024-01-01T00:{i // 60:02d}:{i % 60:02d}" for i in range(1000)], "total": y}
+    data, report = downsample_chart_data("line", line, "day", ["total"], 100)
+    assert report == {"method": "lttb", "original_points": 1000, "returned_points": 100}
+    assert 100.0 in data["total"] and len(line["day"]) == 1000
+
+    # Nulls are not taken as zeros: the dip to the minimum is kept, and each gap keeps one null point
+    gaps = {"x": list(range(1000)), "total": [None if 200 <= i < 300 else 50.0 for i in range(1000)]}
+    gaps["total"][700] = 10.0
+    data, report = downsample_chart_data("line", gaps, "x", ["total"], 50)
+    assert data["total"].count(None) == 1 and data["x"][data["total"].index(None)] == 200
+    assert 10.0 in data["total"]
+
+    # Bar charts keep the largest categories and group the others
+    bars = {"uf": ["SP", "RJ", "MG", "BA", "PR"], "total": [50, 30, 5, 10, 1]}
+    data, report = downsample_chart_data("bar", bars, "uf", ["total"], 3)
+    assert data == {"uf": ["SP", "RJ", "Other"], "total": [50.0, 30.0, 16.0]}
+    assert report["returned_points"] == 3
+
+    # A real "Other" category is added to the bucket instead of being a second "Other" bar
+    bars_with_other = {"uf": ["SP", "Other", "RJ", "MG", "BA"], "total": [50, 40, 30, 5, 10]}
+    data, report = downsample_chart_data("bar", bars_with_other, "uf", ["total"], 3)
+    assert data == {"uf": ["SP", "RJ", "Other"], "total": [50.0, 30.0, 55.0]}
+
+    # Rates are averaged, not added up, and the aggregation is reported
+    rates = {"uf": ["SP", "RJ", "MG", "BA", "PR"], "total": [50, 30, 5, 10, 1],
+             "taxa_inadimplencia": [0.1, 0.2, 0.3, 0.5, None]}
+    data, report = downsample_chart_data("bar", rates, "uf", ["total", "taxa_inadimplencia"], 3)
+    assert data["uf"] == ["SP", "RJ", "Other"] and data["total"] == [50.0, 30.0, 16.0]
+    assert data["taxa_inadimplencia"] == [0.1, 0.2, pytest.approx(0.4)]
+    assert report["aggregation"] == {"total": "sum", "taxa_inadimplencia": "mean"}
+
+    # Small results are not changed
+    assert downsample_chart_data("bar", bars, "uf", ["total"], 10) == (bars, None)
+
+
+def test_add_csv_to_database_streams_chunks(monkeypatch):
+    import io
+    import backend.app.db.db_functions as db_functions
+
+    monkeypatch.setattr(db_functions, "DATABASE_URL", TEST_DB_URL)
+    monkeypatch.setattr(db_functions, "CSV_CHUNK_ROWS", 2)
+    monkeypatch.setattr(db_functions, "CSV_SAMPLE_BYTES", 16)
+
+    # The sample is valid UTF-8, but a latin1 character further in the file forces a reload with latin1
+    upload = io.BytesIO("uf,total\nSP,1\nRJ,2\nMG,3\nSÃO,4\nBA,5\n".encode("latin1"))
+    result = db_functions.add_csv_to_database("test_ingest", upload)
+    assert result["success"] is True
+    assert not upload.closed
+
+    rows = query_database("SELECT uf, total FROM test_ingest ORDER BY total")
+    assert [row["total"] for row in rows] == [1, 2, 3, 4, 5]
+    assert rows[3]["uf"] == "SÃO"
+
+    # Loading again replaces the table, and plain bytes are still accepted
+    assert db_functions.add_csv_to_database("test_ingest", b"uf,total\nSP,10\n")["success"] is True
+    assert query_database("SELECT total FROM test_ingest") == [{"total": 10}]
+
+
+def test_copy_insert_streams_csv_to_postgres():
+    from types import SimpleNamespace
+    from backend.app.db.db_functions import copy_insert
+
+    copied = {}
+
+    class FakeCursor:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            pass
+
+        def copy_expert(self, sql, file):
+            copied["sql"] = sql
+            copied["data"] = file.read()
+
+    conn = SimpleNamespace(connection=SimpleNamespace(cursor=FakeCursor))
+    table = SimpleNamespace(name='my"table', schema=None)
+    copy_insert(table, conn, ["uf", "total"], iter([("SP", 1), ("R,J", None)]))
+
+    assert copied["sql"] == 'COPY "my""table" ("uf", "total") FROM STDIN WITH (FORMAT csv)'
+    assert copied["data"] == 'SP,1\r\n"R,J",\r\n'
+
+    # COPY is only used with psycopg2, other drivers fall back to executemany
+    from backend.app.db.db_functions import _insert_method
+    def dialect(name, driver):
+        return SimpleNamespace(dialect=SimpleNamespace(name=name, driver=driver))
+    assert _insert_method(dialect("postgresql", "psycopg2")) is copy_insert
+    assert _insert_method(dialect("postgresql", "psycopg")) is None
+    assert _insert_method(dialect("postgresql", "pg8000")) is None
+    assert _insert_method(dialect("sqlite", "pysqlite")) is None
+
+
+def test_add_csv_to_database_infers_narrow_types(monkeypatch):
+    import backend.app.db.db_functions as db_functions
+
+    monkeypatch.setattr(db_functions, "DATABASE_URL", TEST_DB_URL)
+    csv_bytes = (
+        b"ref_date,uf,idade,renda,ativo,nome\n"
+        b"2024-01-01,SP,30,1500.5,True,Ana\n"
+        b"2024-02-01,RJ,,2000.0,False,Bruno\n"
+        b"2024-03-01,SP,45,,True,Carla\n"
+    )
+    result = db_functions.add_csv_to_database("test_schema", csv_bytes)
+    assert result["success"] is True
+    types = {column["name"]: column["type"] for column in result["schema"]}
+    assert types == {"ref_date": "DATE", "uf": "CHAR(2)", "idade": "SMALLINT", "renda": "FLOAT",
+                     "ativo": "BOOLEAN", "nome": "TEXT"}
+    uf = next(column for column in result["schema"] if column["name"] == "uf")
+    assert uf["categories"] == ["RJ", "SP"]
+    assert query_database("SELECT idade FROM test_schema WHERE uf = 'SP' ORDER BY idade") == [{"idade": 30}, {"idade": 45}]
+
+    # Values beyond the sample that do not fit the inferred types make the load fall back to the default types
+    monkeypatch.setattr(db_functions, "CSV_CHUNK_ROWS", 1)
+    result = db_functions.add_csv_to_database("test_schema", b"uf,idade\nSP,30\nSAO,70000\n")
+    assert result["success"] is True and result["rows"] == 2
+    assert {column["name"]: column["type"] for column in result["schema"]} == {"uf": "TEXT", "idade": "BIGINT"}
+
+
+def test_analytics_engine_queries_parquet_snapshots(monkeypatch, tmp_path):
+    pytest.importorskip("duckdb")
+    import backend.app.db.analytics as analytics
+    import backend.app.db.db_functions as db_functions
+    from backend.app.llm.agent_functions import query_cache
+
+    monkeypatch.setattr(analytics, "ANALYTICS_URL", f"duckdb:///{tmp_path}")
+    monkeypatch.setattr(analytics, "_connection", None)
+    monkeypatch.setattr(analytics, "_snapshots", {})
+    monkeypatch.setattr(db_functions, "DATABASE_URL", TEST_DB_URL)
+    monkeypatch.setattr(db_functions, "CSV_CHUNK_ROWS", 2)
+    query_cache.clear()
+
+    result = db_functions.add_csv_to_database("test_analytics", b"uf,total\nSP,1\nSP,3\nRJ,2\n")
+    assert result["success"] is True
+    assert analytics.list_snapshots() == ["test_analytics"]
+    assert len(list((tmp_path / "test_analytics").glob("*.parquet"))) == 2
+
+    # MEDIAN only exists in DuckDB, and JULIANDAY only in SQLite (the query falls back to the database)
+    assert query_database("SELECT uf, MEDIAN(total) AS m FROM test_analytics GROUP BY uf ORDER BY uf") == [
+        {"uf": "RJ", "m": 2.0}, {"uf": "SP", "m": 2.0}
+    ]
+    assert query_database("SELECT JULIANDAY('2024-01-01') AS d FROM test_analytics LIMIT 1") == [{"d": 2460310.5}]
+    assert "test_analytics" in list_tables()
+
+    # A reload replaces the snapshot
+    assert db_functions.add_csv_to_database("test_analytics", b"uf,total\nBA,5\n")["success"] is True
+    assert query_database("SELECT uf, MEDIAN(total) AS m FROM test_analytics GROUP BY uf") == [{"uf": "BA", "m": 5.0}]
+    assert [path.name for path in tmp_path.iterdir()] == ["test_analytics"]
+
+    # The analytics connection cannot read files outside the snapshots, nor be reconfigured
+    with pytest.raises(Exception, match="disabled"):
+        analytics.fetch("SELECT * FROM read_text('/etc/hostname')", 10, 10)
+    with pytest.raises(Exception):
+        analytics.fetch("SET enable_external_access = true", 10, 10)
+    # Only single SELECT statements run, even if the validator is fooled
+    with pytest.raises(ValueError):
+        analytics.fetch("SELECT uf FROM test_analytics WHERE uf = E'\\'' ; DROP VIEW test_analytics; --'", 10, 10)
+    assert analytics.fetch("SELECT COUNT(*) FROM test_analytics -- comment", 0, 10)["total_rows"] == 1
+    # A view dropped from the connection is recreated
+    analytics._connection.execute("DROP VIEW test_analytics")
+    with pytest.raises(Exception, match="Catalog"):
+        analytics.fetch("SELECT uf FROM test_analytics", 10, 10)
+    assert analytics.fetch("SELECT uf FROM test_analytics", 10, 10)["rows"] == [("BA",)]
+    assert analytics.has_snapshots(["test_analytics"]) is True
+    # Stale snapshots are not used
+    monkeypatch.setattr(analytics, "ANALYTICS_SNAPSHOT_MAX_AGE_SECONDS", 0.001)
+    assert analytics.has_snapshots(["test_analytics"]) is False
+
+
+def test_schema_catalog_describes_and_invalidates_tables(monkeypatch):
+    import backend.app.db.db_functions as db_functions
+    from backend.app.db.schema_catalog import get_catalog, render_schema_prompt
+    from backend.app.llm.agent_functions import describe_table
+
+    monkeypatch.setattr(db_functions, "DATABASE_URL", TEST_DB_URL)
+    assert db_functions.add_csv_to_database("test_catalog", b"uf,total\nSP,1\nRJ,2\nSP,3\n")["success"] is True
+
+    description = describe_table("TEST_CATALOG")
+    assert description["table"] == "test_catalog" and description["row_count"] == 3
+    assert description["columns"][0] == {"name": "uf", "type": "CHAR(2)", "nullable": True, "values": ["RJ", "SP"]}
+    assert description["columns"][1]["values"] is None
+    assert "error" in describe_table("missing_table")
+
+    # Cached until the table changes: a direct insert is not seen, an upload is
+    engine = create_engine(TEST_DB_URL)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO test_catalog (uf, total) VALUES ('BA', 4)"))
+    assert describe_table("test_catalog")["row_count"] == 3
+    assert db_functions.add_csv_to_database("test_catalog", b"uf,total\nMG,1\n")["success"] is True
+    assert describe_table("test_catalog")["row_count"] == 1
+    assert "test_catalog" in get_catalog(TEST_DB_URL).table_names()
+
+    prompt = render_schema_prompt(TEST_DB_URL)
+    assert "- test_catalog (1 rows): uf CHAR(2) [MG], total SMALLINT" in prompt
+    assert "more tables" in render_schema_prompt(TEST_DB_URL, max_chars=10)
+
+
+def test_system_prompt_describes_existing_rollups_only():
+    from backend.app.db.schema_catalog import get_catalog
+    from backend.app.llm.prompt_templates import GEMINI_PROMPT_TEMPLATE, build_system_prompt
+
+    engine = create_engine(TEST_DB_URL)
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE IF EXISTS clientes_por_uf"))
+    get_catalog(TEST_DB_URL).clear()
+    prompt = build_system_prompt(GEMINI_PROMPT_TEMPLATE, TEST_DB_URL)
+    assert "clientes_por_uf" not in prompt and "summary tables" not in prompt
+
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE clientes_por_uf (uf TEXT, total_clientes INTEGER)"))
+    get_catalog(TEST_DB_URL).clear()
+    prompt = build_system_prompt(GEMINI_PROMPT_TEMPLATE, TEST_DB_URL)
+    assert "- clientes_por_uf (uf)" in prompt and "clientes_por_mes" not in prompt
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE clientes_por_uf"))
+
+
+def test_guardrails_single_pass_checks(tmp_path):
+    import json
+    from backend.app.llm.guardrails import load_guardrails, moderate_response, validate_user_prompt
+
+    assert validate_user_prompt("Can you HACK into the database?") is False
+    assert validate_user_prompt("What is the bad payer rate by state?") is True
+    assert moderate_response("Your Credit Card and personal data.") == "Your [filtered] and [filtered]."
+    # Text whose lowercase form has another length is matched with IGNORECASE instead
+    assert moderate_response("İ: Offensive") == "İ: [filtered]"
+
+    # SQL keywords are matched as tokens, not substrings
+    assert query_database("SELECT 1; drop table test_table")[0]["code"] == "multiple_statements"
+    assert query_database("SELECT COUNT(*) AS deleted_count FROM test_table") == [{"deleted_count": 2}]
+
+    config_path = tmp_path / "guardrails.json"
+    config_path.write_text(json.dumps({"banned_terms": ["Boleto"], "banned_patterns": ["(?i)cpf[ .:]*[0-9]{3}"]}))
+    engine = load_guardrails(str(config_path))
+    assert engine.moderate("BOLETO for CPF: 123") == "[filtered] for [filtered]"
+    assert engine.is_safe("hack") is True
+    assert engine.validate_sql("SELECT * FROM x WHERE alter_date > 1").valid is True
+    config_path.write_text(json.dumps({"dangerous_sql_keywords": ["PG_DUMP"]}))
+    assert load_guardrails(str(config_path)).validate_sql("SELECT pg_dump FROM x").code == "forbidden_keyword"
+
+    config_path.write_text(json.dumps({"banned_patterns": ["(unclosed"]}))
+    assert load_guardrails(str(config_path)).is_safe("hack") is False  # Invalid config, defaults are used
+
+
+def test_sql_validator_resolves_tables_and_rejects_writes():
+    from backend.app.db.sql_validator import is_single_statement, normalize_sql, validate_sql
+    from backend.app.llm.guardrails import validate_table_access
+
+    validation = validate_sql(
+        "WITH maus AS (SELECT * FROM public.clientes WHERE status = 'drop') "
+        "SELECT m.uf, EXTRACT(YEAR FROM e.created_at) FROM maus m JOIN estados AS e ON e.uf = m.uf, "
+        "(SELECT id FROM vendas) v WHERE m.deleted_at IS NULL -- DELETE in a comment"
+    )
+    assert validation.valid and validation.code is None
+    assert validation.tables == {"clientes", "estados", "vendas"}
+    assert validation.ctes == {"maus"}
+    assert ("e", "estados") in validation.aliases
+    # A CTE named like a table reads the table in its own definition
+    assert validate_sql("WITH t AS (SELECT * FROM secret) SELECT * FROM t").tables == {"secret"}
+    assert validate_table_access("WITH clientes AS (SELECT * FROM secret) SELECT * FROM clientes")[0] is False
+
+    for query, code in [
+        ("", "empty"),
+        ("SELECT 'unclosed", "syntax_error"),
+        ("SELECT 1 -- comment\n; DROP TABLE clientes", "multiple_statements"),
+        ("DELETE FROM clientes", "not_read_only"),
+        ("SELECT * INTO copia FROM clientes", "forbidden_keyword"),
+        ("SELECT * FROM clientes FOR UPDATE", "forbidden_keyword"),
+        ("SELECT pg_sleep(10)", "forbidden_function"),
+        # Quoted identifiers name functions too
+        ("SELECT \"pg_read_file\"('/etc/passwd')", "forbidden_function"),
+        ("SELECT * FROM clientes FOR SHARE", "forbidden_keyword"),
+        ("SELECT * FROM clientes FOR NO KEY UPDATE", "forbidden_keyword"),
+        # Row sources must be tables, never files
+        ("SELECT c.uf, f.content FROM clientes c, read_text('/etc/hostname') f", "forbidden_function"),
+        ("SELECT * FROM '/etc/passwd'", "forbidden_table"),
+        ("SELECT * FROM my_function(1) f", "forbidden_table_function"),
+        # Settings that outlive the query on pooled connections, and locks
+        ("SELECT set_config('search_path', 'other', false)", "forbidden_function"),
+        ("SELECT pg_advisory_lock(1)", "forbidden_function"),
+        # Backslash escapes end strings where the database does, not where a plain '...' string would end
+        ("SELECT uf FROM clientes WHERE uf = E'\\'' ; DROP VIEW clientes; --'", "multiple_statements"),
+        ("SELECT uf FROM clientes WHERE uf = '\\'' ; DROP TABLE clientes; --'", "multiple_statements"),
+    ]:
+        assert validate_sql(query).code == code, query
+
+    assert validate_sql("SELECT * FROM clientes WHERE uf = E'S\\'P' OR uf = 'it''s'").valid
+    assert normalize_sql("SELECT E'A\\'B' FROM T") == "select E'A\\'B' from t"
+    assert is_single_statement("SELECT 'a;b';") and not is_single_statement("SELECT E'\\''; DROP TABLE t; --'")
+    payload = "SELECT uf FROM test_table WHERE uf = E'\\'' ; DROP TABLE test_table; --'"
+    assert query_database(payload)[0]["code"] == "multiple_statements"
+
+    assert validate_sql("SELECT * FROM ONLY public.clientes").tables == {"clientes"}
+    generated = validate_sql("SELECT * FROM generate_series(1, 3) g, clientes")
+    assert generated.valid and generated.tables == {"clientes"} and generated.table_functions == {"generate_series"}
+
+    rejected = query_database("UPDATE test_table SET value = 0")
+    assert rejected == [{"error": rejected[0]["error"], "code": "not_read_only"}]
+    assert "SELECT" in rejected[0]["error"]
+
+
+def test_index_advisor_proposes_and_creates_indexes():
+    import backend.app.llm.agent_functions as agent_functions
+    from backend.app.db import index_advisor
+
+    assert index_advisor.extract_workload(
+        "SELECT c.uf, COUNT(*) FROM clientes AS c JOIN pedidos p ON c.id = p.cliente_id "
+        "WHERE p.status = 'ok' GROUP BY c.uf ORDER BY 2 DESC"
+    ) == [("pedidos", "status", "filter"), ("clientes", "id", "join"), ("pedidos", "cliente_id", "join"),
+          ("clientes", "uf", "group_by")]
+
+    agent_functions.query_cache.clear()
+    for threshold in (1, 5):
+        query_database(f"SELECT name, COUNT(*) FROM test_table WHERE value > {threshold} GROUP BY name")
+    # Answered from the query cache, and still counted
+    query_database("SELECT name, COUNT(*) FROM test_table WHERE value > 5 GROUP BY name")
+
+    proposals = index_advisor.propose_indexes(min_uses=3, url=TEST_DB_URL)
+    proposed = {(proposal["table"], proposal["column"]): proposal for proposal in proposals}
+    assert proposed[("test_table", "value")]["method"] == "btree"
+    assert proposed[("test_table", "value")]["uses"]["filter"] == 3
+    assert ("test_table", "id") not in proposed  # Already indexed as the primary key
+
+    results = index_advisor.apply_indexes([proposed[("test_table", "value")]], url=TEST_DB_URL)
+    assert results[0]["created"] is True
+    remaining = index_advisor.propose_indexes(min_uses=3, url=TEST_DB_URL)
+    assert ("test_table", "value") not in {(proposal["table"], proposal["column"]) for proposal in remaining}
+
+
+def test_index_advisor_reads_rotated_workload_logs(tmp_path):
+    from backend.app.db import index_advisor
+
+    log_path = tmp_path / "query_workload.log"
+    entry = json.dumps({"table": "clientes", "column": "uf", "usage": "filter"})
+    log_path.write_text(entry + "\n")
+    (tmp_path / "query_workload.log.1").write_text(f"{entry}\n{entry}\nnot json\n")
+    assert index_advisor.load_workload_log(str(log_path)) == {("clientes", "uf"): {"filter": 3}}
+    assert index_advisor.workload_logger.handlers[0].maxBytes == index_advisor.INDEX_ADVISOR_LOG_MAX_BYTES
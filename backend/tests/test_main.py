@@ -1,6 +1,7 @@
 import sys
 import os
-from unittest.mock import patch, MagicMock
+import json
+from unittest.mock import patch, MagicMock, AsyncMock
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
 
@@ -62,10 +63,10 @@ def test_upload_csv(mock_add_csv):
 @patch("backend.app.main.session_manager")
 def test_generate_response(mock_session_manager, mock_provider_factory):
     mock_provider = mock_provider_factory.return_value
-    mock_provider.generate_response.return_value = {
+    mock_provider.agenerate_response = AsyncMock(return_value={
         "response": "This is a test response",
         "chart_data": None,
-    }
+    })
 
     mock_session = mock_session_manager.create_session.return_value
     mock_session.id = "fake-session-id"
@@ -129,7 +130,7 @@ def test_agent_function_call_flow(mock_query_database, mock_session_manager, moc
             "chart_data": None,
         }
     
-    mock_provider.generate_response.side_effect = side_effect_generate_response
+    mock_provider.agenerate_response = AsyncMock(side_effect=side_effect_generate_response)
     
     mock_session = mock_session_manager.create_session.return_value
     mock_session.id = "fake-session-id"
@@ -152,4 +153,310 @@ def test_agent_function_call_flow(mock_query_database, mock_session_manager, moc
     assert "I found 2 rows in the database" in response.json()["response"]
     assert "Victor has value 10.5" in response.json()["response"]
     
-    mock_query_database.assert_called_once_with("SELECT * FROM test_table")
\ No newline at end of file
+    mock_query_database.assert_called_once_with("SELECT * FROM test_table")
+
+def test_database_pool_stats():
+    client.get("/sessions")  # Make sure the shared engine was used at least once
+    response = client.get("/db/pool")
+    assert response.status_code == 200
+    stats = response.json()
+    assert len(stats) >= 1
+    for pool_stats in stats.values():
+        assert "pool_class" in pool_stats
+        assert "status" in pool_stats
+
+
+def test_provider_factory_reuses_instances(monkeypatch):
+    from backend.app.llm.factory import LLMProviderFactory
+
+    monkeypatch.setenv("GROQ_API_KEY", "first-key")
+    LLMProviderFactory.invalidate()
+
+    provider = LLMProviderFactory.get_provider("groq")
+    assert provider is not None
+    assert LLMProviderFactory.get_provider("groq") is provider
+    assert "groq" in LLMProviderFactory.get_available_providers()
+
+    # Changing the API key rebuilds the provider, removing it makes the provider unavailable
+    monkeypatch.setenv("GROQ_API_KEY", "second-key")
+    assert LLMProviderFactory.get_provider("groq") is not provider
+
+    monkeypatch.delenv("GROQ_API_KEY")
+    assert LLMProviderFactory.get_provider("groq") is None
+    assert "groq" not in LLMProviderFactory.get_available_providers()
+    LLMProviderFactory.invalidate()
+
+
+def test_list_sessions_summary_and_pagination():
+    created_ids = []
+    for name in ["Page A", "Page B", "Page C"]:
+        created_ids.append(client.post("/sessions", json={"name": name}).json()["id"])
+
+    import backend.app.llm.session as session_manager
+    session_manager.add_message(created_ids[0], "user", "Hello")
+    session_manager.add_message(created_ids[0], "assistant", "Hi!")
+
+    seen = []
+    cursor = None
+    while True:
+        params = {"limit": 2, "include_messages": True}
+        if cursor:
+            params["cursor"] = cursor
+        response = client.get("/sessions", params=params)
+        assert response.status_code == 200
+        seen.extend(response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+
+    sessions_by_id = {session["id"]: session for session in seen}
+    assert len(sessions_by_id) == len(seen)
+    assert set(created_ids) <= set(sessions_by_id)
+    assert sessions_by_id[created_ids[0]]["message_count"] == 2
+    assert [m["content"] for m in sessions_by_id[created_ids[0]]["messages"]] == ["Hello", "Hi!"]
+    assert sessions_by_id[created_ids[1]]["message_count"] == 0
+
+    summary = client.get("/sessions").json()
+    assert all(session["messages"] == [] for session in summary)
+
+    for session_id in created_ids:
+        client.delete(f"/sessions/{session_id}")
+
+
+def test_list_sessions_invalid_cursor():
+    response = client.get("/sessions", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
+
+
+def test_get_messages_keyset_pagination():
+    import backend.app.llm.session as session_manager
+
+    new_id = client.post("/sessions", json={"name": "Long Session"}).json()["id"]
+    for i in range(5):
+        session_manager.add_message(new_id, "user", f"message {i}")
+
+    response = client.get(f"/sessions/{new_id}/messages", params={"limit": 2})
+    assert response.status_code == 200
+    assert [m["content"] for m in response.json()] == ["message 3", "message 4"]
+
+    before = response.headers["X-Before-Cursor"]
+    response = client.get(f"/sessions/{new_id}/messages", params={"limit": 2, "before": before})
+    assert [m["content"] for m in response.json()] == ["message 1", "message 2"]
+
+    after = response.headers["X-After-Cursor"]
+    response = client.get(f"/sessions/{new_id}/messages", params={"after": after})
+    assert [m["content"] for m in response.json()] == ["message 3", "message 4"]
+
+    response = client.get(f"/sessions/{new_id}/messages")
+    assert len(response.json()) == 5
+
+    client.delete(f"/sessions/{new_id}")
+
+
+def test_build_context_summarizes_older_messages(monkeypatch):
+    import backend.app.llm.session as session_manager
+    import backend.app.llm.context as context
+
+    monkeypatch.setitem(context.CONTEXT_POLICIES, "test_provider", {
+        "default": {"max_tokens": 200, "min_recent_messages": 2, "summary_max_tokens": 100}
+    })
+    new_id = client.post("/sessions", json={"name": "Budget Session"}).json()["id"]
+    for i in range(6):
+        session_manager.add_message(new_id, "user" if i % 2 == 0 else "assistant", f"turn {i} " + "x" * 120)
+
+    messages = context.build_context(new_id, "test_provider")
+    assert messages[0].content.startswith(context.SUMMARY_PREFIX)
+    assert "turn 3" in messages[0].content
+    assert messages[-1].content.startswith("turn 5")
+    assert sum(context.estimate_message_tokens(m) for m in messages) <= 200
+
+    # The summary is persisted, so the next call only loads the messages it does not cover
+    summary = session_manager.get_summary(new_id)
+    assert summary is not None
+    assert context.build_context(new_id, "test_provider")[-1].content.startswith("turn 5")
+
+    client.delete(f"/sessions/{new_id}")
+
+
+def test_delete_session_without_summaries_table(monkeypatch, tmp_path):
+    import backend.app.llm.session as session_manager
+    from sqlalchemy import create_engine, inspect, text
+
+    # A database created before chat_summaries existed
+    old_engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with old_engine.connect() as conn:
+        conn.execute(text("CREATE TABLE chat_sessions (id TEXT PRIMARY KEY, name TEXT, created_at TIMESTAMP)"))
+        conn.execute(text(
+            "CREATE TABLE chat_messages (id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT, role TEXT, "
+            "content TEXT, timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+        ))
+        conn.commit()
+    monkeypatch.setattr(session_manager, "engine", old_engine)
+
+    session = session_manager.create_session("Old Session")
+    assert session_manager.get_summary(session.id) is None
+    assert session_manager.delete_session(session.id) is True
+    assert "chat_summaries" in inspect(old_engine).get_table_names()
+
+
+@patch("backend.app.main.build_context")
+@patch("backend.app.main.LLMProviderFactory.get_provider")
+@patch("backend.app.main.session_manager")
+def test_generate_response_stream(mock_session_manager, mock_provider_factory, mock_build_context):
+    mock_provider = mock_provider_factory.return_value
+    chart = {"success": True, "chart_type": "bar", "title": "Chart", "x_column": "a", "y_column": "b", "data": [{"a": 1, "b": 2}]}
+    mock_provider.stream_response.return_value = iter([
+        {"type": "tool_start", "name": "generate_chart", "args": {}},
+        {"type": "tool_end", "name": "generate_chart", "success": True},
+        {"type": "chart", "chart_data": chart},
+        {"type": "delta", "text": "Here is "},
+        {"type": "delta", "text": "your chart."},
+        {"type": "done", "response": "Here is your chart.", "chart_data": chart},
+    ])
+    mock_session_manager.get_session.return_value = MagicMock()
+    mock_build_context.return_value = []
+
+    payload = {
+        "provider": "test_provider",
+        "prompt": "Plot a chart",
+        "model": "default",
+        "temperature": 0.7,
+        "top_p": 1.0,
+        "top_k": 40,
+        "session_id": "fake-session-id",
+    }
+
+    with client.stream("POST", "/generate/stream", json=payload) as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        body = "".join(response.iter_text())
+
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+
+    assert [name for name, _ in events] == ["tool_start", "tool_end", "chart", "delta", "delta", "done"]
+    assert events[-1][1]["response"] == "Here is your chart."
+    assert events[-1][1]["session_id"] == "fake-session-id"
+    assert events[-1][1]["chart_data"]["title"] == "Chart"
+    mock_session_manager.add_message.assert_called_with("fake-session-id", "assistant", "Here is your chart.")
+
+
+@patch("backend.app.main.build_context")
+@patch("backend.app.main.LLMProviderFactory.get_provider")
+@patch("backend.app.main.session_manager")
+def test_generate_response_stream_moderates_split_terms(mock_session_manager, mock_provider_factory,
+                                                        mock_build_context):
+    def failing_stream(**kwargs):
+        yield {"type": "delta", "text": "Your cre"}
+        yield {"type": "delta", "text": "dit card and a ha"}
+        yield {"type": "delta", "text": "ck."}
+        raise RuntimeError("connection lost")
+
+    mock_provider_factory.return_value.stream_response.side_effect = failing_stream
+    mock_session_manager.get_session.return_value = MagicMock()
+    mock_build_context.return_value = []
+
+    payload = {
+        "provider": "test_provider",
+        "prompt": "Hi",
+        "model": "default",
+        "temperature": 0.7,
+        "top_p": 1.0,
+        "top_k": 40,
+        "session_id": "fake-session-id",
+    }
+    with client.stream("POST", "/generate/stream", json=payload) as response:
+        body = "".join(response.iter_text())
+
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+
+    # Banned terms split across deltas never reach the client, the held back text is sent before the error
+    streamed = "".join(data["text"] for name, data in events if name == "delta")
+    assert streamed == "Your [filtered] and a [filtered]."
+    assert events[-1][0] == "error"
+    # The failed turn still gets an assistant message in the history
+    mock_session_manager.add_message.assert_called_with("fake-session-id", "assistant", "Your credit card and a hack.")
+
+
+def test_upload_csv_background_job(tmp_path):
+    import time
+    import backend.app.db.db_functions as db_functions
+
+    with patch.object(db_functions, "DATABASE_URL", f"sqlite:///{tmp_path / 'ingest.db'}"):
+        files = {"file": ("test.csv", b"col1,col2\n1,a\n2,b\n3,c\n", "text/csv")}
+        response = client.post("/upload_csv", data={"table_name": "ingest_test", "background": "true"}, files=files)
+        assert response.status_code == 200
+        job_id = response.json()["job_id"]
+
+        for _ in range(100):
+            job = client.get(f"/ingest/{job_id}").json()
+            if job["status"] not in ("queued", "running"):
+                break
+            time.sleep(0.05)
+
+    assert job["status"] == "succeeded"
+    assert job["rows_processed"] == 3 and job["progress"] == 1.0
+    assert client.get("/ingest/unknown").status_code == 404
+
+
+@patch("backend.app.main.build_context")
+@patch("backend.app.main.LLMProviderFactory.get_provider")
+@patch("backend.app.main.session_manager")
+def test_generate_response_semantic_cache(mock_session_manager, mock_provider_factory, mock_build_context):
+    from backend.app.llm.response_cache import response_cache
+    from backend.app.db.table_versions import bump_table_version
+
+    response_cache.clear()
+    mock_provider = mock_provider_factory.return_value
+    mock_provider.agenerate_response = AsyncMock(return_value={"response": "SP has the highest rate.", "chart_data": None})
+    mock_session_manager.get_session.return_value = MagicMock()
+    mock_build_context.return_value = [MagicMock(role="user")]
+
+    def generate(prompt):
+        payload = {"provider": "test_provider", "prompt": prompt, "model": "default", "temperature": 0.7,
+                   "top_p": 1.0, "top_k": 40, "session_id": "fake-session-id"}
+        response = client.post("/generate", json=payload)
+        assert response.status_code == 200
+        return response.json()
+
+    assert generate("Bad payer rate by state")["cached"] is False
+    # A rephrased first question is answered from the cache, without calling the provider
+    cached = generate("What is the bad payer rate per state?")
+    assert cached["cached"] is True and cached["response"] == "SP has the highest rate."
+    assert generate("Bad payer rate by gender")["cached"] is False
+    assert mock_provider.agenerate_response.await_count == 2
+
+    # Very similar questions with another filter value are not answered from the cache
+    question = ("Considering only the clients registered in the default dataset, what was the bad payer rate for "
+                "clients older than sixty years grouped by state and gender during 2023, ordered from highest to lowest?")
+    assert generate(question)["cached"] is False
+    assert generate(question.replace("2023", "2024"))["cached"] is False
+    assert generate(question.replace("clients registered", "customers registered"))["cached"] is True
+    assert generate("Bad payer rate in SP")["cached"] is False
+    assert generate("Bad payer rate in RJ")["cached"] is False
+    # Other social classes and opposite superlatives are different questions too
+    assert generate("What is the bad payer rate of social class A clients by state?")["cached"] is False
+    assert generate("What is the bad payer rate of social class E clients by state?")["cached"] is False
+    assert generate("Which state has the highest bad payer rate among clients older than sixty?")["cached"] is False
+    assert generate("Which state has the lowest bad payer rate among clients older than sixty?")["cached"] is False
+    assert generate("Bad payer rate of male clients by state")["cached"] is False
+    assert generate("Bad payer rate of female clients by state")["cached"] is False
+    assert generate("What is the bad payer rate of female clients per state?")["cached"] is True
+    assert mock_provider.agenerate_response.await_count == 12
+
+    # Follow-up questions depend on the history and are not cached
+    mock_build_context.return_value = [MagicMock(role="user"), MagicMock(role="assistant"), MagicMock(role="user")]
+    assert generate("Bad payer rate by state")["cached"] is False
+    mock_build_context.return_value = [MagicMock(role="user")]
+
+    # Table changes invalidate the cached responses, and failed generations are not cached
+    bump_table_version("clientes")
+    mock_provider.agenerate_response.return_value = {"response": "Error", "chart_data": None, "error": True}
+    assert generate("Bad payer rate by state")["cached"] is False
+    assert generate("Bad payer rate by state")["cached"] is False
+    assert mock_provider.agenerate_response.await_count == 15
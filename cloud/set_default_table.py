@@ -3,12 +3,18 @@ This script prepares default data for the database and creates necessary tables.
 is loaded from a CSV file hosted on GitHub, as requested for the challenge.
 """
 import os
+import sys
 import pandas as pd
 from sqlalchemy import create_engine, text
 from sqlalchemy.exc import SQLAlchemyError
 from dotenv import load_dotenv
 import logging
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from backend.app.db import analytics
+from backend.app.db.db_functions import write_dataframe
+
 
 logging.basicConfig(
     level=logging.INFO,
@@ -66,6 +72,83 @@ def prepare_default_data():
     return df[cols]
 
 
+# Pre-aggregated tables for the most common questions on the default dataset. They are rebuilt every time the data is
+# loaded. "{month}" is replaced by the dialect's expression for the month (YYYY-MM) of ref_date.
+AGE_BAND = """
+    CASE
+        WHEN idade IS NULL THEN NULL
+        WHEN idade < 18 THEN '<18'
+        WHEN idade < 25 THEN '18-24'
+        WHEN idade < 35 THEN '25-34'
+        WHEN idade < 45 THEN '35-44'
+        WHEN idade < 55 THEN '45-54'
+        WHEN idade < 65 THEN '55-64'
+        ELSE '65+'
+    END
+"""
+MONTH_EXPRESSIONS = {
+    "postgresql": "TO_CHAR(ref_date, 'YYYY-MM')",
+    "sqlite": "strftime('%Y-%m', ref_date)",
+}
+ROLLUP_DIMENSIONS = {
+    "clientes_por_uf": {"uf": "uf"},
+    "clientes_por_classe_social": {"classe_social": "classe_social"},
+    "clientes_por_sexo": {"sexo": "sexo"},
+    "clientes_por_faixa_etaria": {"faixa_etaria": AGE_BAND},
+    "clientes_por_mes": {"mes": "{month}"},
+    # Every dimension at once, for combined questions (e.g. bad payers by state and social class)
+    "clientes_resumo": {
+        "uf": "uf",
+        "classe_social": "classe_social",
+        "sexo": "sexo",
+        "faixa_etaria": AGE_BAND,
+        "mes": "{month}",
+    },
+}
+
+
+def build_rollup_tables(conn, dialect_name: str) -> None:
+    """
+    (Re)build the rollup tables of the clientes table. Each one has its dimension columns plus total_clientes,
+    maus_pagadores (sum of target), obitos and soma_idade, which can be added up across rows, and the
+    taxa_inadimplencia (bad payer rate) and idade_media of each group.
+    """
+    month = MONTH_EXPRESSIONS.get(dialect_name, MONTH_EXPRESSIONS["postgresql"])
+    for table_name, dimensions in ROLLUP_DIMENSIONS.items():
+        expressions = [expression.format(month=month) for expression in dimensions.values()]
+        select_dimensions = ",\n".join(f"{expression} AS {name}" for name, expression in zip(dimensions, expressions))
+        group_by = ", ".join(str(i) for i in range(1, len(dimensions) + 1))
+
+        conn.execute(text(f"DROP TABLE IF EXISTS {table_name}"))
+        conn.execute(text(f"""
+            CREATE TABLE {table_name} AS
+            SELECT
+                {select_dimensions},
+                COUNT(*) AS total_clientes,
+                SUM(target) AS maus_pagadores,
+                SUM(CASE WHEN flag_obito = 'S' THEN 1 ELSE 0 END) AS obitos,
+                SUM(idade) AS soma_idade,
+                AVG(target * 1.0) AS taxa_inadimplencia,
+                AVG(idade * 1.0) AS idade_media
+            FROM clientes
+            GROUP BY {group_by}
+        """))
+        row_count = conn.execute(text(f"SELECT COUNT(*) FROM {table_name}")).scalar()
+        logger.info(f"Built rollup table {table_name} with {row_count} rows.")
+
+
+def snapshot_tables(conn, table_names, chunk_rows: int = 100000) -> None:
+    """
+    Write the Parquet snapshots of tables for the analytics engine (only when ANALYTICS_URL is set), reading them in
+    chunks of `chunk_rows` rows
+    """
+    if not analytics.is_enabled():
+        return
+    for table_name in table_names:
+        analytics.write_snapshot(table_name, pd.read_sql(text(f"SELECT * FROM {table_name}"), conn, chunksize=chunk_rows))
+        logger.info(f"Wrote analytics snapshot of {table_name}.")
+
+
 def start_database():
     """
     Start the database by creating necessary tables and loading default data.
@@ -102,10 +185,11 @@ def start_database():
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 );
             """))
-            # Create chat_messages table
-            conn.execute(text("""
+            # Create chat_messages table. SQLite has no SERIAL type, the id must be an INTEGER PRIMARY KEY to autoincrement.
+            id_column = "INTEGER PRIMARY KEY AUTOINCREMENT" if engine.dialect.name == "sqlite" else "SERIAL PRIMARY KEY"
+            conn.execute(text(f"""
                 CREATE TABLE IF NOT EXISTS chat_messages (
-                    id SERIAL PRIMARY KEY,
+                    id {id_column},
                     session_id TEXT,
                     role TEXT,
                     content TEXT,
@@ -113,18 +197,33 @@ def start_database():
                     FOREIGN KEY(session_id) REFERENCES chat_sessions(id)
                 );
             """))
+            # Index used to page through the messages of a session
+            conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_chat_messages_session_timestamp
+                ON chat_messages (session_id, timestamp, id);
+            """))
+            # Create chat_summaries table (rolling summary of the messages that no longer fit in the LLM context)
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS chat_summaries (
+                    session_id TEXT PRIMARY KEY,
+                    summary TEXT,
+                    covered_until TIMESTAMP,
+                    covered_until_id INTEGER,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY(session_id) REFERENCES chat_sessions(id)
+                );
+            """))
             conn.commit()
             
-            df.to_sql(
-                name="clientes",
-                con=conn,
-                if_exists="replace",
-                index=False,
-                method="multi",
-                chunksize=200
-            )
+            # Bulk load (COPY on PostgreSQL), the throughput is logged
+            write_dataframe(df, "clientes", conn, if_exists="replace")
             logger.info(f"Successfully loaded {len(df)} records into the 'clientes' table.")
 
+            build_rollup_tables(conn, engine.dialect.name)
+            conn.commit()
+
+            snapshot_tables(conn, ["clientes", *ROLLUP_DIMENSIONS])
+
     except SQLAlchemyError as e:
         logger.error(f"SQLAlchemy error during database operations: {e}")
         logger.info("Exiting without starting the database.")
@@ -140,10 +239,25 @@ def start_database():
             engine.dispose(close=True)
 
 
+def refresh_rollup_tables():
+    """Rebuild the rollup tables from the current clientes table, without reloading the default data"""
+    engine = create_engine(DATABASE_URL)
+    try:
+        with engine.begin() as conn:
+            build_rollup_tables(conn, engine.dialect.name)
+        with engine.connect() as conn:
+            snapshot_tables(conn, ROLLUP_DIMENSIONS)
+    finally:
+        engine.dispose(close=True)
+
+
 if __name__ == "__main__":
     try:
         logger.info(f"Using database URL: {DATABASE_URL}")
-        start_database()
+        if "--refresh-rollups" in sys.argv:
+            refresh_rollup_tables()
+        else:
+            start_database()
 
         # Just a test to see if the database is working with the default dataset
         engine = create_engine(DATABASE_URL)
@@ -1,21 +1,39 @@
+import json
 import requests
 import uuid
-from typing import Dict, Tuple, List, Any, Optional
+from typing import Dict, Tuple, List, Any, Optional, Iterator
 
-def load_sessions(backend_url: str) -> Tuple[List[Dict], bool]:
-    """Load all sessions from the backend."""
+def load_sessions(backend_url: str, include_messages: bool = False, page_size: int = 100) -> Tuple[List[Dict], bool]:
+    """Load all sessions from the backend, page by page, optionally with their messages."""
     try:
-        response = requests.get(f"{backend_url}/sessions")
-        if response.status_code == 200:
-            return response.json(), True
-        return [], False
+        sessions = []
+        cursor = None
+        while True:
+            params = {"limit": page_size, "include_messages": include_messages}
+            if cursor:
+                params["cursor"] = cursor
+
+            response = requests.get(f"{backend_url}/sessions", params=params)
+            if response.status_code != 200:
+                return [], False
+
+            sessions.extend(response.json())
+            cursor = response.headers.get("X-Next-Cursor")
+            if not cursor:
+                return sessions, True
     except Exception as e:
         return [], f"Error loading sessions: {str(e)}"
 
-def load_messages(backend_url: str, session_id: str) -> Tuple[List[Dict], bool]:
-    """Load messages for a specific session."""
+def load_messages(backend_url: str, session_id: str, limit: Optional[int] = None,
+                  before: Optional[str] = None) -> Tuple[List[Dict], bool]:
+    """Load messages for a specific session (the latest `limit` ones, older than the `before` cursor if given)."""
     try:
-        response = requests.get(f"{backend_url}/sessions/{session_id}/messages")
+        params = {}
+        if limit:
+            params["limit"] = limit
+        if before:
+            params["before"] = before
+        response = requests.get(f"{backend_url}/sessions/{session_id}/messages", params=params)
         if response.status_code == 200:
             return response.json(), True
         return [], False
@@ -50,7 +68,8 @@ def send_message(
                 "temperature": temperature,
                 "top_p": top_p,
                 "top_k": top_k,
-                "session_id": session_id
+                "session_id": session_id,
+                "chart_format": "columnar"
             }
         )
         if response.status_code == 200:
@@ -59,11 +78,51 @@ def send_message(
     except Exception as e:
         return None, f"Error connecting to backend: {str(e)}"
 
-def upload_csv(backend_url: str, file_content, file_name: str, table_name: str) -> Tuple[Dict, bool]:
-    """Upload a CSV file to the backend."""
+def stream_message(
+    backend_url: str, prompt: str, session_id: str, provider: str = "gemini", model: Optional[str] = None,
+    temperature: float = 0.2, top_p: float = 0.95, top_k: int = 30
+) -> Iterator[Dict]:
+    """
+    Send a message to the backend and stream the response. Yields the server-sent events as dictionaries with a
+    "type" key (delta, tool_start, tool_end, chart, done or error).
+    """
+    try:
+        with requests.post(
+            f"{backend_url}/generate/stream",
+            json={
+                "prompt": prompt,
+                "provider": provider,
+                "model": model,
+                "temperature": temperature,
+                "top_p": top_p,
+                "top_k": top_k,
+                "session_id": session_id,
+                "chart_format": "columnar"
+            },
+            stream=True
+        ) as response:
+            if response.status_code != 200:
+                yield {"type": "error", "message": f"Error: {response.status_code} - {response.text}"}
+                return
+
+            data_lines = []
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("data:"):
+                    data_lines.append(line[len("data:"):].strip())
+                elif not line and data_lines:
+                    # A blank line ends the event
+                    yield json.loads("\n".join(data_lines))
+                    data_lines = []
+            if data_lines:
+                yield json.loads("\n".join(data_lines))
+    except Exception as e:
+        yield {"type": "error", "message": f"Error connecting to backend: {str(e)}"}
+
+def upload_csv(backend_url: str, file_content, file_name: str, table_name: str, background: bool = False) -> Tuple[Dict, bool]:
+    """Upload a CSV file to the backend. With background=True, the response carries the job_id of the ingestion."""
     try:
         files = {"file": (file_name, file_content)}
-        data = {"table_name": table_name}
+        data = {"table_name": table_name, "background": str(background).lower()}
         response = requests.post(
             f"{backend_url}/upload_csv",
             files=files,
@@ -75,6 +134,16 @@ def upload_csv(backend_url: str, file_content, file_name: str, table_name: str)
     except Exception as e:
         return None, f"Error uploading CSV: {str(e)}"
 
+def get_ingest_job(backend_url: str, job_id: str) -> Tuple[Dict, bool]:
+    """Get the status of a background CSV ingestion job."""
+    try:
+        response = requests.get(f"{backend_url}/ingest/{job_id}")
+        if response.status_code == 200:
+            return response.json(), True
+        return None, f"Error: {response.status_code} - {response.text}"
+    except Exception as e:
+        return None, f"Error getting ingestion job: {str(e)}"
+
 def get_available_providers(backend_url: str) -> Tuple[Dict, bool]:
     """Get available LLM providers and their models from the backend."""
     try:
@@ -1,5 +1,5 @@
 import streamlit as st
-from modules.api import load_sessions, load_messages
+from modules.api import load_sessions
 
 import streamlit as st
 
@@ -54,8 +54,8 @@ def start_chatting() -> None:
 def load_sessions_from_backend(backend_url: str) -> bool:
     """Load all sessions and their messages from the backend."""
     try:
-        # Get all sessions
-        sessions, success = load_sessions(backend_url)
+        # Get all sessions with their messages (one request per page instead of one per session)
+        sessions, success = load_sessions(backend_url, include_messages=True)
         
         if success:
             for session in sessions:
@@ -64,20 +64,17 @@ def load_sessions_from_backend(backend_url: str) -> bool:
                 if session_id in st.session_state.chat_sessions:
                     continue
                 
-                messages, msg_success = load_messages(backend_url, session_id)
+                # Convert to the format used in frontend
+                frontend_messages = [
+                    {"role": msg["role"], "content": msg["content"]} 
+                    for msg in session.get("messages", [])
+                ]
                 
-                if msg_success:
-                    # Convert to the format used in frontend
-                    frontend_messages = [
-                        {"role": msg["role"], "content": msg["content"]} 
-                        for msg in messages
-                    ]
-                    
-                    st.session_state.chat_sessions[session_id] = frontend_messages
-                    st.session_state.session_names[session_id] = session.get("name", f"Chat {session_id[:6]}")
-                    
-                    if session_id not in st.session_state.chart_history:
-                        st.session_state.chart_history[session_id] = []
+                st.session_state.chat_sessions[session_id] = frontend_messages
+                st.session_state.session_names[session_id] = session.get("name", f"Chat {session_id[:6]}")
+                
+                if session_id not in st.session_state.chart_history:
+                    st.session_state.chart_history[session_id] = []
             
             if st.session_state.current_chat_id is None and st.session_state.chat_sessions:
                 st.session_state.current_chat_id = list(st.session_state.chat_sessions.keys())[0]
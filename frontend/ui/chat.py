@@ -1,7 +1,7 @@
 import streamlit as st
 from ast import literal_eval
 import pandas as pd
-from modules.api import send_message
+from modules.api import stream_message
 
 
 def parse_y_column(y_column):
@@ -102,10 +102,13 @@ def render_chat_area(backend_url: str) -> None:
                             with st.chat_message("user"):
                                 st.markdown(user_input)
                             
-                            # Show assistant response
+                            # Show assistant response as it is streamed
                             with st.chat_message("assistant"):
-                                with st.spinner("Thinking..."):
-                                    result, success = send_message(
+                                tool_status = st.empty()
+                                final_event = {}
+
+                                def response_text_stream():
+                                    for event in stream_message(
                                         backend_url,
                                         user_input,
                                         st.session_state.current_chat_id,
@@ -114,23 +117,34 @@ def render_chat_area(backend_url: str) -> None:
                                         temperature=temperature,
                                         top_p=top_p,
                                         top_k=top_k
-                                    )
-                                    
-                                    if success:
-                                        answer = result["response"]
+                                    ):
+                                        if event["type"] == "delta":
+                                            yield event["text"]
+                                        elif event["type"] == "tool_start":
+                                            tool_status.caption("Looking into the data...")
+                                        elif event["type"] == "tool_end":
+                                            tool_status.empty()
+                                        elif event["type"] in ("done", "error"):
+                                            final_event.update(event)
+
+                                st.write_stream(response_text_stream())
+                                tool_status.empty()
+
+                                if final_event.get("type") == "done":
+                                    answer = final_event["response"]
+                                    chart_data = final_event.get("chart_data")
+
+                                    # Process chart data if available
+                                    if chart_data and chart_data.get("success"):
+                                        session_id = st.session_state.current_chat_id
                                         
-                                        # Process chart data if available
-                                        if "chart_data" in result and result["chart_data"] and result["chart_data"]["success"]:
-                                            session_id = st.session_state.current_chat_id
-                                            
-                                            if session_id not in st.session_state.chart_history:
-                                                st.session_state.chart_history[session_id] = []
-                                            
-                                            st.session_state.chart_history[session_id].append(result["chart_data"])
-                                            st.session_state.current_chart_data = result["chart_data"]
-                                    else:
-                                        answer = str(result) if result else "Error communicating with backend"
-                                    
+                                        if session_id not in st.session_state.chart_history:
+                                            st.session_state.chart_history[session_id] = []
+                                        
+                                        st.session_state.chart_history[session_id].append(chart_data)
+                                        st.session_state.current_chart_data = chart_data
+                                else:
+                                    answer = final_event.get("message", "Error communicating with backend")
                                     st.markdown(answer)
                         
                         # Add assistant response to chat history
@@ -166,6 +180,19 @@ def render_chat_area(backend_url: str) -> None:
                                 elif chart_data["chart_type"] == "scatter":
                                     tab1.scatter_chart(df, x=chart_data["x_column"], y=parse_y_column(chart_data["y_column"]))
 
+                                # Large results are reduced on the backend before being sent
+                                downsampling = chart_data.get("downsampling")
+                                if downsampling:
+                                    # How the "Other" bar combines each column (sum, or mean for rates)
+                                    aggregation = ", ".join(
+                                        f"{column}: {how}" for column, how in downsampling.get("aggregation", {}).items()
+                                    )
+                                    tab1.caption(
+                                        f"Showing {downsampling['returned_points']} of "
+                                        f"{downsampling['original_points']} points ({downsampling['method']}"
+                                        f"{'; Other = ' + aggregation if aggregation else ''})."
+                                    )
+
                                 tab2.dataframe(df, use_container_width=True)
                             
                                 if i < len(session_charts) - 1:
@@ -1,7 +1,8 @@
 import streamlit as st
+import time
 import uuid
 import requests
-from modules.api import create_session, upload_csv, get_available_providers
+from modules.api import create_session, upload_csv, get_ingest_job, get_available_providers
 
 
 def render_sidebar(backend_url: str) -> None:
@@ -83,13 +84,39 @@ def render_sidebar(backend_url: str) -> None:
                     backend_url,
                     uploaded_file.getvalue(),
                     uploaded_file.name,
-                    table_name
+                    table_name,
+                    background=True
                 )
                 
                 if success and result.get("success"):
-                    st.success(result.get("message"))
+                    # The table is loaded by a background job, poll it until it finishes
+                    progress_bar = st.progress(0.0, text="Upload queued...")
+                    while True:
+                        job, job_success = get_ingest_job(backend_url, result["job_id"])
+                        if job_success is not True:
+                            st.error(job_success)
+                            break
+
+                        progress_bar.progress(
+                            job["progress"],
+                            text=f"{job['rows_processed']:,} rows loaded ({job['rows_per_second']:,.0f} rows/s)"
+                        )
+                        if job["status"] == "succeeded":
+                            st.success(job["message"])
+                            if job.get("schema"):
+                                st.caption("Column types")
+                                st.dataframe(
+                                    [{"column": column["name"], "type": column["type"]} for column in job["schema"]],
+                                    hide_index=True,
+                                    use_container_width=True
+                                )
+                            break
+                        if job["status"] == "failed":
+                            st.error(job["error"])
+                            break
+                        time.sleep(0.5)
                 else:
-                    st.error(result.get("message", "Upload failed"))
+                    st.error(result.get("message", "Upload failed") if result else success)
         
         # Load available providers if not already loaded
         if not st.session_state.providers_loaded: